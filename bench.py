@@ -0,0 +1,203 @@
+"""
+Замер памяти на участника.
+
+FSM: прежний формат (MemoryStorage, в данных FSM - копия текстов вопросов блока)
+против текущего (BoundedMemoryStorage, в данных только номер блока, шаг и ответы)
+для участников посреди блока и после его завершения.
+
+Сессии: прежние словари активных блоков и участников стихотворений со строковыми
+ключами и dataclass без слотов (поля - как в poem.py до SessionTable) против
+SessionTable и слотовых TeamPoem/TeamMember, в пересчете на 10 000 участников:
+по tracemalloc и по приросту резидентной памяти (RSS) отдельного процесса.
+
+    python bench.py [--users 10000] [--team-size 10]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List, Optional
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from catalog import load_catalog
+from poem import PoemStatus, TeamMember, TeamPoem
+from sessions import SessionTable
+from storage import BoundedMemoryStorage
+
+QUESTIONS_PATH = "config/questions.json"
+STATE = "BotState:asking"
+FIRST_USER_ID = 700_000_000  # Идентификаторы Telegram не попадают в кэш малых int
+
+
+def _legacy_data(catalog, user_id: int) -> dict:
+    block = catalog[user_id % len(catalog)]
+    return {
+        "chat_id": user_id,
+        "user_id": user_id,
+        "block_questions": list(block.texts),
+        "block_step": 1,
+        "answers": [f"ответ {user_id}"],
+        "quiz_index": block.index,
+    }
+
+
+def _compact_data(catalog, user_id: int) -> dict:
+    block = catalog[user_id % len(catalog)]
+    return {"quiz_index": block.index, "block_step": 1, "answers": [f"ответ {user_id}"]}
+
+
+async def _measure(storage, make_data, catalog, users: int, finish: bool) -> float:
+    """Байт на участника: сессия посреди блока или уже завершенная (state.clear())"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for user_id in range(users):
+        key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+        await storage.set_state(key, STATE)
+        await storage.set_data(key, make_data(catalog, user_id))
+        if finish:
+            await storage.set_state(key, None)
+            await storage.set_data(key, {})
+        # Каждый апдейт читает состояние - MemoryStorage при этом создает записи
+        await storage.get_state(StorageKey(bot_id=1, chat_id=-user_id - 1, user_id=-user_id - 1))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return size / users
+
+
+@dataclass
+class _LegacyMember:
+    user_id: int
+    chat_id: int
+    fio: str
+    username: str
+    order: int
+    has_contributed: bool = False
+    contribution: str = ""
+    skipped: bool = False
+    progress_message_id: Optional[int] = None
+    progress_text: str = ""
+
+
+@dataclass
+class _LegacyPoem:
+    team: str
+    status: PoemStatus = PoemStatus.NOT_STARTED
+    members: List[_LegacyMember] = field(default_factory=list)
+    lines: List[str] = field(default_factory=list)
+    current_member_index: int = 0
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    turn_started_at: Optional[datetime] = None
+    _ready_for_completion: bool = False
+    _row_id: Optional[int] = None
+    _rendered_lines: List[str] = field(default_factory=list)
+    _progress_task: Optional[asyncio.Task] = None
+    _progress_sent_at: float = 0.0
+
+
+def _legacy_sessions(users: int, team_size: int):
+    """Словарь активных блоков "chat_user" -> блок, user_id -> команда и стихотворения команд"""
+    active_blocks, user_to_team, poems = {}, {}, {}
+    for i in range(users):
+        user_id = FIRST_USER_ID + i
+        team = f"Команда {i // team_size}"
+        active_blocks[f"{user_id}_{user_id}"] = 5
+        user_to_team[user_id] = team
+        poem = poems.setdefault(team, _LegacyPoem(team=team))
+        poem.members.append(_LegacyMember(user_id=user_id, chat_id=user_id, fio=f"Участник {i}",
+                                          username="", order=len(poem.members)))
+    return active_blocks, user_to_team, poems
+
+
+def _compact_sessions(users: int, team_size: int):
+    sessions, poems = SessionTable(), {}
+    for i in range(users):
+        user_id = FIRST_USER_ID + i
+        team = f"Команда {i // team_size}"
+        member = TeamMember(user_id=user_id, chat_id=user_id, fio=f"Участник {i}", username="", order=i % team_size)
+        key = (member.chat_id, member.user_id)
+        sessions.set_block(key, 5)
+        sessions.set_team(key, team)
+        poems.setdefault(team, TeamPoem(team=team)).members.append(member)
+    return sessions, poems
+
+
+def _measure_sessions(build, users: int, team_size: int) -> float:
+    """Байт на участника, которые держат сессии и стихотворения"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = build(users, team_size)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del kept
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return size / users
+
+
+def _rss() -> int:
+    # Текущая (не пиковая) резидентная память: второе поле /proc/self/statm, в страницах
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _rss_child(build, users: int, team_size: int, result):
+    before = _rss()
+    kept = build(users, team_size)
+    result.put(_rss() - before)
+    del kept
+
+
+def _measure_rss(build, users: int, team_size: int) -> float:
+    """Прирост RSS на участника в свежем процессе: память, освобожденная прежними замерами, не переиспользуется"""
+    context = multiprocessing.get_context("spawn")
+    result = context.Queue()
+    process = context.Process(target=_rss_child, args=(build, users, team_size, result))
+    process.start()
+    size = result.get()
+    process.join()
+    return size / users
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--team-size", type=int, default=10)
+    args = parser.parse_args()
+
+    catalog = load_catalog(QUESTIONS_PATH)
+    print(f"Участников: {args.users}, блоков в каталоге: {len(catalog)}")
+    print(f"{'':32}{'в блоке':>12}{'завершили':>12}")
+    rows = [
+        ("MemoryStorage + тексты вопросов", MemoryStorage, _legacy_data),
+        ("BoundedMemoryStorage + номер блока", BoundedMemoryStorage, _compact_data),
+    ]
+    for title, storage_cls, make_data in rows:
+        active = await _measure(storage_cls(), make_data, catalog, args.users, finish=False)
+        finished = await _measure(storage_cls(), make_data, catalog, args.users, finish=True)
+        print(f"{title:32}{active:>10.0f} Б{finished:>10.0f} Б")
+
+    print(f"\nСессии и стихотворения (команды по {args.team_size})")
+    print(f"{'':32}{'на участника':>14}{'на 10 000':>12}{'RSS на 10 000':>16}")
+    rows = [
+        ("словари + dataclass", _legacy_sessions),
+        ("SessionTable + слоты", _compact_sessions),
+    ]
+    for title, build in rows:
+        per_user = _measure_sessions(build, args.users, args.team_size)
+        rss = _measure_rss(build, args.users, args.team_size)
+        print(f"{title:32}{per_user:>12.0f} Б{per_user * 10000 / 2 ** 20:>9.1f} МБ{rss * 10000 / 2 ** 20:>13.1f} МБ")
+
+    # ru_maxrss в Linux - в килобайтах
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"\nПиковая резидентная память процесса: {peak:.1f} МБ")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import logging
+import sqlite3
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from typing import Dict, Mapping, Optional, Tuple
+
+logger = logging.getLogger("bot.catalog")
+
+BLOCK_KINDS = ("quiz", "poem")
+QUESTION_KINDS = ("text", "photo")
+DEFAULT_FINISH_TIME = time(16, 30)  # Автозавершение игры, если в каталоге не задано finish_time
+
+
+# ==================== МОДЕЛЬ КАТАЛОГА ====================
+
+@dataclass(frozen=True)
+class Question:
+    """Вопрос блока. column - номер колонки answer_N в таблице answers, закрепленный за qid"""
+    qid: str
+    text: str
+    kind: str
+    column: int
+
+
+@dataclass(frozen=True)
+class Block:
+    """Блок вопросов"""
+    index: int
+    title: str
+    kind: str
+    questions: Tuple[Question, ...]
+    start: Optional[time]
+
+    @property
+    def texts(self) -> Tuple[str, ...]:
+        return tuple(q.text for q in self.questions)
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+
+@dataclass(frozen=True)
+class Catalog:
+    """Неизменяемый скомпилированный каталог вопросов мероприятия"""
+    blocks: Tuple[Block, ...]
+    event_date: Optional[date]
+    total_questions: int
+    version: str
+    poem_index: Optional[int] = None  # Индекс блока командного стихотворения
+    finish: time = DEFAULT_FINISH_TIME  # Время автоматического завершения игры
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def __getitem__(self, index: int) -> Block:
+        return self.blocks[index]
+
+    @property
+    def questions(self) -> Tuple[Question, ...]:
+        """Все вопросы каталога по порядку блоков"""
+        return tuple(q for block in self.blocks for q in block.questions)
+
+    def event_day(self, today: Optional[date] = None) -> date:
+        """Дата мероприятия; если она не задана - `today` (по умолчанию текущая дата)"""
+        return self.event_date or today or date.today()
+
+    def block_time(self, index: int, today: Optional[date] = None) -> Optional[datetime]:
+        """Время открытия блока (None - блок без расписания)"""
+        start = self.blocks[index].start
+        if start is None:
+            return None
+        return datetime.combine(self.event_day(today), start)
+
+    def finish_time(self, today: Optional[date] = None) -> datetime:
+        """Время автоматического завершения игры"""
+        return datetime.combine(self.event_day(today), self.finish)
+
+
+# ==================== КОМПИЛЯЦИЯ ====================
+
+def _parse_time(value: Optional[str], where: str) -> Optional[time]:
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, "%H:%M").time()
+    except (TypeError, ValueError):
+        raise ValueError(f"{where}: некорректное время '{value}', ожидается ЧЧ:ММ")
+
+
+def _default_qid(text: str) -> str:
+    # Без явного id вопрос узнается по тексту: перестановка вопросов и блоков не меняет его колонку
+    return "q" + hashlib.sha1(text.encode()).hexdigest()[:10]
+
+
+def compile_catalog(raw: dict, columns: Optional[Mapping[str, int]] = None) -> Catalog:
+    """
+    Проверяет описание каталога и собирает из него неизменяемый Catalog.
+
+    columns - уже закрепленные колонки ответов (qid -> N в answer_N): вопрос
+    сохраняет свою колонку при любом порядке в каталоге, новый вопрос получает
+    следующую свободную. Колонки удаленных вопросов не переиспользуются.
+    """
+    columns = dict(columns or {})
+    next_column = max(columns.values(), default=0) + 1
+
+    raw_blocks = raw.get("blocks")
+    if not raw_blocks:
+        raise ValueError("В каталоге нет блоков")
+
+    event_date = raw.get("event_date")
+    if event_date is not None:
+        try:
+            event_date = date.fromisoformat(event_date)
+        except (TypeError, ValueError):
+            raise ValueError(f"Некорректная дата мероприятия '{event_date}', ожидается ГГГГ-ММ-ДД")
+
+    blocks = []
+    seen: Dict[str, str] = {}
+    for b_idx, raw_block in enumerate(raw_blocks):
+        where = f"Блок #{b_idx}"
+        kind = raw_block.get("kind", "quiz")
+        if kind not in BLOCK_KINDS:
+            raise ValueError(f"{where}: неизвестный тип блока '{kind}'")
+
+        raw_questions = raw_block.get("questions")
+        if not raw_questions:
+            raise ValueError(f"{where}: нет вопросов")
+
+        block_questions = []
+        for q_idx, raw_question in enumerate(raw_questions):
+            if isinstance(raw_question, str):
+                raw_question = {"text": raw_question}
+            text = raw_question.get("text")
+            if not text:
+                raise ValueError(f"{where}, вопрос #{q_idx}: пустой текст")
+            q_kind = raw_question.get("kind", "text")
+            if q_kind not in QUESTION_KINDS:
+                raise ValueError(f"{where}, вопрос #{q_idx}: неизвестный тип вопроса '{q_kind}'")
+            qid = str(raw_question.get("id") or _default_qid(text))
+            if qid in seen:
+                raise ValueError(f"{where}, вопрос #{q_idx}: id '{qid}' уже занят ({seen[qid]}); "
+                                 f"для одинаковых вопросов задайте разные \"id\"")
+            seen[qid] = f"{where}, вопрос #{q_idx}"
+            if qid not in columns:
+                columns[qid] = next_column
+                next_column += 1
+            block_questions.append(Question(
+                qid=qid,
+                text=text,
+                kind=q_kind,
+                column=columns[qid],
+            ))
+
+        blocks.append(Block(
+            index=b_idx,
+            title=raw_block.get("title") or f"Блок №{b_idx + 1}",
+            kind=kind,
+            questions=tuple(block_questions),
+            start=_parse_time(raw_block.get("time"), where),
+        ))
+
+    finish = _parse_time(raw.get("finish_time"), "Время завершения") or DEFAULT_FINISH_TIME
+
+    version = hashlib.sha1(json.dumps(raw, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:8]
+    poem_index = next((block.index for block in blocks if block.kind == "poem"), None)
+    return Catalog(blocks=tuple(blocks), event_date=event_date, total_questions=len(seen),
+                   version=version, poem_index=poem_index, finish=finish)
+
+
+def load_catalog(path: str, columns: Optional[Mapping[str, int]] = None) -> Catalog:
+    with open(path, encoding="utf-8") as f:
+        return compile_catalog(json.load(f), columns)
+
+
+class CatalogStore:
+    """
+    Хранит текущий каталог и позволяет заменить его без перезапуска.
+    Каталог неизменяем, поэтому замена - это атомарная подмена ссылки.
+
+    Колонки ответов закреплены за qid в таблице answer_columns базы мероприятия.
+    В базе, созданной до этой таблицы, ответы лежат по порядку вопросов каталога,
+    поэтому пустая таблица заполняется в том же порядке - старые ответы остаются
+    на своих местах, а дальше порядок вопросов в файле на колонки не влияет.
+    """
+
+    def __init__(self, path: str, conn: sqlite3.Connection):
+        self.path = path
+        self.conn = conn
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS answer_columns (
+                qid TEXT PRIMARY KEY,
+                answer_column INTEGER NOT NULL UNIQUE  -- N в answer_N
+            )
+        """)
+        self.conn.commit()
+        self.catalog = self._load()
+        logger.info(f"Каталог вопросов загружен: {len(self.catalog)} блоков, версия {self.catalog.version}")
+
+    def _load(self) -> Catalog:
+        columns = dict(self.conn.execute("SELECT qid, answer_column FROM answer_columns"))
+        catalog = load_catalog(self.path, columns)
+        added = [(q.qid, q.column) for q in catalog.questions if q.qid not in columns]
+        if added:
+            with self.conn:
+                self.conn.executemany("INSERT INTO answer_columns (qid, answer_column) VALUES (?, ?)", added)
+            logger.info(f"Закреплены колонки ответов для новых вопросов: {len(added)}")
+        return catalog
+
+    def reload(self) -> Catalog:
+        """Перечитать файл. При ошибке текущий каталог остается в силе (ValueError/OSError пробрасываются)"""
+        catalog = self._load()
+        self.catalog = catalog
+        logger.info(f"Каталог вопросов перезагружен: {len(catalog)} блоков, версия {catalog.version}")
+        return catalog
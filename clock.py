@@ -0,0 +1,60 @@
+import asyncio
+import time
+from datetime import date, datetime, timedelta, timezone
+
+
+class Clock:
+    """
+    Часы мероприятия: время суток для расписания блоков и завершения игры,
+    таймауты сессий и ходов стихотворения, отметки last_activity в базе.
+
+    Обычные часы идут в реальном времени. Очереди отправки, снимки базы,
+    фоновые задачи и повторные отправки от часов не зависят - им нужно
+    настоящее время, а не время мероприятия.
+    """
+
+    speed = 1.0  # Секунд часов за одну реальную секунду
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def today(self) -> date:
+        return self.now().date()
+
+    def monotonic(self) -> float:
+        """Монотонные секунды часов - для сроков и интервалов"""
+        return time.monotonic()
+
+    def db_now(self) -> str:
+        """Текущее время в формате CURRENT_TIMESTAMP SQLite (UTC)"""
+        return self.now().astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+    def real(self, seconds: float) -> float:
+        """Интервал часов -> реальные секунды (для asyncio и интервальных задач APScheduler)"""
+        return seconds / self.speed
+
+    def real_moment(self, moment: datetime) -> datetime:
+        """Момент по часам -> реальное время, когда он наступит (для задач APScheduler на дату)"""
+        return datetime.now() + timedelta(seconds=self.real((moment - self.now()).total_seconds()))
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(self.real(seconds))
+
+
+class SimulatedClock(Clock):
+    """
+    Ускоренные часы: от `start` время идет в `speed` раз быстрее реального.
+    При 1000x день мероприятия (с 9:00 до 17:00) проходит меньше чем за 30 секунд
+    вместе с расписанием блоков, напоминаниями, таймаутами и автозавершением.
+    """
+
+    def __init__(self, start: datetime, speed: float = 1000.0):
+        self.start = start
+        self.speed = speed
+        self._origin = time.monotonic()
+
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=self.monotonic())
+
+    def monotonic(self) -> float:
+        return (time.monotonic() - self._origin) * self.speed
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Sequence, Tuple
+
+logger = logging.getLogger("bot.db")
+
+# Настройки соединений. В режиме WAL чтение не блокирует запись и наоборот,
+# поэтому длинные выборки для администратора не задерживают ответы участников
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),  # В WAL при сбое теряется не больше последних транзакций, но не целостность
+    ("busy_timeout", "5000"),   # Ждать блокировку до 5 с вместо немедленной ошибки "database is locked"
+    ("temp_store", "MEMORY"),
+    ("cache_size", "-16000"),   # 16 МБ страничного кэша
+)
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """Соединение для записи: единственное на базу, используется только из event loop"""
+    conn = sqlite3.connect(db_path)
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+class ReadPool:
+    """
+    Пул соединений только для чтения для отчетов, выгрузок и списков администратора.
+
+    Запросы выполняются в отдельном потоке, поэтому длинная выборка не блокирует
+    event loop, а благодаря WAL видит согласованный снимок базы и не мешает записи.
+    Соединения открываются по требованию, но не больше `size`; открывать пул нужно
+    после того, как соединение для записи создало базу и перевело ее в WAL.
+    """
+
+    def __init__(self, db_path: str, size: int = 4):
+        self.uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+        self.size = size
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._opened: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only=1")
+        conn.execute("PRAGMA busy_timeout=5000")
+        self._opened.append(conn)
+        return conn
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                conn = self._open() if len(self._opened) < self.size else None
+            if conn is None:
+                conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def _fetch(self, query: str, params: Sequence) -> Tuple[List[str], List[tuple]]:
+        with self._connection() as conn:
+            cur = conn.execute(query, params)
+            columns = [desc[0] for desc in cur.description]
+            return columns, cur.fetchall()
+
+    async def fetch(self, query: str, params: Sequence = ()) -> Tuple[List[str], List[tuple]]:
+        """Выполнить SELECT в потоке пула. Возвращает имена колонок и строки"""
+        return await asyncio.to_thread(self._fetch, query, params)
+
+    async def fetchall(self, query: str, params: Sequence = ()) -> List[tuple]:
+        return (await self.fetch(query, params))[1]
+
+    def close(self):
+        with self._lock:
+            for conn in self._opened:
+                conn.close()
+            self._opened.clear()
+            self._idle = queue.LifoQueue()
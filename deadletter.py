@@ -0,0 +1,313 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.types import InlineKeyboardMarkup
+
+from db import connect
+
+if TYPE_CHECKING:
+    from outbox import Outbox
+
+logger = logging.getLogger("bot.deadletter")
+
+# Ошибки, при которых повтор бесполезен: бот заблокирован, чат не найден, некорректный запрос.
+# Такие сообщения не повторяются автоматически, но их можно переотправить командой администратора
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramNotFound, TelegramBadRequest)
+
+# Ошибки, которые говорят о недоступности Telegram и учитываются предохранителем
+OUTAGE_ERRORS = (TelegramNetworkError, TelegramServerError, TelegramRetryAfter, asyncio.TimeoutError)
+
+
+class CircuitOpenError(Exception):
+    """Отправка не выполнялась: предохранитель разомкнут"""
+
+
+def chat_unavailable(error: BaseException) -> bool:
+    """Отказ относится к самому чату: бот заблокирован, чат удален или не найден - повтор бесполезен"""
+    return isinstance(error, (TelegramForbiddenError, TelegramNotFound)) or (
+        isinstance(error, TelegramBadRequest) and "chat not found" in str(error).lower()
+    )
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для отправки в Telegram.
+    После `failure_threshold` сбоев подряд размыкается на `reset_timeout` секунд:
+    в это время отправки не выполняются. Затем пропускается одна пробная отправка -
+    при успехе предохранитель замыкается, при сбое снова размыкается.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    @property
+    def probing(self) -> bool:
+        """Идет пробная отправка: allow() только что пропустил ее в полуразомкнутом состоянии"""
+        return self._probing
+
+    def record(self, error: Optional[BaseException] = None):
+        """
+        Итог отправки. Любой ответ Telegram, в том числе отказ (бот заблокирован,
+        некорректный запрос), значит, что связь есть; сбоем считаются только OUTAGE_ERRORS
+        """
+        if isinstance(error, OUTAGE_ERRORS):
+            self.record_failure()
+        elif error is None or isinstance(error, TelegramAPIError):
+            self.record_success()
+
+    def retry_in(self) -> float:
+        """Через сколько секунд разомкнутый предохранитель пропустит пробную отправку (0 - уже можно)"""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def end_probe(self):
+        """Пробная отправка завершилась, чем бы то ни было: следующая попытка снова возможна"""
+        self._probing = False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Связь с Telegram восстановлена, предохранитель замкнут")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.error(f"Telegram недоступен ({self.failures} сбоев подряд), отправка приостановлена")
+            self.opened_at = time.monotonic()
+
+
+def _dump_kwargs(kwargs: Dict[str, Any]) -> str:
+    data = dict(kwargs)
+    markup = data.get("reply_markup")
+    if markup is not None and hasattr(markup, "model_dump"):
+        data["reply_markup"] = markup.model_dump(exclude_none=True)
+    return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def _load_kwargs(raw: str) -> Dict[str, Any]:
+    data = json.loads(raw)
+    markup = data.get("reply_markup")
+    if isinstance(markup, dict) and "inline_keyboard" in markup:
+        data["reply_markup"] = InlineKeyboardMarkup.model_validate(markup)
+    return data
+
+
+class DeadLetterQueue:
+    """
+    Сообщения, которые не удалось отправить.
+    Хранятся в SQLite вместе с классом ошибки; фоновая задача повторяет отправку
+    с экспоненциальной задержкой со случайным разбросом. Повторы ставятся в очередь
+    Outbox, который подключается сам при создании (Outbox(bot, dead_letters=...)), - они
+    соблюдают общий лимит скорости и порядок сообщений в чате. Пока предохранитель
+    разомкнут, повторы не выполняются.
+    """
+
+    def __init__(self, bot: Bot, db_path: str = "dead_letters.db", breaker: Optional[CircuitBreaker] = None,
+                 base_delay: float = 5.0, max_delay: float = 600.0, max_attempts: int = 8,
+                 poll_interval: float = 5.0, batch_size: int = 50):
+        self.bot = bot
+        self.breaker = breaker or CircuitBreaker()
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.outbox: Optional["Outbox"] = None  # Задает attach()
+        self._task: Optional[asyncio.Task] = None
+
+        self.conn = connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                kwargs TEXT NOT NULL DEFAULT '{}',
+                error_class TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'pending', -- pending: ждет повтора, sending: в очереди Outbox, failed: повторы прекращены
+                next_attempt_at REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_dead_letters_due ON dead_letters (status, next_attempt_at)"
+        )
+        # Повторы, которые были в очереди Outbox при остановке бота, снова ждут отправки
+        self.conn.execute("UPDATE dead_letters SET status='pending' WHERE status='sending'")
+        self.conn.commit()
+
+    def _backoff(self, attempts: int) -> float:
+        """Экспоненциальная задержка со случайным разбросом, чтобы повторы не шли одной волной"""
+        delay = min(self.max_delay, self.base_delay * 2 ** attempts)
+        return random.uniform(delay / 2, delay)
+
+    def add(self, chat_id: int, text: str, kwargs: Dict[str, Any], error: BaseException):
+        """Сохранить неотправленное сообщение"""
+        status = "failed" if isinstance(error, PERMANENT_ERRORS) else "pending"
+        delay = self._backoff(0)
+        if isinstance(error, TelegramRetryAfter):
+            delay = max(delay, error.retry_after)
+        self.conn.execute(
+            "INSERT INTO dead_letters (chat_id, text, kwargs, error_class, error, status, next_attempt_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (chat_id, text, _dump_kwargs(kwargs), type(error).__name__, str(error), status, time.time() + delay)
+        )
+        self.conn.commit()
+        logger.warning(f"Сообщение в чат {chat_id} отложено ({type(error).__name__}, статус {status})",
+                       extra={"sample_key": "dead_letter"})
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM dead_letters GROUP BY status"))
+
+    def recent(self, limit: int = 10) -> List[Tuple]:
+        """Последние отложенные сообщения: id, chat_id, error_class, attempts, status, next_attempt_at"""
+        return self.conn.execute(
+            "SELECT id, chat_id, error_class, attempts, status, next_attempt_at "
+            "FROM dead_letters ORDER BY id DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+
+    def replay(self, letter_id: Optional[int] = None) -> int:
+        """Поставить сообщения (одно или все) на немедленный повтор со сбросом счетчика попыток"""
+        query = "UPDATE dead_letters SET status='pending', attempts=0, next_attempt_at=?"
+        params: tuple = (time.time(),)
+        if letter_id is not None:
+            query += " WHERE id=?"
+            params += (letter_id,)
+        updated = self.conn.execute(query, params).rowcount
+        self.conn.commit()
+        return updated
+
+    def attach(self, outbox: "Outbox"):
+        """Подключить очередь исходящих, через которую идут повторы (вызывает Outbox при создании)"""
+        if self.outbox is not None and self.outbox is not outbox:
+            raise ValueError("Очередь dead_letters уже подключена к другому Outbox")
+        self.outbox = outbox
+
+    def _require_outbox(self) -> "Outbox":
+        if self.outbox is None:
+            raise RuntimeError("Повторы невозможны: очередь dead_letters не подключена к Outbox")
+        return self.outbox
+
+    def start(self):
+        self._require_outbox()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def close(self):
+        self.conn.close()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.retry_due()
+            except Exception as e:
+                logger.error(f"Ошибка повторной отправки: {e}", exc_info=True)
+
+    async def retry_due(self) -> int:
+        """
+        Поставить в очередь Outbox сообщения, у которых подошло время повтора.
+        Возвращает их число; итог отправки записывается, когда Outbox ее выполнит
+        """
+        outbox = self._require_outbox()
+        if self.breaker.state == "open":
+            return 0
+        rows = self.conn.execute(
+            "SELECT id, chat_id, text, kwargs, attempts FROM dead_letters "
+            "WHERE status='pending' AND next_attempt_at<=? ORDER BY id LIMIT ?",
+            (time.time(), self.batch_size)
+        ).fetchall()
+        if not rows:
+            return 0
+
+        self.conn.executemany("UPDATE dead_letters SET status='sending' WHERE id=?", [(row[0],) for row in rows])
+        self.conn.commit()
+        for letter_id, chat_id, text, kwargs, attempts in rows:
+            # Повтор не склеивается с соседями и при неудаче не попадает сюда второй раз
+            delivery = outbox.send(chat_id, text, merge=False, dead_letter=False, **_load_kwargs(kwargs))
+            delivery.add_done_callback(
+                lambda future, letter_id=letter_id, attempts=attempts: self._settle(letter_id, attempts, future)
+            )
+        logger.info(f"Повторная отправка: {len(rows)} сообщений в очереди", extra={"sample_key": "dead_letter_retry"})
+        return len(rows)
+
+    def _settle(self, letter_id: int, attempts: int, future: asyncio.Future):
+        """Итог повтора из Outbox: отправлено - удалить, нет - отложить снова"""
+        error = CircuitOpenError("Отправка отменена") if future.cancelled() else future.exception()
+        try:
+            if error is None:
+                self.conn.execute("DELETE FROM dead_letters WHERE id=?", (letter_id,))
+            elif isinstance(error, CircuitOpenError):
+                # Попытки не было - предохранитель разомкнулся, пока повтор ждал очереди
+                self._reschedule(letter_id, attempts, error)
+            else:
+                self._reschedule(letter_id, attempts + 1, error)
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"Не удалось записать итог повтора #{letter_id}: {e}")
+
+    def _reschedule(self, letter_id: int, attempts: int, error: BaseException):
+        # Сбой связи уже учтен предохранителем в Outbox
+        if isinstance(error, PERMANENT_ERRORS) or attempts >= self.max_attempts:
+            status = "failed"
+        else:
+            status = "pending"
+        delay = self._backoff(attempts)
+        if isinstance(error, TelegramRetryAfter):
+            delay = max(delay, error.retry_after)
+
+        self.conn.execute(
+            "UPDATE dead_letters SET attempts=?, status=?, error_class=?, error=?, next_attempt_at=? WHERE id=?",
+            (attempts, status, type(error).__name__, str(error), time.time() + delay, letter_id)
+        )
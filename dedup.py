@@ -0,0 +1,120 @@
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger("bot.dedup")
+
+WINDOW = 1024            # Сколько последних update_id помнит окно
+SAVE_EVERY = 50          # Апдейтов между сохранениями верхней границы...
+SAVE_INTERVAL = 5.0      # ...или секунд
+STALE_AFTER = timedelta(days=7)  # После недели без апдейтов Telegram начинает нумерацию заново
+
+
+class UpdateDeduplicator(BaseMiddleware):
+    """
+    Внешний middleware апдейтов: отбрасывает повторно доставленные апдейты.
+
+    Telegram повторяет апдейт после перезапуска бота (смещение не успели
+    подтвердить) и после неудачного ответа вебхука. Окно - битовая маска
+    последних WINDOW номеров относительно верхней границы (самого большого
+    увиденного update_id): апдейты из разных чатов могут приходить не по
+    порядку, поэтому номер ниже границы отбрасывается, только если он уже
+    был или вышел за окно.
+
+    В базу сохраняется не верхняя граница, а нижняя граница завершенных
+    (low_water): самый большой номер, до которого обработчики всех увиденных
+    апдейтов уже отработали. Апдейт, обработка которого не закончилась к
+    аварийной остановке, Telegram доставит снова, и после перезапуска он
+    будет обработан, а не потерян. Граница сохраняется раз в SAVE_EVERY
+    апдейтов или SAVE_INTERVAL секунд и при остановке. Апдейты выше нее,
+    успевшие завершиться, пройдут повторно - запись ответов и строк
+    стихотворения от этого защищена отдельно.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, bot_id: int):
+        self.conn = conn
+        self.bot_id = bot_id
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS update_offsets (
+                bot_id INTEGER PRIMARY KEY,
+                high_water INTEGER NOT NULL,  -- Все апдейты до этого update_id включительно обработаны
+                saved_at TIMESTAMP NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+        self.high_water = -1
+        self._seen = 0  # Бит i - апдейт high_water - i уже был
+        row = self.conn.execute(
+            "SELECT high_water, saved_at FROM update_offsets WHERE bot_id = ?", (bot_id,)
+        ).fetchone()
+        if row and datetime.now() - datetime.fromisoformat(row[1]) < STALE_AFTER:
+            self.high_water = row[0]
+            self._seen = (1 << WINDOW) - 1
+            logger.info(f"Апдейты до {self.high_water} считаются обработанными")
+
+        self.duplicates = 0
+        self._in_flight: Set[int] = set()  # Апдейты, обработчики которых еще работают
+        self._saved = self.high_water
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def seen(self, update_id: int) -> bool:
+        """Отметить апдейт; True - он уже был"""
+        shift = update_id - self.high_water
+        if shift > 0:
+            self._seen = ((self._seen << shift) | 1) & ((1 << WINDOW) - 1)
+            self.high_water = update_id
+            return False
+        if -shift >= WINDOW:
+            return True
+        bit = 1 << -shift
+        if self._seen & bit:
+            return True
+        self._seen |= bit
+        return False
+
+    @property
+    def low_water(self) -> int:
+        """Самый большой update_id, до которого все увиденные апдейты обработаны"""
+        if self._in_flight:
+            return min(self._in_flight) - 1
+        return self.high_water
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        update: Update = event
+        if self.seen(update.update_id):
+            self.duplicates += 1
+            logger.info("Повторный апдейт %s пропущен", update.update_id)
+            return None
+        self._in_flight.add(update.update_id)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(update.update_id)
+            self._unsaved += 1
+            if self._unsaved >= SAVE_EVERY or time.monotonic() - self._saved_at >= SAVE_INTERVAL:
+                self.save()
+
+    def save(self):
+        """Сохранить нижнюю границу завершенных апдейтов, если она изменилась"""
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        low_water = self.low_water
+        if low_water == self._saved:
+            return
+        try:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO update_offsets VALUES (?, ?, ?)",
+                (self.bot_id, low_water, datetime.now().isoformat(sep=" ", timespec="seconds"))
+            )
+            self.conn.commit()
+            self._saved = low_water
+        except Exception as e:
+            logger.error(f"Не удалось сохранить границу апдейтов: {e}")
@@ -0,0 +1,151 @@
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.filters import Filter
+from aiogram.types import Message, TelegramObject
+
+from db import connect
+
+logger = logging.getLogger("bot.events")
+
+
+@dataclass
+class Event:
+    """Мероприятие: свой каталог вопросов, расписание, команды, БД и таблица экспорта"""
+    event_id: str
+    title: str
+    questions_path: str
+    schedule_path: str
+    db_path: str
+    teams: List[str] = field(default_factory=list)
+    spreadsheet_id: str = ""
+    creds_json_path: str = "config/service_account.json"
+    _schedule_text: Optional[str] = field(default=None, repr=False)
+
+    @property
+    def schedule_text(self) -> str:
+        """Текст расписания (HTML), читается из файла один раз"""
+        if self._schedule_text is None:
+            with open(self.schedule_path, encoding="utf-8") as f:
+                self._schedule_text = f.read()
+        return self._schedule_text
+
+
+def load_events(path: str) -> List[Event]:
+    """Загружает список мероприятий; первым в списке идет мероприятие по умолчанию"""
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+
+    events = []
+    seen = set()
+    for item in raw.get("events", []):
+        event_id = item["id"]
+        if event_id in seen:
+            raise ValueError(f"Мероприятие '{event_id}' описано дважды")
+        seen.add(event_id)
+        events.append(Event(
+            event_id=event_id,
+            title=item.get("title", event_id),
+            questions_path=item["questions"],
+            schedule_path=item["schedule"],
+            db_path=item.get("db", f"quiz_answers_{event_id}.db"),
+            teams=list(item.get("teams", [])),
+            spreadsheet_id=item.get("spreadsheet_id", ""),
+            creds_json_path=item.get("service_account", "config/service_account.json"),
+        ))
+
+    if not events:
+        raise ValueError("Не описано ни одного мероприятия")
+
+    default_id = raw.get("default", events[0].event_id)
+    events.sort(key=lambda e: e.event_id != default_id)
+    return events
+
+
+class EventRegistry:
+    """
+    Привязка пользователей к мероприятиям.
+    Привязки хранятся в отдельной БД и целиком кэшируются в памяти.
+    """
+
+    def __init__(self, events: List[Event], db_path: str = "events.db"):
+        self.events: Dict[str, Event] = {event.event_id: event for event in events}
+        self.default = events[0]
+
+        self.conn = connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS event_members (
+                user_id INTEGER PRIMARY KEY,
+                event_id TEXT NOT NULL,
+                bound_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.conn.commit()
+
+        self._members: Dict[int, str] = dict(self.conn.execute("SELECT user_id, event_id FROM event_members"))
+        logger.info(f"Мероприятий: {len(self.events)}, привязок пользователей: {len(self._members)}")
+
+    def event_id_of(self, user_id: int) -> str:
+        event_id = self._members.get(user_id)
+        if event_id not in self.events:
+            return self.default.event_id
+        return event_id
+
+    def bind(self, user_id: int, event_id: str):
+        if event_id not in self.events:
+            raise KeyError(event_id)
+        if self._members.get(user_id) == event_id:
+            return
+        self._members[user_id] = event_id
+        self.conn.execute(
+            "INSERT OR REPLACE INTO event_members (user_id, event_id) VALUES (?, ?)",
+            (user_id, event_id)
+        )
+        self.conn.commit()
+        logger.info("Пользователь %s привязан к мероприятию %s", user_id, event_id)
+
+    def members_count(self) -> Dict[str, int]:
+        counts = {event_id: 0 for event_id in self.events}
+        for event_id in self._members.values():
+            if event_id in counts:
+                counts[event_id] += 1
+        return counts
+
+    def close(self):
+        self.conn.close()
+
+
+class EventFilter(Filter):
+    """Пропускает в роутер мероприятия только апдейты его участников"""
+
+    def __init__(self, registry: EventRegistry, event_id: str):
+        self.registry = registry
+        self.event_id = event_id
+
+    async def __call__(self, event: TelegramObject) -> bool:
+        user = getattr(event, "from_user", None)
+        if user is None:
+            return False
+        return self.registry.event_id_of(user.id) == self.event_id
+
+
+class EventBindingMiddleware(BaseMiddleware):
+    """Привязывает пользователя к мероприятию по ссылке вида t.me/<bot>?start=<event_id>"""
+
+    def __init__(self, registry: EventRegistry):
+        self.registry = registry
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Message) and event.text and event.from_user and event.text.startswith("/start "):
+            event_id = event.text.split(maxsplit=1)[1].strip()
+            if event_id in self.registry.events:
+                self.registry.bind(event.from_user.id, event_id)
+        return await handler(event, data)
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import EditMessageText
+
+from outbox import Outbox
+
+logger = logging.getLogger("bot.jobs")
+
+# Статусы задачи
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+_STATUS_ICONS = {QUEUED: "🕓", RUNNING: "⏳", DONE: "✅", FAILED: "❌", CANCELLED: "🛑"}
+
+
+@dataclass(slots=True)
+class Job:
+    """Фоновая задача администратора"""
+    job_id: int
+    title: str
+    chat_id: int  # Чат, в котором задача показывает свой прогресс
+    status: str = QUEUED
+    done: int = 0
+    total: Optional[int] = None  # None - объем работы заранее неизвестен
+    result: str = ""
+    created_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    message_id: Optional[int] = None  # Сообщение с прогрессом
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def advance(self, count: int = 1):
+        self.done += count
+
+    def describe(self) -> str:
+        """Текст сообщения с прогрессом"""
+        text = f"{_STATUS_ICONS[self.status]} Задача #{self.job_id}: {self.title}\n"
+        if self.status == QUEUED:
+            return text + f"Ожидает очереди\n/cancel {self.job_id} — отменить"
+
+        if self.total:
+            progress = f"{self.done} из {self.total} ({self.done * 100 // self.total}%)"
+        else:
+            progress = str(self.done)
+        elapsed = (self.finished_at or time.monotonic()) - (self.started_at or self.created_at)
+
+        if self.status == RUNNING:
+            return text + f"Выполнено: {progress}, прошло {elapsed:.0f} с\n/cancel {self.job_id} — отменить"
+        if self.status == CANCELLED:
+            return text + f"Отменена, выполнено: {progress}"
+        if self.status == FAILED:
+            return text + f"Ошибка после {progress}: {self.result}"
+        return text + f"Готово за {elapsed:.0f} с. {self.result}"
+
+
+class JobRunner:
+    """
+    Долгие команды администратора в фоне.
+
+    Команда ставит задачу и сразу возвращает управление; задача публикует сообщение
+    с прогрессом и обновляет его не чаще раза в `progress_interval` секунд - правки тоже
+    идут через очередь исходящих, в общем лимите скорости и под предохранителем.
+    Одновременно выполняется не больше `concurrency` задач, остальные ждут очереди.
+    Рассылки внутри задачи идут через `each`, который держит в общей очереди
+    исходящих не больше `send_concurrency` сообщений задачи, поэтому сообщения
+    участников не ждут, пока разойдется вся рассылка.
+    """
+
+    def __init__(self, bot: Bot, outbox: Outbox, concurrency: int = 2, send_concurrency: int = 5,
+                 progress_interval: float = 3.0, keep_finished: int = 20):
+        self.bot = bot
+        self.outbox = outbox
+        self.send_concurrency = send_concurrency
+        self.progress_interval = progress_interval
+        self.keep_finished = keep_finished  # Сколько завершенных задач показывать в /jobs
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._jobs: Dict[int, Job] = {}
+        self._next_id = 1
+
+    def submit(self, chat_id: int, title: str, work: Callable[[Job], Awaitable[str]]) -> Job:
+        """
+        Поставить задачу. `work` получает Job, отмечает прогресс через job.advance()
+        и возвращает строку с итогом для сообщения о завершении.
+        """
+        job = Job(job_id=self._next_id, title=title, chat_id=chat_id)
+        self._next_id += 1
+        self._jobs[job.job_id] = job
+        job.task = asyncio.create_task(self._run(job, work))
+        self._prune()
+        logger.info(f"Задача #{job.job_id} поставлена: {title}")
+        return job
+
+    def list(self) -> List[Job]:
+        return list(self._jobs.values())
+
+    def active_count(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def cancel(self, job_id: int) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.task.cancel()
+        return True
+
+    async def each(self, job: Job, items: Iterable, func: Callable[..., Awaitable]) -> List:
+        """
+        Выполнить `func(item)` для всех элементов, не больше `send_concurrency` одновременно,
+        отмечая прогресс задачи. Возвращает результаты по порядку; ошибки - в виде исключений
+        """
+        items = list(items)
+        job.total = len(items)
+        semaphore = asyncio.Semaphore(self.send_concurrency)
+
+        async def run_one(item):
+            async with semaphore:
+                try:
+                    return await func(item)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    return e
+                finally:
+                    job.advance()
+
+        return await asyncio.gather(*(run_one(item) for item in items))
+
+    async def shutdown(self):
+        tasks = [job.task for job in self._jobs.values() if not job.finished]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    async def _run(self, job: Job, work: Callable[[Job], Awaitable[str]]):
+        reporter = None
+        try:
+            try:
+                sent = await self.outbox.send(job.chat_id, job.describe(), merge=False)
+                job.message_id = sent.message_id
+            except Exception as e:
+                logger.warning(f"Задача #{job.job_id}: не удалось отправить сообщение с прогрессом: {e}")
+
+            async with self._semaphore:
+                job.status = RUNNING
+                job.started_at = time.monotonic()
+                reporter = asyncio.create_task(self._report(job))
+                job.result = await work(job) or ""
+                job.status = DONE
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+        except Exception as e:
+            job.status = FAILED
+            job.result = str(e)
+            logger.error(f"Задача #{job.job_id} ({job.title}) завершилась с ошибкой: {e}", exc_info=True)
+        finally:
+            job.finished_at = time.monotonic()
+            if reporter:
+                reporter.cancel()
+            self._prune()
+
+        logger.info(f"Задача #{job.job_id} завершена: {job.status}, выполнено {job.done}")
+        await self._update(job)
+
+    async def _report(self, job: Job):
+        while True:
+            await self._update(job)
+            await asyncio.sleep(self.progress_interval)
+
+    async def _update(self, job: Job):
+        if job.message_id is None:
+            return
+        try:
+            await self.outbox.call(job.chat_id, EditMessageText(
+                text=job.describe(), chat_id=job.chat_id, message_id=job.message_id
+            ))
+        except TelegramBadRequest:
+            pass  # Текст не изменился
+        except Exception as e:
+            logger.warning(f"Задача #{job.job_id}: не удалось обновить прогресс: {e}")
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import sqlite3
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from clock import Clock
+from db import ReadPool
+
+logger = logging.getLogger("bot.latency")
+
+
+@dataclass(slots=True)
+class _Pending:
+    """Вопрос, отправленный участнику и ждущий ответа"""
+    block: int
+    step: int
+    published: float                   # Вопрос поставлен в очередь отправки (unix-время)
+    delivered: Optional[float] = None  # Telegram принял сообщение
+
+
+@dataclass(frozen=True)
+class LatencySummary:
+    """Распределение задержек группы вопросов (секунды)"""
+    sent: int                # Сколько раз вопрос был задан
+    answered: int
+    delivery_median: Optional[float]
+    median: Optional[float]  # От публикации вопроса до ответа
+    p90: Optional[float]
+
+
+def _percentile(values: List[float], p: float) -> Optional[float]:
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def _summary(rows: List[Tuple[Optional[int], Optional[int]]]) -> LatencySummary:
+    delivered = sorted(d / 1000 for d, _ in rows if d is not None)
+    answered = sorted(a / 1000 for _, a in rows if a is not None)
+    return LatencySummary(len(rows), len(answered), _percentile(delivered, 0.5),
+                          _percentile(answered, 0.5), _percentile(answered, 0.9))
+
+
+class LatencyTracker:
+    """
+    Время реакции участников на каждый вопрос: публикация, доставка и ответ.
+
+    Bot API не сообщает о прочтении, поэтому вместо первого просмотра хранится
+    момент доставки - раньше него участник увидеть вопрос не мог. Пока вопрос
+    ждет ответа, отметки лежат в памяти; строка answer_timings пишется один раз -
+    при ответе или при закрытии вопроса без ответа (answered_ms = NULL) - и
+    фиксируется ближайшим commit соединения вместе с самим ответом.
+
+    Строка занимает несколько целых чисел: публикация в мс unix-времени,
+    доставка и ответ - смещения от нее в мс; таблица WITHOUT ROWID
+    хранит строки прямо в первичном ключе (блок, вопрос, участник).
+    """
+
+    def __init__(self, conn: sqlite3.Connection, clock: Optional[Clock] = None):
+        self.conn = conn
+        self.clock = clock or Clock()
+        self._pending: Dict[Hashable, _Pending] = {}
+        self._init_table()
+
+    def _init_table(self):
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS answer_timings (
+                block INTEGER NOT NULL,
+                step INTEGER NOT NULL,        -- Номер вопроса в блоке (для стихотворения - номер строки)
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                published INTEGER NOT NULL,   -- мс unix-времени
+                delivered_ms INTEGER,         -- Смещение от публикации
+                answered_ms INTEGER,          -- Смещение от публикации; NULL - ответа не было
+                PRIMARY KEY (block, step, user_id, chat_id)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def published(self, key: Tuple[int, int], block: int, step: int, delivery: Optional[asyncio.Future] = None):
+        """Вопрос поставлен в очередь отправки; `delivery` - future доставки из Outbox"""
+        pending = self._pending[key] = _Pending(block, step, self._now())
+        if delivery is not None:
+            delivery.add_done_callback(lambda future: self._on_delivery(pending, future))
+
+    def _now(self) -> float:
+        return self.clock.now().timestamp()
+
+    def _on_delivery(self, pending: _Pending, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is None:
+            pending.delivered = self._now()
+
+    def delivered(self, key: Tuple[int, int]):
+        """Отметить доставку, если отправка ожидалась напрямую"""
+        pending = self._pending.get(key)
+        if pending is not None and pending.delivered is None:
+            pending.delivered = self._now()
+
+    def answered(self, key: Tuple[int, int], block: int, step: int):
+        """Участник ответил на вопрос `step` блока `block`"""
+        pending = self._pending.get(key)
+        if pending is None or (pending.block, pending.step) != (block, step):
+            return  # Вопрос задан до перезапуска бота - время публикации неизвестно
+        del self._pending[key]
+        self._write(key, pending, self._now())
+
+    def abandon(self, key: Tuple[int, int]):
+        """Вопрос закрыт без ответа (истекла сессия или ход стихотворения)"""
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            self._write(key, pending, None)
+
+    def _write(self, key: Tuple[int, int], pending: _Pending, answered: Optional[float]):
+        chat_id, user_id = key
+
+        def offset(moment: Optional[float]) -> Optional[int]:
+            return None if moment is None else round((moment - pending.published) * 1000)
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO answer_timings VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (pending.block, pending.step, user_id, chat_id, round(pending.published * 1000),
+             offset(pending.delivered), offset(answered))
+        )
+
+    def clear(self):
+        self._pending.clear()
+
+
+class LatencyReport:
+    """Распределения задержек по блокам, командам и вопросам - через соединения только для чтения"""
+
+    def __init__(self, reads: ReadPool):
+        self.reads = reads
+
+    async def _rows(self, block: Optional[int]) -> List[tuple]:
+        query = """
+            SELECT t.block, t.step, COALESCE(a.team, ''), t.delivered_ms, t.answered_ms
+            FROM answer_timings t
+            LEFT JOIN answers a ON a.user_id = t.user_id AND a.chat_id = t.chat_id
+        """
+        if block is None:
+            return await self.reads.fetchall(query)
+        return await self.reads.fetchall(query + " WHERE t.block = ?", (block,))
+
+    @staticmethod
+    def _group(rows: List[tuple], key) -> Dict:
+        groups = defaultdict(list)
+        for row in rows:
+            groups[key(row)].append((row[3], row[4]))
+        return {name: _summary(values) for name, values in sorted(groups.items())}
+
+    async def by_block(self) -> Dict[int, LatencySummary]:
+        return self._group(await self._rows(None), lambda row: row[0])
+
+    async def by_team(self, block: Optional[int] = None) -> Dict[str, LatencySummary]:
+        return self._group(await self._rows(block), lambda row: row[2])
+
+    async def by_question(self, block: int) -> Dict[int, LatencySummary]:
+        return self._group(await self._rows(block), lambda row: row[1])
@@ -0,0 +1,139 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+
+# Уровни по подсистемам по умолчанию. Переопределяются переменной окружения
+# LOG_LEVELS, например: LOG_LEVELS="bot.scheduler=DEBUG,poem=WARNING"
+DEFAULT_LEVELS = {
+    "bot": "INFO",
+    "bot.scheduler": "INFO",
+    "poem": "INFO",
+    "aiogram.event": "WARNING",  # aiogram пишет строку на каждый апдейт
+    "apscheduler": "WARNING",    # и APScheduler - на каждый запуск задачи
+}
+
+# Стандартные атрибуты LogRecord, которые не попадают в JSON как extra-поля
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись в одну JSON-строку"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Ограничивает повторяющиеся сообщения: не более `burst` записей на ключ
+    за `interval` секунд. Ключ - `extra={"sample_key": ...}` или шаблон сообщения,
+    поэтому сообщения горячих путей с id пользователей пишутся с %-аргументами, а не f-строками.
+    Количество отброшенных записей прикладывается к первой записи следующего окна.
+    Ошибки (ERROR и выше) не сэмплируются.
+    """
+
+    def __init__(self, burst: int = 5, interval: float = 60.0, max_keys: int = 10000):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_keys = max_keys
+        self._windows: Dict[tuple, list] = {}  # ключ -> [начало окна, записано, отброшено]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+
+        key = (record.name, getattr(record, "sample_key", None) or record.msg)
+        now = time.monotonic()
+
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if len(self._windows) >= self.max_keys:
+                    self._windows.clear()
+                if window is not None and window[2]:
+                    record.suppressed = window[2]
+                self._windows[key] = [now, 1, 0]
+                return True
+
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+
+            window[2] += 1
+            return False
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который сохраняет extra-поля и трассировку для JSON"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for item in spec.split(","):
+        name, sep, level = item.partition("=")
+        if sep and name.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level: str = "INFO", levels: Optional[Dict[str, str]] = None) -> logging.handlers.QueueListener:
+    """
+    Настраивает корневой логгер: записи проходят через сэмплирование и очередь,
+    а запись в поток выполняет фоновый поток QueueListener, не блокируя event loop.
+    """
+    log_queue = queue.SimpleQueue()
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(
+        burst=int(os.getenv("LOG_SAMPLE_BURST", "5")),
+        interval=float(os.getenv("LOG_SAMPLE_INTERVAL", "60")),
+    ))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(os.getenv("LOG_LEVEL", level).upper())
+
+    subsystem_levels = dict(DEFAULT_LEVELS)
+    subsystem_levels.update(levels or {})
+    subsystem_levels.update(_parse_levels(os.getenv("LOG_LEVELS", "")))
+    for name, subsystem_level in subsystem_levels.items():
+        logging.getLogger(name).setLevel(subsystem_level)
+
+    return listener
@@ -1,143 +1,111 @@
+import time
+
+_STARTUP_T0 = time.perf_counter()
+
 import asyncio
+import html
 import logging
 import sqlite3
 import os
 from dotenv import load_dotenv
 
-from aiogram import Bot, Dispatcher, types, Router
+from aiogram import Bot, Dispatcher, F, types, Router
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.fsm.storage.memory import MemoryStorage
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, timezone
 import re
-import gspread
-from google.oauth2.service_account import Credentials
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 from poem import TeamPoemManager, TeamPoemState
-
-logging.basicConfig(level=logging.INFO)
+from catalog import Block, Catalog, CatalogStore
+from events import Event, EventBindingMiddleware, EventFilter, EventRegistry, load_events
+from logs import setup_logging
+from outbox import Outbox
+from storage import BoundedMemoryStorage, user_state
+from sessions import SessionExpiry, SessionTable
+from reminders import IDLE, TEAM_BLOCKER, ReminderScheduler
+from deadletter import DeadLetterQueue
+from jobs import Job, JobRunner
+from db import ReadPool, connect
+from snapshots import ARCHIVE_PREFIX, SnapshotService
+from search import SearchIndex
+from stats import LiveStats
+from latency import LatencyReport, LatencyTracker
+from replay import UpdateRecorder
+from clock import Clock
+from throttle import Budget, ThrottleMiddleware
+from dedup import UpdateDeduplicator
+from roster import Roster, parse_roster
+
+logger = logging.getLogger("bot")
+scheduler_logger = logging.getLogger("bot.scheduler")
+
+# Этапы запуска (мс от старта процесса) для отчета о холодном старте.
+# Разбивку импорта по модулям дает `python -X importtime main.py`
+startup_marks: Dict[str, float] = {}
+
+
+def mark_startup(phase: str):
+    startup_marks[phase] = round((time.perf_counter() - _STARTUP_T0) * 1000, 1)
+
+
+mark_startup("imports")
 
 load_dotenv()
 API_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = 874968987
 
-questions = [
-    {
-        "text": [
-            "В каком году была основана компания?",
-            "В каком году компания стала резидентом Сколково?",
-            "Назови три ключевые ценности корпоративной культуры, важные для роста нашей компании",
-            "Сформулируй 2-3 ключевых правила для поведения сотрудников на встречах и совещаниях."
-        ],
-        "time": None
-    },
-    {
-        "text": [
-            "Что ты запомнил из выступления топ команды? Напиши ключевую мысль.",
-            "По твоему мнению, какое самое важное достижение у компании за этот год и почему?"
-        ],
-        # Для тестирования: через 2 минуты после запуска
-        # "time": datetime.now() + timedelta(minutes=1)
-        # Для продакшена:
-        "time": datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=9, minutes=55)
-    },
-    {
-        "text": [
-            "Сделай и отправь креативную фотографию с коллегой, с которым чаще всего взаимодействуешь по работе (приветствуется использование ИИ)."
-        ],
-        # Для тестирования: через 4 минуты после запуска
-        # "time": datetime.now() + timedelta(minutes=2)
-        # Для продакшена:
-        "time": datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=12, minutes=30)
-    },
-    {
-        "text": [
-            "Какой продукт нашей компании тебе нравится больше всего и почему?\nОпиши, что именно в этом продукте привлекает тебя — будь то функциональность, дизайн, польза для клиентов или что-то ещё. Постарайся раскрыть свои личные впечатления и причины выбора.",
-            "С помощью ИИ сгенерируй и направь сюда ответ с нестандартными способами использования продукта, о котором ты писал(а) выше, выходящими за рамки его традиционного применения."
-        ],
-        # Для тестирования: через 6 минут после запуска
-        # "time": datetime.now() + timedelta(minutes=3)
-        # Для продакшена:
-        "time": datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=14, minutes=30)
-    },
-    {
-        "text": [
-            "Если бы ты мог воплотить принципы Agile в образе живого существа или объекта, что бы это было и почему?",
-            "Как бы ты переосмыслил одно из ключевых правил Agile, чтобы оно отражало не только гибкость и скорость, но и вдохновение и творческий подход в работе команды?",
-            "Расшифруй ребус из эмодзи и напиши, какое Agile-понятие или практика здесь изображены\n 🐢📅🛠",
-        ],
-        # Для тестирования: через 8 минут после запуска
-        # "time": datetime.now() + timedelta(minutes=4)
-        # Для продакшена:
-        "time": datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=15, minutes=30)
-    },
-    {
-        "text": [
-            "Задание командной творческой цепочки: ""Стих о нашей компании"".\n"
-            "Цель — создать совместное стихотворение, отражающее уникальность компании.\n\n"
-            "1. Первому участнику команды приходит задание (первый участник команды - это тот кто первый зарегистрировался в чат боте из команды):\n"
-            "— Напиши в стихотворной форме одну строчку, посвящённую нашей компании.\n\n"
-            "2. Как только первый участник отправляет свою строчку, задание автоматически переходит к следующему участнику:\n"
-            "— Продолжи стихотворение, добавив ещё одну рифмованную строчку.\n\n"
-            "3. Задание поочерёдно передаётся всем участникам команды, каждый добавляет свою строчку, развивая общее стихотворение."
-        ],
-        # Для тестирования: через 10 минут после запуска
-        # "time": datetime.now() + timedelta(minutes=5)
-        # Для продакшена:
-        "time": datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=16, minutes=00)
-    },
-]
-
-# Переменная с расписанием (можно вынести в начало файла или в отдельный модуль)
-SCHEDULE_TEXT = """
-📅 <b>ПРОГРАММА КОРПОРАТИВНОГО МЕРОПРИЯТИЯ «ТРАДИЦИИ И ТРАНСФОРМАЦИИ»</b>
-🗓 <b>15–16 августа 2025</b>
-
-🏢 <b>ОФИЦИАЛЬНАЯ ЧАСТЬ</b>
-📍 <b>Место:</b> Челябинск-Сити, ул. Кирова 159
-🕘 <b>Время:</b> 09:00 - 18:00
-
-⚠️ <b>ВАЖНО:</b> Запрещено курение на территории всего здания «Челябинск-Сити», вне выделенного места для курения. За каждый факт нарушения – штраф 5000 руб.
-
-─────────────────────────────
-
-🕰 <b>08:50 - 09:20</b>    Кофе-брейк
-🎬 <b>09:30 - 09:40</b>    Открытие мероприятия
-💼 <b>09:40 - 12:10</b>    Панельная сессия ТОПов. Ответы на вопросы, поступившие к руководству компании
-📸 <b>12:10 - 12:20</b>    Фотографирование
-🍽 <b>12:20 - 13:10</b>    Обед
-🎥 <b>13:10 - 13:25</b>    Просмотр фильма о продуктах компании
-
-👥 <b>Спикеры:</b>
-🎯 <b>13:25 - 13:40</b>    <i>Руднева Илона</i>, руководитель отдела методологии и научных исследований
-Тема: "Из образования в цифровой мир: мой путь в IT"
-
-💻 <b>13:40 - 13:55</b>    <i>Светлана Рудольфовна</i>, эксперт БЦ город Ижевск (онлайн)
-
-🏫 <b>13:55 - 14:10</b>    <i>Меркасимова Ольга Сергеевна</i>, руководитель МБУ "Центр психолого-педагогической, медицинской и социальной помощи Калининского района г. Челябинска"
-
-🎓 <b>14:10 - 14:25</b>    <i>Слизкая Ирина Ивановна</i>, заведующий МБДОУ "ДС №55 г. Челябинска"
-
-🔬 <b>14:25 - 14:40</b>    <i>Мальцева Алиса</i>, научный консультант
-Тема: "Бережная цифра: баланс света и тени в цифровом детстве"
-
-☕ <b>14:40 - 14:55</b>    Перерыв
-
-⚡ <b>15:00 - 16:00</b>    <i>Стригуненко Влас</i>, предприниматель, методолог, исследователь, консультант
-Тема: "Agile и современное продуктовое управление"
-
-☕ <b>16:10 - 16:30</b>    Перерыв
-
-🤖 <b>16:30 - 17:30</b>    <i>Терехин Игорь</i>, руководитель отдела AI и LLM компании Napoleon IT
-Тема: "Жить и работать в эпоху ИИ: от мифов к реальным результатам"
-
-🎊 <b>17:40 - 18:00</b>    Закрытие мероприятия
-
-Удачного дня! 🚀
-"""
+EVENTS_PATH = "config/events.json"
+EVENTS_DB_PATH = "events.db"
+DEAD_LETTERS_DB_PATH = "dead_letters.db"
+
+# Открытие блока по расписанию для всех ожидающих участников
+FANOUT_CONCURRENCY = 50  # Сколько участников обрабатывается одновременно
+SQL_IN_CHUNK = 450       # Пар (chat_id, user_id) в одном UPDATE ... IN (VALUES ...) (лимит параметров SQLite - 999)
+
+# Через сколько минут без ответа блок вопросов закрывается с сохранением данных ответов
+SESSION_TIMEOUT_MINUTES = 15
+
+# Сжатые снимки баз мероприятий: резервные копии и источник для тяжелых отчетов
+SNAPSHOTS_DIR = "snapshots"
+SNAPSHOT_INTERVAL_MINUTES = 30
+SNAPSHOT_KEEP = 48                # Сколько периодических снимков хранить (архивы не удаляются)
+EXPORT_SNAPSHOT_MAX_AGE_MINUTES = 5  # Экспорт берет снимок не старше, иначе снимает новый
+
+SEARCH_PAGE_SIZE = 5  # Результатов /search на странице
+
+ROSTER_MAX_FILE_MB = 5  # Предельный размер файла со списком участников для /import
+
+# Запись входящих апдейтов для воспроизведения (python replay.py): включается каталогом в UPDATES_LOG_DIR.
+# В записи - полные тексты и username участников, поэтому по умолчанию она выключена
+UPDATES_LOG_DIR = os.getenv("UPDATES_LOG_DIR", "")
+UPDATES_LOG_MAX_MB = 50  # Размер сжатого файла записи, после которого начинается новый
+UPDATES_LOG_KEEP = 20    # Сколько файлов записи хранить (старые удаляются)
+
+# Ограничение частоты апдейтов одного пользователя: подряд, в секунду, сверх бюджета с предупреждением
+PARTICIPANT_BUDGET = Budget(rate=1.0, burst=8, grace=4)
+ADMIN_BUDGET = Budget(rate=5.0, burst=30, grace=20)  # Команды и кнопки администратора
+THROTTLE_MAX_USERS = 20000                           # Ведер в памяти, давние вытесняются
+
+
+def _parse_db_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """CURRENT_TIMESTAMP SQLite (UTC) -> локальное время без часового пояса"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+
+def _quiz_session(block_index: int, answered_message: int = 0) -> dict:
+    """
+    Данные FSM блока вопросов: только номер блока, шаг и ответы - тексты вопросов берутся из каталога.
+    answered_message - message_id последнего принятого ответа, его повтор не записывается еще раз
+    """
+    return {"quiz_index": block_index, "block_step": 0, "answers": [], "answered_message": answered_message}
+
 
 class BotState(StatesGroup):
     waiting_for_fio = State()
@@ -146,40 +114,99 @@ class BotState(StatesGroup):
     asking = State()
     waiting = State()
 
+class BlockHandlers(NamedTuple):
+    """Обработчики одного типа блока"""
+    open: Callable    # Блок открылся по расписанию
+    enter: Callable   # Пользователь завершил предыдущий блок
+    resume: Callable  # Пришло сообщение, а состояние FSM потеряно
+    open_many: Optional[Callable] = None  # Блок открылся по расписанию сразу для многих участников
+
+
 class InteractiveBot:
-    def __init__(self, token: str):
-        self.bot = Bot(token=token)
-        self.dp = Dispatcher(storage=MemoryStorage())
-        self.router = Router()
+    """Игра одного мероприятия. Бот и диспетчер общие для всех мероприятий процесса"""
+
+    def __init__(self, bot: Bot, dp: Dispatcher, event: Event, registry: EventRegistry, outbox: Outbox,
+                 jobs: JobRunner, clock: Optional[Clock] = None):
+        self.bot = bot
+        # Часы мероприятия: расписание, таймауты и last_activity (в симуляции - ускоренные)
+        self.clock = clock or Clock()
+        self.dp = dp
+        self.event = event
+        self.outbox = outbox  # Общая очередь исходящих сообщений
+        self.jobs = jobs  # Фоновые задачи администратора (общие для всех мероприятий)
+        self.router = Router(name=f"event:{event.event_id}")
+        # В роутер мероприятия попадают только апдейты его участников
+        event_filter = EventFilter(registry, event.event_id)
+        self.router.message.filter(event_filter)
+        self.router.callback_query.filter(event_filter)
         self.dp.include_router(self.router)
         self._init_db()
-        self.poem_manager = TeamPoemManager(self.bot, self.conn, dp=self.dp)
+        # Отчеты и выгрузки администратора читают базу через отдельные соединения
+        self.reads = ReadPool(event.db_path)
+        self.snapshots = SnapshotService(event.db_path, SNAPSHOTS_DIR, keep=SNAPSHOT_KEEP,
+                                         interval=SNAPSHOT_INTERVAL_MINUTES * 60)
+        # Единая таблица сессий участников: открытый блок и команда идущего стихотворения
+        self.sessions = SessionTable()
+        # Счетчики /stats: обновляются при записи, а не агрегирующими запросами
+        self.stats = LiveStats()
+        # Время публикации, доставки и ответа по каждому вопросу - для настройки расписания
+        self.latency = LatencyTracker(self.conn, self.clock)
+        self.latency_report = LatencyReport(self.reads)
+        self.reminders = ReminderScheduler(self.conn, outbox, lambda: self.catalog.poem_index, self.clock)
+        self.poem_manager = TeamPoemManager(self.bot, self.conn, dp=self.dp, catalog_store=self.catalog_store,
+                                            event_title=event.title, outbox=outbox, sessions=self.sessions,
+                                            stats=self.stats, latency=self.latency, clock=self.clock)
+        self.stats.load(self.conn, self.catalog.poem_index)
+        # Полнотекстовый поиск по ответам и строкам стихотворений (таблицы уже созданы выше)
+        self.search = SearchIndex(self.conn, self.reads)
+        self._search_queries: Dict[int, str] = {}  # Последний запрос /search в чате - для перелистывания
+        # Заранее известный список участников (/import): такие участники регистрируются одним /start
+        self.roster = Roster(self.conn)
 
         self.bot_active = True
 
         self.admin_export = AdminExport(
             bot=self.bot,
-            cur=self.cur,
-            admin_id=ADMIN_ID,
-            creds_json_path="config/service_account.json",
-            spreadsheet_id="1MQMhgMeI5B1zjK-UcPhVGVBHFer5HUMdnyvs0A5FayU"
+            snapshots=self.snapshots,
+            creds_json_path=event.creds_json_path,
+            spreadsheet_id=event.spreadsheet_id
         )
 
         self.keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Красный", callback_data="team_Красный")],
-            [InlineKeyboardButton(text="Желтый", callback_data="team_Желтый")],
-            [InlineKeyboardButton(text="Зелёный", callback_data="team_Зелёный")],
-            [InlineKeyboardButton(text="Синий", callback_data="team_Синий")]
+            [InlineKeyboardButton(text=team, callback_data=f"team_{team}")]
+            for team in event.teams
         ])
 
+        # Реестр типов блоков и вопросов: тег типа из каталога -> обработчики
+        self.block_types = {
+            "quiz": BlockHandlers(self._open_quiz_block, self._enter_quiz_block, self._resume_quiz_block,
+                                  self._open_quiz_block_many),
+            "poem": BlockHandlers(self._open_poem_block, self._enter_poem_block, self._resume_poem_block),
+        }
+        self.answer_readers = {
+            "text": self._read_text_answer,
+            "photo": self._read_photo_answer,
+        }
+
         self.scheduler = AsyncIOScheduler()
-        # Словарь для отслеживания активных блоков пользователей
-        self.active_blocks = {}
+        # Сроки бездействия сессий блоков вопросов: брошенный блок закрывается сам
+        self.expiry = SessionExpiry(self._expire_session, SESSION_TIMEOUT_MINUTES * 60, self.clock)
+        self.nudge_expired = True  # Сообщать участнику, что его блок закрыт по бездействию
+        # Фоновые задачи замера рассылки (ссылки нужны, чтобы задачи не собрал GC)
+        self._fan_out_reports = set()
         self._register_handlers()
 
+    @property
+    def catalog(self) -> Catalog:
+        """Текущий каталог вопросов (может быть заменен командой /reload_questions)"""
+        return self.catalog_store.catalog
+
     def _init_db(self):
-        self.conn = sqlite3.connect('quiz_answers.db')
+        # Единственное соединение для записи: все изменения идут через него из event loop
+        self.conn = connect(self.event.db_path)
         self.cur = self.conn.cursor()
+        # Каталог вопросов: колонки ответов закреплены за вопросами в этой же базе
+        self.catalog_store = CatalogStore(self.event.questions_path, self.conn)
 
         # Проверяем существование таблицы
         self.cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='answers'")
@@ -187,8 +214,7 @@ class InteractiveBot:
 
         if not table_exists:
             # Создаем новую таблицу
-            num_questions = sum(len(block["text"]) for block in questions)
-            answers_cols = ', '.join([f"answer_{i + 1} TEXT" for i in range(num_questions)])
+            answers_cols = ', '.join(f"answer_{q.column} TEXT" for q in self.catalog.questions)
             self.cur.execute(f"""
                 CREATE TABLE answers (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -211,22 +237,36 @@ class InteractiveBot:
 
             if 'is_active' not in columns:
                 self.cur.execute("ALTER TABLE answers ADD COLUMN is_active INTEGER DEFAULT 0")
-                logging.info("Добавлен столбец is_active")
+                logger.info("Добавлен столбец is_active")
 
             if 'last_activity' not in columns:
                 self.cur.execute("ALTER TABLE answers ADD COLUMN last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-                logging.info("Добавлен столбец last_activity")
+                logger.info("Добавлен столбец last_activity")
 
             if 'current_block' not in columns:
                 self.cur.execute("ALTER TABLE answers ADD COLUMN current_block INTEGER DEFAULT 0")
-                logging.info("Добавлен столбец current_block")
+                logger.info("Добавлен столбец current_block")
+
+            self._ensure_answer_columns()
 
         self.conn.commit()
 
+    def _ensure_answer_columns(self):
+        """Добавляет колонки answer_N для новых вопросов каталога"""
+        self.cur.execute("PRAGMA table_info(answers)")
+        columns = {column[1] for column in self.cur.fetchall()}
+        for question in self.catalog.questions:
+            if f"answer_{question.column}" not in columns:
+                self.cur.execute(f"ALTER TABLE answers ADD COLUMN answer_{question.column} TEXT")
+                logger.info(f"Добавлен столбец answer_{question.column} (вопрос {question.qid})")
+        self.conn.commit()
+
     def _register_handlers(self):
         # 1. ОСНОВНЫЕ КОМАНДЫ (самые приоритетные)
         @self.router.message(Command("start"))
         async def cmd_start(message: Message, state: FSMContext):
+            if await self.preregistered(message, state):
+                return
             await self.name(message)
             await state.set_state(BotState.waiting_for_fio)
 
@@ -255,6 +295,22 @@ class InteractiveBot:
                 "/finish_game — завершить игру досрочно\n"
                 "/start_poem [команда] — сразу перейти к стихотворению для команды\n"
                 "/send_schedule — команда для отправки расписания\n"
+                "/reload_questions — перечитать каталог вопросов из файла\n"
+                "/reminders — политики напоминаний отстающим\n"
+                "/reminder_add [блок|poem] [минуты] [текст] — добавить напоминание\n"
+                "/reminder_del [id] — удалить напоминание\n"
+                "/events — список мероприятий\n"
+                "/queues — очередь исходящих сообщений\n"
+                "/dlq — неотправленные сообщения\n"
+                "/dlq_replay [id|all] — повторить отправку неотправленных сообщений\n"
+                "/jobs — фоновые задачи (экспорт, фото, рассылка)\n"
+                "/cancel [id] — отменить фоновую задачу\n"
+                "/snapshots — снимки базы, /snapshot — снять снимок сейчас\n"
+                "/search [слова] — поиск по ответам и строкам стихотворений\n"
+                "/stats — живая статистика игры\n"
+                "/latency [номер_блока] — время ответа по блокам, командам и вопросам\n"
+                "/import — загрузить список участников (CSV/XLSX: username, ФИО, команда), файл с подписью /import\n"
+                "/event [id] — переключиться на другое мероприятие\n"
                 "/help_admin — список админ-команд\n"
             )
             await message.answer(text, parse_mode="HTML")
@@ -266,12 +322,8 @@ class InteractiveBot:
                 await message.answer("У вас нет доступа к этой команде.")
                 return
 
-            # Достаем нужные 3 поля из БД
-            self.cur.execute("""
-                             SELECT username, full_name, fio, team, is_active
-                             FROM answers
-                             """)
-            rows = self.cur.fetchall()
+            # Достаем нужные поля из БД
+            rows = await self.reads.fetchall("SELECT username, full_name, fio, team, is_active FROM answers")
 
             if not rows:
                 await message.answer("В базе нет зарегистрированных пользователей.")
@@ -296,6 +348,15 @@ class InteractiveBot:
                 await message.answer("У вас нет доступа к этой команде.")
                 return
 
+            # Перед очисткой сохраняем архив базы; без архива не очищаем
+            try:
+                archive = await self.snapshots.take(f"{ARCHIVE_PREFIX}_before_clear")
+            except Exception as e:
+                logger.error(f"Не удалось сохранить архив перед очисткой: {e}", exc_info=True)
+                await message.answer(f"❌ Не удалось сохранить архив, таблицы не очищены: {e}")
+                return
+            await message.answer(f"🗄 Архив сохранен: {archive.name}")
+
             # Очищаем таблицу
             try:
                 self.cur.execute("DELETE FROM answers")
@@ -307,26 +368,143 @@ class InteractiveBot:
                 self.cur.execute(f"DELETE FROM sqlite_sequence WHERE name='poem_contributions'")  # сброс автоинкремента
                 self.conn.commit()
                 await message.answer("✅ Таблица poem_contributions успешно очищена!")
+
+                self.cur.execute("DELETE FROM reminders_sent")
+                self.cur.execute("DELETE FROM answer_timings")
+                self.roster.release_all()
+                self.conn.commit()
+                self.latency.clear()
+                self.stats.load(self.conn, self.catalog.poem_index)
             except Exception as e:
                 await message.answer(f"❌ Ошибка при очистке таблицы: {e}")
 
+        @self.router.message(Command("snapshots"))
+        async def list_snapshots_cmd(message: Message):
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            snapshots = self.snapshots.list()
+            if not snapshots:
+                await message.answer("Снимков базы пока нет. /snapshot — снять сейчас")
+                return
+            lines = [f"{path.name} — {path.stat().st_size // 1024} КБ" for path in snapshots[-15:]]
+            await message.answer(f"🗄 Снимки базы (последние {len(lines)} из {len(snapshots)}):\n" + "\n".join(lines))
+
+        @self.router.message(Command("snapshot"))
+        async def take_snapshot_cmd(message: Message):
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+
+            async def take(job: Job) -> str:
+                path = await self.snapshots.take("manual")
+                return f"Снимок {path.name} ({path.stat().st_size // 1024} КБ)"
+
+            self.jobs.submit(message.chat.id, "Снимок базы", take)
+
+        @self.router.message(Command("search"))
+        async def search_cmd(message: Message):
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            args = message.text.split(maxsplit=1)
+            if len(args) < 2 or not args[1].strip():
+                await message.answer("Использование: /search <слова>\nИщет по текстовым ответам и строкам стихотворений.")
+                return
+            self._search_queries[message.chat.id] = args[1].strip()
+            text, keyboard = await self._search_page(args[1].strip(), 0)
+            await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+        @self.router.callback_query(F.data.startswith("search:"))
+        async def search_page_cb(callback: CallbackQuery):
+            if callback.from_user.id != ADMIN_ID:
+                await callback.answer()
+                return
+            query = self._search_queries.get(callback.message.chat.id)
+            if query is None:
+                await callback.answer("Запрос устарел, повторите /search")
+                return
+            text, keyboard = await self._search_page(query, int(callback.data.split(":", 1)[1]))
+            await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+            await callback.answer()
+
+        @self.router.message(Command("stats"))
+        async def stats_cmd(message: Message):
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            await message.answer(self._stats_text(), parse_mode="HTML", reply_markup=self._stats_keyboard)
+
+        @self.router.callback_query(F.data == "stats:refresh")
+        async def stats_refresh_cb(callback: CallbackQuery):
+            if callback.from_user.id != ADMIN_ID:
+                await callback.answer()
+                return
+            try:
+                await callback.message.edit_text(self._stats_text(), parse_mode="HTML", reply_markup=self._stats_keyboard)
+            except TelegramBadRequest:
+                pass  # Ничего не изменилось
+            await callback.answer()
+
+        @self.router.message(Command("latency"))
+        async def latency_cmd(message: Message):
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            args = message.text.split()
+            if len(args) > 1 and (not args[1].isdigit() or not 1 <= int(args[1]) <= len(self.catalog)):
+                await message.answer(f"Использование: /latency [номер блока от 1 до {len(self.catalog)}]")
+                return
+            block = int(args[1]) - 1 if len(args) > 1 else None
+            await message.answer(await self._latency_text(block), parse_mode="HTML")
+
+        @self.router.message(Command("import"))
+        async def import_roster_cmd(message: Message):
+            """Список участников из CSV/XLSX: файл с подписью /import или ответ /import на сообщение с файлом"""
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            document = message.document or (message.reply_to_message and message.reply_to_message.document)
+            if document is None:
+                total, claimed = self.roster.counts()
+                await message.answer(
+                    f"📋 В списке участников: {total}, зарегистрировались: {claimed}\n\n"
+                    "Чтобы загрузить список, отправьте CSV или XLSX с колонками username, ФИО и команда "
+                    f"с подписью /import. Команды: {', '.join(self.event.teams)}"
+                )
+                return
+            if document.file_size and document.file_size > ROSTER_MAX_FILE_MB * 1024 * 1024:
+                await message.answer(f"❌ Файл больше {ROSTER_MAX_FILE_MB} МБ")
+                return
+
+            content = (await self.bot.download(document)).read()
+            try:
+                rows, errors = await asyncio.to_thread(parse_roster, document.file_name or "", content, self.event.teams)
+            except Exception as e:
+                await message.answer(f"❌ Не удалось прочитать файл: {e}")
+                return
+            report = self.roster.import_rows(rows, errors)
+            total, claimed = self.roster.counts()
+            await message.answer(f"📋 Список участников загружен\n{report.text()}\n\n"
+                                 f"Всего в списке: {total}, зарегистрировались: {claimed}")
+
         @self.router.message(Command("results"))
         async def view_results(message: types.Message):
             if message.from_user.id != ADMIN_ID:
                 await message.answer("У вас нет доступа к просмотру результатов.")
                 return
-            all_results = self.get_all_answers()
+            columns, all_results = await self.reads.fetch("SELECT * FROM answers")
             if not all_results:
                 await message.answer("Ответов пока нет.")
                 return
+            # Ответ на вопрос ищется по его колонке, а не по позиции в каталоге
+            positions = [columns.index(f"answer_{q.column}") for q in self.catalog.questions]
             text = ""
             for idx, row in enumerate(all_results, 1):
                 user_info = f"{row[3]} (@{row[2]})"
-                num_questions = sum(len(block["text"]) for block in questions)
-                # Формируем список ответов (начинаем с индекса 4, так как первые 4 колонки - это метаданные)
                 answers = []
-                for i in range(num_questions):
-                    answer = row[10 + i] if (10 + i) < len(row) and row[10 + i] is not None else "Нет ответа"
+                for i, position in enumerate(positions):
+                    answer = row[position] if row[position] is not None else "Нет ответа"
                     answers.append(f"{i + 1}: {answer}")
 
                 text += f"{idx}. {user_info}\n" + "\n".join(answers) + "\n\n"
@@ -339,9 +517,8 @@ class InteractiveBot:
                 await message.answer("У вас нет доступа к просмотру вопросов.")
                 return
             text = "Список блоков:\n"
-            for idx, block in enumerate(questions):
-                block_title = block.get("title", f"Блок №{idx + 1}")
-                text += f"{block_title} — {len(block['text'])}\n"
+            for block in self.catalog.blocks:
+                text += f"{block.title} — {len(block)}\n"
             await message.answer(text)
 
         @self.router.message(Command("block"))
@@ -354,13 +531,91 @@ class InteractiveBot:
                 await message.answer("Используй: /block <номер_блока>")
                 return
             idx = int(parts[1])
-            if 0 <= idx < len(questions):
-                block = questions[idx]["text"]
+            if 0 <= idx < len(self.catalog):
+                block = self.catalog[idx].texts
                 result = "\n".join([f"{i + 1}. {q}" for i, q in enumerate(block)])
                 await message.answer(f"Вопросы к блоку #{idx}\n{result}")
             else:
                 await message.answer("Нет такого блока.")
 
+        @self.router.message(Command("reload_questions"))
+        async def reload_questions_cmd(message: Message):
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            try:
+                catalog = self.catalog_store.reload()
+            except (OSError, ValueError) as e:
+                await message.answer(f"❌ Каталог не перезагружен, остается текущий: {e}")
+                return
+            self._ensure_answer_columns()
+            self.search.sync()
+            await message.answer(
+                f"✅ Каталог перезагружен: {len(catalog)} блоков, {catalog.total_questions} вопросов, версия {catalog.version}"
+            )
+
+        @self.router.message(Command("reminders"))
+        async def reminders_cmd(message: Message):
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            policies = self.reminders.policies()
+            if not policies:
+                await message.answer(
+                    "Политик напоминаний нет.\n"
+                    "/reminder_add <блок|poem> <минуты> <текст> — напомнить участникам, которые столько минут "
+                    "не отвечают в блоке (или не дошли до стихотворения, которого ждет их команда)"
+                )
+                return
+            lines = []
+            for policy in policies:
+                target = "стихотворение команды" if policy.kind == TEAM_BLOCKER else f"блок {policy.block}"
+                lines.append(f"#{policy.policy_id}: {target}, через {policy.after_minutes} мин — {policy.text}")
+            await message.answer(
+                "🔔 Политики напоминаний:\n" + "\n".join(lines) +
+                f"\n\nОтправлено напоминаний: {self.reminders.sent_count()}"
+            )
+
+        @self.router.message(Command("reminder_add"))
+        async def reminder_add_cmd(message: Message):
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            args = message.text.split(maxsplit=3)
+            if len(args) < 4 or not args[2].isdigit() or not (args[1] == "poem" or args[1].isdigit()):
+                await message.answer("Использование: /reminder_add <блок|poem> <минуты> <текст>")
+                return
+            if args[1] == "poem":
+                if self.catalog.poem_index is None:
+                    await message.answer("❌ В каталоге нет блока стихотворения")
+                    return
+                kind, block = TEAM_BLOCKER, self.catalog.poem_index
+            else:
+                kind, block = IDLE, int(args[1])
+                if block >= len(self.catalog):
+                    await message.answer(f"❌ Блока {block} нет, блоков в каталоге: {len(self.catalog)}")
+                    return
+            try:
+                policy_id = self.reminders.add_policy(kind, block, int(args[2]), args[3])
+            except ValueError as e:
+                await message.answer(f"❌ {e}")
+                return
+            await message.answer(f"✅ Напоминание #{policy_id} добавлено")
+
+        @self.router.message(Command("reminder_del"))
+        async def reminder_del_cmd(message: Message):
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            args = message.text.split()
+            if len(args) < 2 or not args[1].isdigit():
+                await message.answer("Использование: /reminder_del <id>")
+                return
+            if self.reminders.remove_policy(int(args[1])):
+                await message.answer(f"✅ Напоминание #{args[1]} удалено")
+            else:
+                await message.answer(f"❌ Напоминания #{args[1]} нет")
+
         @self.router.message(Command("finish_game"))
         async def finish_game_cmd(message: Message):
             if message.from_user.id != ADMIN_ID:
@@ -377,28 +632,34 @@ class InteractiveBot:
             
             # Получаем название команды из команды: /start_poem Красный
             args = message.text.split(maxsplit=1)
+            teams_text = "\n".join(f"• {team}" for team in self.event.teams)
             if len(args) < 2:
-                await message.answer("Использование: /start_poem <название_команды>\n\nДоступные команды:\n• Красный\n• Желтый\n• Зелёный\n• Синий")
+                await message.answer(f"Использование: /start_poem <название_команды>\n\nДоступные команды:\n{teams_text}")
                 return
             
             team_name = args[1].strip()
             
             # Проверяем, что команда существует
-            if team_name not in ["Красный", "Желтый", "Зелёный", "Синий"]:
-                await message.answer("❌ Неверное название команды!\n\nДоступные команды:\n• Красный\n• Желтый\n• Зелёный\n• Синий")
+            if team_name not in self.event.teams:
+                await message.answer(f"❌ Неверное название команды!\n\nДоступные команды:\n{teams_text}")
                 return
             
             try:
+                poem_index = self.catalog.poem_index
+                if poem_index is None:
+                    await message.answer("❌ В каталоге нет блока стихотворения.")
+                    return
+
                 # Проверяем, есть ли участники в команде и их текущий прогресс
-                self.cur.execute("""
+                rows = await self.reads.fetchall("""
                     SELECT COUNT(*) as total,
-                           SUM(CASE WHEN current_block >= 5 THEN 1 ELSE 0 END) as ready_for_poem,
-                           SUM(CASE WHEN current_block < 5 THEN 1 ELSE 0 END) as not_ready
+                           SUM(CASE WHEN current_block >= ? THEN 1 ELSE 0 END) as ready_for_poem,
+                           SUM(CASE WHEN current_block < ? THEN 1 ELSE 0 END) as not_ready
                     FROM answers
                     WHERE team = ?
-                """, (team_name,))
-                
-                result = self.cur.fetchone()
+                """, (poem_index, poem_index, team_name))
+
+                result = rows[0] if rows else None
                 if not result or result[0] == 0:
                     await message.answer(f"❌ В команде {team_name} нет участников!")
                     return
@@ -412,12 +673,12 @@ class InteractiveBot:
                     f"Запускаю стихотворение..."
                 )
                 
-                # Принудительно устанавливаем current_block = 5 для всех участников команды
+                # Принудительно переводим всех участников команды в блок стихотворения
                 self.cur.execute("""
                     UPDATE answers 
-                    SET current_block = 5 
+                    SET current_block = ? 
                     WHERE team = ?
-                """, (team_name,))
+                """, (poem_index, team_name))
                 self.conn.commit()
                 
                 await message.answer(f"✅ Все участники команды {team_name} переведены в блок стихотворения")
@@ -431,37 +692,37 @@ class InteractiveBot:
                     await message.answer(f"❌ Ошибка при запуске стихотворения для команды {team_name}.\nВозможно, процесс уже запущен или произошла ошибка.")
                     
             except Exception as e:
-                logging.error(f"Ошибка при запуске стихотворения для команды {team_name}: {e}", exc_info=True)
+                logger.error("Ошибка при запуске стихотворения для команды %s: %s", team_name, e, exc_info=True)
                 await message.answer(f"❌ Произошла ошибка при запуске стихотворения: {e}")
 
         @self.router.message(Command("export"))
         async def export_data(message: Message, state: FSMContext):
-            await self.admin_export.export_to_sheet(message)
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет прав на выполнение этой команды.")
+                return
+            self.jobs.submit(message.chat.id, "Экспорт в Google Таблицу", self.admin_export.export)
 
         @self.router.message(Command("download_all_photos"))
         async def download_all_photos_cmd(message: types.Message):
             if message.from_user.id != ADMIN_ID:
                 await message.answer("У вас нет доступа к этой команде.")
                 return
-            self.cur.execute("SELECT * FROM answers")
-            rows = self.cur.fetchall()
-            columns = [desc[0] for desc in self.cur.description]
-            photo_file_ids = []
-            for row in rows:
-                username = row[3] or "unknown"
-                for i, col in enumerate(columns):
-                    if col.startswith("answer_") and row[i]:
-                        if str(row[i]).startswith("photo_file_id:"):
-                            photo_file_id = str(row[i]).split(":", 1)[1]
-                            photo_file_ids.append((photo_file_id, username))
-            saved = 0
-            for file_id, username in photo_file_ids:
-                try:
-                    await self.download_photo_by_file_id(file_id, username)
-                    saved += 1
-                except Exception as e:
-                    await message.answer(f"Ошибка скачивания: {file_id} — {e}")
-            await message.answer(f"Готово! Скачано {saved} изображений.")
+
+            async def download_all(job: Job) -> str:
+                photos = await self._all_photos()
+                # Файлы скачиваются по одному: задача не должна занимать соединения бота
+                errors = []
+                job.total = len(photos)
+                for file_id, username, _ in photos:
+                    try:
+                        await self.download_photo_by_file_id(file_id, username)
+                    except Exception as e:
+                        logger.warning("Ошибка скачивания %s: %s", file_id, e)
+                        errors.append(file_id)
+                    job.advance()
+                return f"Скачано {len(photos) - len(errors)} изображений, ошибок: {len(errors)}."
+
+            self.jobs.submit(message.chat.id, "Скачивание всех фото", download_all)
 
         @self.router.message(Command("get_photo"))
         async def get_photo_by_id_cmd(message: types.Message):
@@ -499,40 +760,29 @@ class InteractiveBot:
                 await message.answer("У вас нет доступа к этой команде.")
                 return
 
-            # Поиск всех фото в БД
-            self.cur.execute("SELECT * FROM answers")
-            rows = self.cur.fetchall()
-            columns = [desc[0] for desc in self.cur.description]
-
-            photo_data = []
-            for row in rows:
-                username = row[3] or "unknown"
-                user_id = row[1]
-                for i, col in enumerate(columns):
-                    if col.startswith("answer_") and row[i]:
-                        if str(row[i]).startswith("photo_file_id:"):
-                            photo_file_id = str(row[i]).split(":", 1)[1]
-                            photo_data.append((photo_file_id, username, user_id))
-
+            photo_data = await self._all_photos()
             if not photo_data:
                 await message.answer("В базе данных нет фотографий.")
                 return
 
-            await message.answer(f"Найдено {len(photo_data)} фотографий. Отправляю...")
-
-            sent = 0
-            for file_id, username, user_id in photo_data:
-                try:
-                    await self.bot.send_photo(
-                        chat_id=message.chat.id,
-                        photo=file_id,
-                        caption=f"👤 {username} (ID: {user_id})\n📷 File ID: {file_id}"
-                    )
-                    sent += 1
-                except Exception as e:
-                    await message.answer(f"Ошибка отправки фото от {username}: {e}")
+            async def send_all(job: Job) -> str:
+                # Фото идут в один чат - по одному, чтобы не упереться в лимит Telegram на чат
+                sent = 0
+                job.total = len(photo_data)
+                for file_id, username, user_id in photo_data:
+                    try:
+                        await self.bot.send_photo(
+                            chat_id=message.chat.id,
+                            photo=file_id,
+                            caption=f"👤 {username} (ID: {user_id})\n📷 File ID: {file_id}"
+                        )
+                        sent += 1
+                    except Exception as e:
+                        logger.warning("Ошибка отправки фото от %s: %s", username, e)
+                    job.advance()
+                return f"Отправлено {sent} из {len(photo_data)} фотографий."
 
-            await message.answer(f"✅ Отправлено {sent} из {len(photo_data)} фотографий.")
+            self.jobs.submit(message.chat.id, f"Отправка {len(photo_data)} фото", send_all)
 
         @self.router.message(Command("send_schedule"))
         async def send_schedule_cmd(message: Message):
@@ -542,39 +792,28 @@ class InteractiveBot:
                 return
 
             # Получаем всех зарегистрированных пользователей
-            self.cur.execute("SELECT DISTINCT chat_id, user_id FROM answers WHERE chat_id IS NOT NULL")
-            users = self.cur.fetchall()
+            users = await self.reads.fetchall("SELECT DISTINCT chat_id, user_id FROM answers WHERE chat_id IS NOT NULL")
 
             if not users:
                 await message.answer("Нет зарегистрированных участников.")
                 return
 
-            sent_count = 0
-            error_count = 0
-
-            for chat_id, user_id in users:
-                try:
-                    await self.bot.send_message(
-                        chat_id=chat_id,
-                        text=SCHEDULE_TEXT,
-                        parse_mode="HTML"
-                    )
-                    sent_count += 1
-                except Exception as e:
-                    error_count += 1
-                    logging.error(f"Ошибка отправки расписания пользователю {user_id}: {e}")
+            async def broadcast(job: Job) -> str:
+                # Неотправленные сообщения попадают в очередь повторной отправки (/dlq)
+                results = await self.jobs.each(
+                    job, users,
+                    lambda user: self.outbox.send(user[0], self.event.schedule_text, parse_mode="HTML")
+                )
+                error_count = sum(isinstance(result, Exception) for result in results)
+                return (f"Отправлено: {len(results) - error_count}, "
+                        f"ошибок: {error_count} (отложены для повторной отправки, см. /dlq)")
 
-            await message.answer(
-                f"📊 <b>Результат рассылки расписания:</b>\n"
-                f"✅ Отправлено: {sent_count} пользователям\n"
-                f"❌ Ошибок: {error_count}",
-                parse_mode="HTML"
-            )
+            self.jobs.submit(message.chat.id, f"Рассылка расписания ({len(users)} участникам)", broadcast)
 
         @self.router.message(Command("schedule"))
         async def show_schedule_cmd(message: Message):
             """Команда для просмотра расписания (доступна всем)"""
-            await message.answer(SCHEDULE_TEXT, parse_mode="HTML")
+            await message.answer(self.event.schedule_text, parse_mode="HTML")
 
 
         # 3. ОБРАБОТЧИКИ СОСТОЯНИЙ (callback_query должны быть перед message для того же состояния)
@@ -583,8 +822,12 @@ class InteractiveBot:
             choice = callback.data.split("_")[1]
             data = await state.get_data()
             chat_id, user_id = data["chat_id"], data["user_id"]
+            self.cur.execute("SELECT team FROM answers WHERE chat_id=? AND user_id=?", (chat_id, user_id))
+            previous = self.cur.fetchone()
             self.cur.execute("UPDATE answers SET team=? WHERE chat_id=? AND user_id=?", (choice, chat_id, user_id))
             self.conn.commit()
+            if previous:
+                self.stats.record_team(previous[0], choice)
             await state.update_data(team=choice)
             await callback.message.edit_reply_markup(reply_markup=None)
             await callback.message.answer(f"Вы выбрали вариант: {choice}")
@@ -601,14 +844,16 @@ class InteractiveBot:
 
             if existing:
                 self.cur.execute(
-                    "UPDATE answers SET username=?, full_name=?, fio=?, is_active=0, last_activity=CURRENT_TIMESTAMP WHERE user_id=? AND chat_id=?",
-                    (user.username or "", user.full_name or "", fio, user.id, chat_id)
+                    "UPDATE answers SET username=?, full_name=?, fio=?, is_active=0, last_activity=? WHERE user_id=? AND chat_id=?",
+                    (user.username or "", user.full_name or "", fio, self.clock.db_now(), user.id, chat_id)
                 )
             else:
                 self.cur.execute(
-                    "INSERT INTO answers (user_id, chat_id, username, full_name, fio, team, current_block, is_active) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                    (user.id, chat_id, user.username or "", user.full_name or "", fio, "", 0, 0)
+                    "INSERT INTO answers (user_id, chat_id, username, full_name, fio, team, current_block, is_active, last_activity) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (user.id, chat_id, user.username or "", user.full_name or "", fio, "", 0, 0, self.clock.db_now())
                 )
+                self.stats.record_registration()
             self.conn.commit()
 
             await state.update_data(fio=fio, chat_id=chat_id, user_id=user.id)
@@ -623,7 +868,7 @@ class InteractiveBot:
         async def registration_complete(callback: CallbackQuery, state: FSMContext):
             await callback.message.edit_reply_markup(reply_markup=None)
             await callback.message.answer("Погнали! 🚀")
-            await self.start_quiz(callback.message, state)
+            await self.start_quiz(callback.message, state, callback.from_user.id)
             if not self.scheduler.running:
                 self.schedule_all_blocks()
 
@@ -633,41 +878,30 @@ class InteractiveBot:
 
         @self.router.message(TeamPoemState.waiting_for_poem_line)
         async def handle_poem_line(message: types.Message, state: FSMContext):
-            logging.info(
-                f"🎭 [POEM] Получено сообщение в состоянии waiting_for_poem_line от user_id={message.from_user.id}: {message.text}")
+            logger.debug("🎭 [POEM] Получено сообщение в состоянии waiting_for_poem_line от user_id=%s", message.from_user.id)
 
             # Проверяем, что пользователь действительно участвует в стихотворении
-            if not self.poem_manager.is_user_in_poem_process(message.from_user.id):
-                logging.warning(f"🎭 [POEM] Пользователь {message.from_user.id} не участвует в процессе стихотворения, но находится в состоянии waiting_for_poem_line")
+            if not self.poem_manager.is_user_in_poem_process(message.from_user.id, message.chat.id):
+                logger.warning("🎭 [POEM] Пользователь %s не участвует в процессе стихотворения, но находится в состоянии waiting_for_poem_line", message.from_user.id)
                 await state.clear()
                 await message.answer("❌ Произошла ошибка с состоянием. Попробуйте начать заново.")
                 return
 
-            logging.info(f"🎭 [POEM] Пользователь {message.from_user.id} участвует в процессе стихотворения, обрабатываем строку...")
+            logger.info("🎭 [POEM] Пользователь %s участвует в процессе стихотворения, обрабатываем строку...", message.from_user.id)
             result = await self.poem_manager.process_poem_line(message, state)
             
             if result:
-                logging.info(f"🎭 [POEM] Строка стихотворения от пользователя {message.from_user.id} успешно обработана")
+                logger.info("🎭 [POEM] Строка стихотворения от пользователя %s успешно обработана", message.from_user.id)
                 
-                # Если result - это список завершивших пользователей, очищаем их из active_blocks
+                # Если result - это список завершивших пользователей, их сессии уже сняты poem_manager
                 if isinstance(result, list) and result:
-                    logging.info(f"🎭 [POEM] Завершили стихотворение пользователи: {result}")
-                    for completed_user_id in result:
-                        # Находим chat_id для каждого пользователя
-                        self.cur.execute("SELECT chat_id FROM answers WHERE user_id = ?", (completed_user_id,))
-                        chat_result = self.cur.fetchone()
-                        if chat_result:
-                            chat_id = chat_result[0]
-                            user_key = f"{chat_id}_{completed_user_id}"
-                            if user_key in self.active_blocks:
-                                del self.active_blocks[user_key]
-                                logging.info(f"🎭 [POEM] Убран пользователь {completed_user_id} из active_blocks")
+                    logger.info("🎭 [POEM] Завершили стихотворение пользователи: %s", result)
                 
                 # НЕ проверяем завершение здесь - это должно происходить только после завершения всего стихотворения
                 # Возвращаем True чтобы показать что строка обработана успешно
                 return True
             else:
-                logging.error(f"🎭 [POEM] Ошибка при обработке строки стихотворения от пользователя {message.from_user.id}")
+                logger.error("🎭 [POEM] Ошибка при обработке строки стихотворения от пользователя %s", message.from_user.id)
 
         # 4. УНИВЕРСАЛЬНЫЙ ОБРАБОТЧИК - ОБЯЗАТЕЛЬНО ПОСЛЕДНИЙ!
         @self.router.message()
@@ -675,68 +909,37 @@ class InteractiveBot:
             current_state = await state.get_state()
             #
             # Добавляем логирование для отладки
-            logging.info(
-                f"Универсальный обработчик: user_id={message.from_user.id}, state={current_state}, text={message.text[:50] if message.text else 'no text'}")
+            logger.debug("Универсальный обработчик: user_id=%s, state=%s", message.from_user.id, current_state)
             
-            # Проверяем active_blocks для отладки
-            user_key = f"{message.chat.id}_{message.from_user.id}"
-            if user_key in self.active_blocks:
-                logging.info(f"🎭 [POEM] Пользователь {message.from_user.id} найден в active_blocks с индексом {self.active_blocks[user_key]}")
-            else:
-                logging.info(f"🎭 [POEM] Пользователь {message.from_user.id} НЕ найден в active_blocks")
+            # Проверяем сессию для отладки
+            key = (message.chat.id, message.from_user.id)
+            in_poem = self.poem_manager.is_user_in_poem_process(message.from_user.id, message.chat.id)
+            logger.debug("🎭 [POEM] Пользователь %s: активный блок %s", message.from_user.id, self.sessions.block(key))
             #
-            # Дополнительная проверка: если пользователь в блоке стихотворения, но состояние потеряно
-            if current_state is None:
-                self.cur.execute("SELECT current_block FROM answers WHERE chat_id=? AND user_id=?", 
-                                (message.chat.id, message.from_user.id))
-                block_result = self.cur.fetchone()
-                
-                if block_result and block_result[0] == 5:  # Блок стихотворения
-                    # Проверяем, участвует ли пользователь в процессе стихотворения
-                    if self.poem_manager.is_user_in_poem_process(message.from_user.id):
-                        logging.info(f"🎭 [POEM] Восстановление состояния стихотворения для пользователя {message.from_user.id} (состояние None, но участвует в процессе)")
-                        user_key = f"{message.chat.id}_{message.from_user.id}"
-                        
-                        # Добавляем в active_blocks если его там нет
-                        if user_key not in self.active_blocks:
-                            self.active_blocks[user_key] = 5
-                            logging.info(f"🎭 [POEM] Пользователь {message.from_user.id} добавлен в active_blocks")
-                        
-                        # НЕ отправляем сообщение "Продолжайте стихотворение" - это дублирует основное сообщение
-                        # Восстанавливаем состояние и передаем обработку в poem_manager
-                        await state.set_state(TeamPoemState.waiting_for_poem_line)
-                        current_state = await state.get_state()
-                        # НЕ возвращаемся, а продолжаем обработку сообщения
-                    else:
-                        logging.info(f"🎭 [POEM] Пользователь {message.from_user.id} не участвует в процессе стихотворения, пропускаем восстановление")
+            # Дополнительная проверка: если пользователь участвует в стихотворении, но состояние потеряно
+            if current_state is None and in_poem:
+                logger.info("🎭 [POEM] Восстановление состояния стихотворения для пользователя %s (состояние None, но участвует в процессе)", message.from_user.id)
+                if self.sessions.block(key) is None:
+                    self.sessions.set_block(key, self.catalog.poem_index)
+                # Восстанавливаем состояние и передаем обработку в poem_manager
+                await state.set_state(TeamPoemState.waiting_for_poem_line)
+                current_state = await state.get_state()
             #
             # Проверяем, не находится ли пользователь в состоянии ожидания строки стихотворения
             if current_state == TeamPoemState.waiting_for_poem_line.state:
-                logging.info(f"🎭 [POEM] Универсальный обработчик: восстановление состояния стихотворения для пользователя {message.from_user.id}")
+                logger.info("🎭 [POEM] Универсальный обработчик: восстановление состояния стихотворения для пользователя %s", message.from_user.id)
                 # Передаем обработку в poem_manager
                 result = await self.poem_manager.process_poem_line(message, state)
-                if result:
-                    # Если result - это список завершивших пользователей, очищаем их из active_blocks
-                    if isinstance(result, list) and result:
-                        logging.info(f"🎭 [POEM] Универсальный обработчик: завершили стихотворение пользователи: {result}")
-                        for completed_user_id in result:
-                            # Находим chat_id для каждого пользователя
-                            self.cur.execute("SELECT chat_id FROM answers WHERE user_id = ?", (completed_user_id,))
-                            chat_result = self.cur.fetchone()
-                            if chat_result:
-                                chat_id = chat_result[0]
-                                user_key = f"{chat_id}_{completed_user_id}"
-                                if user_key in self.active_blocks:
-                                    del self.active_blocks[user_key]
-                                    logging.info(f"🎭 [POEM] Универсальный обработчик: убран пользователь {completed_user_id} из active_blocks")
-                    
+                if isinstance(result, list) and result:
+                    logger.info("🎭 [POEM] Универсальный обработчик: завершили стихотворение пользователи: %s", result)
+
                 # НЕ проверяем завершение здесь - это должно происходить только после завершения всего стихотворения
                 return
             #
             # Проверяем, завершил ли пользователь все задания
             # НО сначала проверяем, не участвует ли он в процессе стихотворения
-            if self.poem_manager.is_user_in_poem_process(message.from_user.id):
-                logging.info(f"🎭 [POEM] Пользователь {message.from_user.id} участвует в процессе стихотворения, пропускаем проверку завершения")
+            if in_poem:
+                logger.info("🎭 [POEM] Пользователь %s участвует в процессе стихотворения, пропускаем проверку завершения", message.from_user.id)
                 # Пропускаем проверку завершения для участников стихотворения
                 pass
             else:
@@ -746,7 +949,7 @@ class InteractiveBot:
                 )
                 result = self.cur.fetchone()
 
-                if result and result[0] >= 6:  # Пользователь завершил все задания
+                if result and result[0] >= len(self.catalog):  # Пользователь завершил все задания
                     await message.answer(
                         "📊 Вы уже завершили все задания корпоративной игры!\n\n"
                         "Ожидайте объявления результатов в конце мероприятия. "
@@ -763,55 +966,137 @@ class InteractiveBot:
             result = self.cur.fetchone()
 
             if result and result[0] == 1:
-                user_key = f"{message.chat.id}_{message.from_user.id}"
+                # Состояние FSM потеряно - восстанавливаем его обработчиком типа блока
+                block_index = self.sessions.block(key)
+                if block_index is None:
+                    logger.warning("Пользователь %s активен в БД, но нет активного блока", message.from_user.id)
+                    block_index = result[1]
+                if block_index < len(self.catalog):
+                    block = self.catalog[block_index]
+                    await self.block_types[block.kind].resume(message, state, block)
+
+    async def _search_page(self, query: str, page: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        """Страница результатов /search: текст (HTML) и кнопки перелистывания"""
+        started = time.perf_counter()
+        total, hits = await self.search.search(query, page, SEARCH_PAGE_SIZE)
+        elapsed = (time.perf_counter() - started) * 1000
+        if not total:
+            return f"🔎 По запросу «{html.escape(query)}» ничего не найдено.", None
+
+        questions = {q.column: q.text for block in self.catalog.blocks for q in block.questions}
+        pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+        lines = [f"🔎 «{html.escape(query)}»: найдено {total}, страница {page + 1} из {pages} ({elapsed:.0f} мс)\n"]
+        for number, hit in enumerate(hits, start=page * SEARCH_PAGE_SIZE + 1):
+            who = html.escape(hit.fio or "—")
+            if hit.username:
+                who += f" (@{html.escape(hit.username)})"
+            if hit.column is None:
+                where = f"стихотворение, строка {hit.line_number}"
+            else:
+                question = questions.get(hit.column, f"вопрос {hit.column}")
+                where = html.escape(question[:60] + ("…" if len(question) > 60 else ""))
+            lines.append(f"{number}. <b>{who}</b>, {html.escape(hit.team or '—')}\n<i>{where}</i>\n{hit.snippet}\n")
+
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"search:{page - 1}"))
+        if page + 1 < pages:
+            buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"search:{page + 1}"))
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+        return "\n".join(lines), keyboard
+
+    async def _latency_text(self, block: Optional[int]) -> str:
+        """Текст /latency (HTML): без номера - по блокам и командам, с номером - по вопросам блока"""
+        def seconds(value: Optional[float]) -> str:
+            if value is None:
+                return "—"
+            if value < 10:
+                return f"{value:.1f} с"
+            return f"{value:.0f} с" if value < 120 else f"{value / 60:.1f} мин"
+
+        def describe(name: str, summary) -> str:
+            return (f"{name}: ответили {summary.answered} из {summary.sent}, медиана {seconds(summary.median)}, "
+                    f"90% — до {seconds(summary.p90)} (доставка {seconds(summary.delivery_median)})")
+
+        if block is None:
+            groups = await self.latency_report.by_block()
+            if not groups:
+                return "⏱ Данных о времени ответа пока нет."
+            lines = ["⏱ <b>Время от публикации вопроса до ответа</b>\n", "По блокам:"]
+            for index, summary in groups.items():
+                title = self.catalog[index].title if index < len(self.catalog) else f"Блок №{index + 1}"
+                lines.append(f"  {describe(html.escape(title), summary)}")
+            lines.append("\nПо командам:")
+            lines += [f"  {describe(html.escape(team or '—'), summary)}"
+                      for team, summary in (await self.latency_report.by_team()).items()]
+            lines.append("\n/latency [номер блока] — по вопросам блока")
+            return "\n".join(lines)
+
+        target = self.catalog[block]
+        questions = await self.latency_report.by_question(block)
+        if not questions:
+            return f"⏱ По блоку «{html.escape(target.title)}» данных пока нет."
+        lines = [f"⏱ <b>{html.escape(target.title)}</b>\n"]
+        if target.kind == "poem":
+            # Шаг стихотворения - номер строки (с 1), шаг блока вопросов - индекс вопроса (с 0)
+            lines.append(f"Время на ход: {self.poem_manager.response_timeout} мин\n")
+            lines += [f"  {describe(f'Строка {step}', summary)}" for step, summary in questions.items()]
+        else:
+            lines += [f"  {describe(f'Вопрос {step + 1}', summary)}" for step, summary in questions.items()]
+        lines.append("\nПо командам:")
+        lines += [f"  {describe(html.escape(team or '—'), summary)}"
+                  for team, summary in (await self.latency_report.by_team(block)).items()]
+        return "\n".join(lines)
+
+    _stats_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔄 Обновить", callback_data="stats:refresh")]
+    ])
+
+    def _stats_text(self) -> str:
+        """Текст /stats (HTML) из счетчиков в памяти - без запросов к базе"""
+        stats = self.stats
+        lines = [f"📊 <b>{html.escape(self.event.title)}</b> — {self.clock.now():%H:%M:%S}\n",
+                 f"👥 Зарегистрировано: {stats.registered}"]
+        for team, count in sorted(stats.teams.items()):
+            if count:
+                lines.append(f"  • {html.escape(team)}: {count}")
+
+        lines.append("\n🧩 Блоки (завершили / закрыто по бездействию):")
+        for index, block in enumerate(self.catalog.blocks):
+            expired = f" / {stats.expired[index]}" if stats.expired[index] else ""
+            lines.append(f"  {index + 1}. {html.escape(block.title)}: {stats.completed[index]}{expired}")
+
+        in_blocks, in_poems = self.sessions.count()
+        lines.append(f"\n⏳ Активных сессий: в блоках {in_blocks}, в стихотворениях {in_poems}, "
+                     f"со сроком бездействия {len(self.expiry)}")
+
+        lines.append(f"\n📝 Стихотворений завершено: {stats.poems_completed}")
+        for team, poem in sorted(self.poem_manager.team_poems.items()):
+            lines.append(f"  • {html.escape(team)}: строк {len(poem.lines)} из {len(poem.members)}")
+
+        median = stats.answer_times.median()
+        if median is None:
+            lines.append("\n⏱ Время ответа: пока нет данных")
+        else:
+            p90 = stats.answer_times.percentile(0.9)
+            lines.append(f"\n⏱ Время ответа: медиана {median:.1f} с, 90% — до {p90:.1f} с "
+                         f"(ответов: {stats.answer_times.total})")
+        return "\n".join(lines)
 
-                if user_key in self.active_blocks:
-                    active_block_index = self.active_blocks[user_key]
-                    
-                    # Если это блок стихотворения, восстанавливаем состояние стихотворения
-                    if active_block_index == 5:
-                        logging.info(f"🎭 [POEM] Восстановление состояния стихотворения для пользователя {message.from_user.id}")
-                        await state.set_state(TeamPoemState.waiting_for_poem_line)
-                        logging.info(state.get_state())
-                        # НЕ отправляем сообщение "Продолжайте стихотворение" - это дублирует основное сообщение
-                        # Восстанавливаем состояние и передаем обработку в poem_manager
-                        # НЕ возвращаемся, а продолжаем обработку сообщения
-                    
-                    # Для обычных блоков вопросов
-                    data = await state.get_data()
-
-                    if not data.get("block_questions") or data.get("quiz_index") != active_block_index:
-                        questions_block = questions[active_block_index]["text"]
-                        await state.set_data({
-                            "chat_id": message.chat.id,
-                            "user_id": message.from_user.id,
-                            "block_questions": questions_block,
-                            "block_step": 0,
-                            "answers": [],
-                            "quiz_index": active_block_index,
-                        })
-                        logging.info(
-                            f"Восстановлено состояние для пользователя {message.from_user.id}, блок {active_block_index}")
+    async def _all_photos(self) -> List[Tuple[str, str, int]]:
+        """Все фото из ответов: (file_id, username, user_id)"""
+        columns, rows = await self.reads.fetch("SELECT * FROM answers")
 
-                    await state.set_state(BotState.asking)
-                    await self.process_answer(message, state)
-                else:
-                    logging.warning(f"Пользователь {message.from_user.id} активен в БД, но нет активного блока")
-                    
-                    # Проверяем, может ли это быть блок стихотворения
-                    if result[1] == 5:  # current_block == 5
-                        # Проверяем, участвует ли пользователь в процессе стихотворения
-                        if self.poem_manager.is_user_in_poem_process(message.from_user.id):
-                            logging.info(f"🎭 [POEM] Восстановление состояния стихотворения для пользователя {message.from_user.id} (блок 5, участвует в процессе)")
-                            # Добавляем пользователя в active_blocks
-                            self.active_blocks[user_key] = 5
-                            
-                            # НЕ отправляем сообщение "Продолжайте стихотворение" - это дублирует основное сообщение
-                            # Просто восстанавливаем состояние и передаем обработку в poem_manager
-                            await state.set_state(TeamPoemState.waiting_for_poem_line)
-                            return
-                        else:
-                            logging.info(f"🎭 [POEM] Пользователь {message.from_user.id} не участвует в процессе стихотворения, пропускаем восстановление")
+        photos = []
+        for row in rows:
+            username = row[3] or "unknown"
+            user_id = row[1]
+            for i, col in enumerate(columns):
+                if col.startswith("answer_") and row[i]:
+                    if str(row[i]).startswith("photo_file_id:"):
+                        photo_file_id = str(row[i]).split(":", 1)[1]
+                        photos.append((photo_file_id, username, user_id))
+        return photos
 
     async def download_photo_by_file_id(self, photo_file_id, username):
         file = await self.bot.get_file(photo_file_id)
@@ -849,6 +1134,17 @@ class InteractiveBot:
             types.BotCommand(command="bd_users", description="👨‍💼 Посмотреть данные из БД"),
             types.BotCommand(command="bd_clear", description="‍👨‍💼 Удалить данные из БД"),
             types.BotCommand(command="finish_game", description="Завершить игру досрочно"),
+            types.BotCommand(command="reload_questions", description="Перечитать каталог вопросов"),
+            types.BotCommand(command="reminders", description="Напоминания отстающим"),
+            types.BotCommand(command="events", description="Список мероприятий"),
+            types.BotCommand(command="queues", description="Очередь исходящих сообщений"),
+            types.BotCommand(command="dlq", description="Неотправленные сообщения"),
+            types.BotCommand(command="jobs", description="Фоновые задачи"),
+            types.BotCommand(command="snapshots", description="Снимки базы"),
+            types.BotCommand(command="search", description="Поиск по ответам"),
+            types.BotCommand(command="stats", description="Статистика игры"),
+            types.BotCommand(command="latency", description="Время ответа участников"),
+            types.BotCommand(command="import", description="Загрузить список участников"),
         ]
 
         await self.bot.set_my_commands(
@@ -858,9 +1154,44 @@ class InteractiveBot:
 
 # -----------------------------------------------------------------------------------------------------------------
     async def name(self, message: Message):
-        await message.answer("Дорогой коллега, приветствую тебя в корпоративной игре, которая проводится в рамках мероприятия «Традиции и трансформация». 🎉")
+        await message.answer(f"Дорогой коллега, приветствую тебя в корпоративной игре, которая проводится в рамках мероприятия «{self.event.title}». 🎉")
         await message.answer("Пожалуйста, введите своё ФИ для регистрации участия:")
 
+    async def preregistered(self, message: Message, state: FSMContext) -> bool:
+        """
+        Регистрация по заранее загруженному списку: участник с известным username
+        сразу получает ФИО и команду и переходит к правилам. False - его нет в списке
+        """
+        user = message.from_user
+        chat_id = message.chat.id
+        entry = self.roster.claim(user.username, user.id)
+        if entry is None:
+            return False
+
+        self.cur.execute("SELECT team FROM answers WHERE user_id=? AND chat_id=?", (user.id, chat_id))
+        existing = self.cur.fetchone()
+        if existing:
+            self.cur.execute(
+                "UPDATE answers SET username=?, full_name=?, fio=?, team=?, is_active=0, last_activity=? "
+                "WHERE user_id=? AND chat_id=?",
+                (user.username or "", user.full_name or "", entry.fio, entry.team, self.clock.db_now(), user.id, chat_id)
+            )
+        else:
+            self.cur.execute(
+                "INSERT INTO answers (user_id, chat_id, username, full_name, fio, team, current_block, is_active, last_activity) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user.id, chat_id, user.username or "", user.full_name or "", entry.fio, entry.team, 0, 0, self.clock.db_now())
+            )
+            self.stats.record_registration()
+        self.conn.commit()
+        self.stats.record_team(existing[0] if existing else None, entry.team)
+
+        await state.update_data(fio=entry.fio, chat_id=chat_id, user_id=user.id, team=entry.team)
+        await message.answer(f"Дорогой коллега, приветствую тебя в корпоративной игре, которая проводится в рамках мероприятия «{self.event.title}». 🎉")
+        await message.answer(f"Вы уже зарегистрированы: {entry.fio}, команда {entry.team}.")
+        await self.run_quiz(message, state)
+        return True
+
     async def team(self, message: Message, state: FSMContext):
         await message.answer(f"Теперь выберите цвет своего браслета, так мы сможем закрепить тебя в качестве участника за одной из команд:", reply_markup=self.keyboard)
         await state.set_state(BotState.waiting_for_team)
@@ -878,56 +1209,50 @@ class InteractiveBot:
                              f"Если готов(а) жми ДА", reply_markup=keyboard_yes)
         await state.set_state(BotState.waiting_for_run_quiz)
 
-    async def start_quiz(self, message: types.Message, state: FSMContext):
+    async def start_quiz(self, message: types.Message, state: FSMContext, user_id: int):
+        # message - сообщение бота с кнопкой, поэтому user_id передается отдельно
         index = 0
-        block = questions[index]["text"]
+        block = self.catalog[index]
 
-        user_key = f"{message.chat.id}_{message.from_user.id}"
-        self.active_blocks[user_key] = index
+        self.sessions.set_block((message.chat.id, user_id), index)
 
         # Обновляем статус в базе данных
         self.cur.execute(
-            "UPDATE answers SET current_block=?, is_active=1, last_activity=CURRENT_TIMESTAMP WHERE chat_id=? AND user_id=?",
-            (index, message.chat.id, message.from_user.id)
+            "UPDATE answers SET current_block=?, is_active=1, last_activity=? WHERE chat_id=? AND user_id=?",
+            (index, self.clock.db_now(), message.chat.id, user_id)
         )
         self.conn.commit()
 
-        await state.update_data(
-            chat_id=message.chat.id,
-            user_id=message.from_user.id,
-            block_questions=block,
-            block_step=0,
-            answers=[],
-            quiz_index=index
-        )
-        await message.answer(block[0])
+        await state.update_data(_quiz_session(index))
+        delivery = self.outbox.send(message.chat.id, block.questions[0].text)
+        self.latency.published((message.chat.id, user_id), index, 0, delivery)
         await state.set_state(BotState.asking)
+        self.expiry.touch((message.chat.id, user_id))
 
     async def save_answers(self, message: types.Message, answers, state: FSMContext):
         data = await state.get_data()
-        chat_id = message.chat.id
-        user_id = message.from_user.id
-        index = data.get("quiz_index", 0)
+        self._store_answers(message.chat.id, message.from_user.id, data.get("quiz_index", 0), answers)
 
-        start_answer_index = sum(len(q["text"]) for q in questions[:index])
-        questions_count = len(questions[index]["text"])
-        answers_padded = answers + [""] * (questions_count - len(answers))
+    def _store_answers(self, chat_id: int, user_id: int, index: int, answers, expired: bool = False):
+        """Записывает ответы блока (недостающие - пустыми) и переводит участника к следующему блоку"""
+        block = self.catalog[index]
+        answers_padded = answers + [""] * (len(block) - len(answers))
 
         set_clause_parts = []
         params = []
-        for i in range(questions_count):
-            col_num = start_answer_index + i + 1
-            set_clause_parts.append(f"answer_{col_num}=?")
-            params.append(answers_padded[i])
+        for question, answer in zip(block.questions, answers_padded):
+            set_clause_parts.append(f"answer_{question.column}=?")
+            params.append(answer)
 
         set_clause = ', '.join(set_clause_parts)
-        params.extend([index + 1, chat_id, user_id])
+        params.extend([index + 1, self.clock.db_now(), chat_id, user_id])
 
         self.cur.execute(
-            f"UPDATE answers SET {set_clause}, current_block=?, last_activity=CURRENT_TIMESTAMP WHERE chat_id=? AND user_id=?",
+            f"UPDATE answers SET {set_clause}, current_block=?, last_activity=? WHERE chat_id=? AND user_id=?",
             params
         )
         self.conn.commit()
+        self.stats.record_block(index, expired)
 
     async def finish_bot_work(self, message: Message = None):
         """Завершает работу бота и отправляет финальные сообщения всем участникам"""
@@ -935,8 +1260,7 @@ class InteractiveBot:
             self.bot_active = False
 
             # Получаем всех зарегистрированных участников
-            self.cur.execute("SELECT DISTINCT chat_id, user_id, fio FROM answers WHERE chat_id IS NOT NULL")
-            users = self.cur.fetchall()
+            users = await self.reads.fetchall("SELECT DISTINCT chat_id, user_id, fio FROM answers WHERE chat_id IS NOT NULL")
 
             final_message = (
                 "Дорогой коллега, благодарим тебя за активное участие в нашей корпоративной игре! 🎊 🎉\n\n"
@@ -944,22 +1268,21 @@ class InteractiveBot:
                 "Ожидай результаты и награждение 🏆 — они будут объявлены совсем скоро."
             )
 
-            # Отправляем финальное сообщение всем участникам
-            sent_count = 0
-            for chat_id, user_id, fio in users:
-                try:
-                    await self.bot.send_message(chat_id, final_message)
-                    sent_count += 1
-                except Exception as e:
-                    logging.error(f"Ошибка отправки финального сообщения пользователю {fio} ({user_id}): {e}")
+            # Отправляем финальное сообщение всем участникам; неотправленные повторит очередь /dlq
+            results = await asyncio.gather(
+                *(self.outbox.send(chat_id, final_message) for chat_id, _, _ in users),
+                return_exceptions=True
+            )
+            sent_count = sum(not isinstance(result, Exception) for result in results)
 
             # Останавливаем планировщик
             if self.scheduler.running:
                 self.scheduler.shutdown()
-                logging.info("Планировщик остановлен")
+                logger.info("Планировщик остановлен")
 
             # Очищаем активные блоки
-            self.active_blocks.clear()
+            self.sessions.release_all_blocks()
+            self.expiry.clear()
 
             # Обновляем статус всех пользователей в БД
             self.cur.execute("UPDATE answers SET is_active=0 WHERE is_active=1")
@@ -968,52 +1291,164 @@ class InteractiveBot:
             if message:
                 await message.answer(f"✅ Игра завершена!")
 
-            logging.info(f"Игра завершена. Финальное сообщение отправлено {sent_count} участникам.")
+            logger.info(f"Игра завершена. Финальное сообщение отправлено {sent_count} участникам.")
 
         except Exception as e:
-            logging.error(f"Ошибка при завершении игры: {e}")
+            logger.error(f"Ошибка при завершении игры: {e}")
             if message:
                 await message.answer("❌ Произошла ошибка при завершении игры.")
 
+    async def _expire_session(self, key: Tuple[int, int]):
+        """Сессия блока вопросов истекла: сохраняем то, что участник успел ответить, и освобождаем его"""
+        chat_id, user_id = key
+        block_index = self.sessions.block(key)
+        if block_index is None or self.catalog[block_index].kind != "quiz":
+            return
+
+        state = user_state(self.bot, self.dp.storage, chat_id, user_id)
+        data = await state.get_data()
+        answers = data.get("answers", []) if data.get("quiz_index") == block_index else []
+
+        self.sessions.release_block(key)
+        self.latency.abandon(key)
+        self.cur.execute("UPDATE answers SET is_active=0 WHERE chat_id=? AND user_id=?", (chat_id, user_id))
+        self._store_answers(chat_id, user_id, block_index, answers, expired=True)
+        await state.clear()
+
+        logger.info("Сессия пользователя %s в блоке %s истекла, сохранено ответов: %s", user_id, block_index, len(answers))
+        if self.nudge_expired:
+            self.outbox.send(
+                chat_id,
+                "⏰ Вы давно не отвечали, поэтому этот блок вопросов закрыт. "
+                "Ответы, которые вы успели дать, сохранены.\n"
+                "Следующий блок придет по расписанию."
+            )
+
+    async def recover(self):
+        """
+        Теплый перезапуск: восстанавливает состояние игры из БД.
+        Активным участникам блока вопросов блок выдается заново с первого вопроса
+        (ответы внутри блока сохраняются только по его завершении), стихотворения
+        продолжаются с текущего участника, а зависшие is_active=1 сбрасываются,
+        чтобы планировщик снова их видел.
+        """
+        started_at = time.perf_counter()
+        self.expiry.start()
+        self.snapshots.start()
+        self.cur.execute(
+            "SELECT chat_id, user_id, current_block, is_active, last_activity FROM answers "
+            "WHERE current_block IS NOT NULL"
+        )
+        users_data = self.cur.fetchall()
+        if not users_data:
+            return
+
+        await self.poem_manager.restore()
+
+        catalog = self.catalog
+        quiz_sessions = []
+        abandoned = []
+        stale = []
+        expired_before = self.clock.now() - timedelta(minutes=SESSION_TIMEOUT_MINUTES)
+        for chat_id, user_id, current_block, is_active, last_activity in users_data:
+            if is_active != 1:
+                continue
+            key = (chat_id, user_id)
+            if self.poem_manager.is_user_in_poem_process(user_id, chat_id):
+                self.sessions.set_block(key, self.poem_manager.block_index)
+            elif current_block < len(catalog) and catalog[current_block].kind == "quiz":
+                self.sessions.set_block(key, current_block)
+                last_seen = _parse_db_timestamp(last_activity)
+                if last_seen and last_seen < expired_before:
+                    # Участник бросил блок еще до перезапуска - не спрашиваем его заново
+                    abandoned.append((chat_id, user_id))
+                else:
+                    quiz_sessions.append((chat_id, user_id, catalog[current_block]))
+            else:
+                stale.append(key)
+
+        for chat_id, user_id, block in quiz_sessions:
+            await self._start_quiz_session(
+                chat_id, user_id, block,
+                notice="🔄 Бот был перезапущен. Пожалуйста, ответьте на вопросы этого блока заново."
+            )
+        for key in abandoned:
+            await self._expire_session(key)
+        if stale:
+            self._set_active(stale, active=False)
+
+        if not self.scheduler.running:
+            self.schedule_all_blocks()
+
+        logger.info(
+            f"Состояние мероприятия {self.event.event_id} восстановлено",
+            extra={
+                "users": len(users_data),
+                "quiz_sessions": len(quiz_sessions),
+                "expired": len(abandoned),
+                "poem_members": self.sessions.count()[1],
+                "reset": len(stale),
+                "recovery_ms": round((time.perf_counter() - started_at) * 1000, 1),
+            },
+        )
+
     def schedule_all_blocks(self):
         # ИСПРАВЛЕНИЕ: Используем более частый интервал для проверки (каждые 30 секунд)
         # и запускаем планировщик только если он еще не запущен
         if not self.scheduler.running:
             self.scheduler.start()
-            logging.info("Планировщик запущен")
+            scheduler_logger.info("Планировщик запущен")
 
-        # Добавляем задачу проверки каждые 30 секунд
+        # Добавляем задачу проверки каждые 30 секунд (по часам мероприятия)
         self.job = self.scheduler.add_job(
             self.timer_block_run,
             "interval",
-            seconds=30,  # Проверяем каждые 30 секунд
+            seconds=self.clock.real(30),  # Проверяем каждые 30 секунд
             id="timer_job",  # Добавляем ID для предотвращения дубликатов
             replace_existing=True  # Заменяем существующую задачу если есть
         )
-        logging.info("Задача планировщика добавлена")
+        scheduler_logger.info("Задача планировщика добавлена")
+
+        # Напоминания отстающим проверяются раз в минуту по политикам администратора
+        self.scheduler.add_job(
+            self.send_reminders,
+            "interval",
+            seconds=self.clock.real(60),
+            id="reminders_job",
+            replace_existing=True
+        )
 
-        # Добавляем задачу для автоматического завершения в 16:30
-        finish_time = datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=16, minutes=30)
+        # Автоматическое завершение - во время finish_time из каталога (по умолчанию 16:30)
+        finish_time = self.catalog.finish_time(self.clock.today())
 
         self.scheduler.add_job(
             self.auto_finish_game,
             "date",
-            run_date=finish_time,
+            run_date=self.clock.real_moment(finish_time),
             id="auto_finish_job",
             replace_existing=True
         )
-        logging.info(f"Запланировано автоматическое завершение игры на {finish_time.strftime('%H:%M')}")
+        scheduler_logger.info(f"Запланировано автоматическое завершение игры на {finish_time.strftime('%H:%M')}")
+
+    async def send_reminders(self):
+        """Ставит в очередь напоминания отстающим участникам"""
+        try:
+            self.reminders.run_once()
+        except Exception as e:
+            scheduler_logger.error(f"Ошибка при отправке напоминаний: {e}", exc_info=True)
 
     async def auto_finish_game(self):
         """Автоматическое завершение игры в запланированное время"""
-        logging.info("Автоматическое завершение игры запущено")
+        logger.info("Автоматическое завершение игры запущено")
         await self.finish_bot_work()
 
     async def timer_block_run(self):
         """Проверяет и запускает блоки по расписанию"""
         try:
-            now = datetime.now()
-            logging.info(f"Планировщик проверяет блоки в {now.strftime('%H:%M:%S')}")
+            now = self.clock.now()
+            scheduler_logger.debug("Планировщик проверяет блоки в %s", now.strftime('%H:%M:%S'))
+
+            catalog = self.catalog
 
             # Получаем всех пользователей
             self.cur.execute(
@@ -1022,25 +1457,28 @@ class InteractiveBot:
             users_data = self.cur.fetchall()
 
             if not users_data:
-                logging.info("Нет зарегистрированных пользователей")
+                scheduler_logger.info("Нет зарегистрированных пользователей")
                 return
 
+            skipped_active = 0
+            waiting = 0
+            due: Dict[int, List[Tuple[int, int]]] = {}  # Номер блока -> участники, которым он открылся
+
             # Проверяем каждого пользователя
             for chat_id, user_id, current_block, is_active in users_data:
                 # Пропускаем активных пользователей
                 if is_active == 1:
-                    logging.info(f"Пользователь {user_id} активен, пропускаем")
+                    skipped_active += 1
                     continue
 
                 # Пропускаем пользователей, завершивших все блоки
-                if current_block >= len(questions):
+                if current_block >= len(catalog):
                     continue
 
                 # Проверяем, есть ли доступный следующий блок
                 next_block_index = current_block
-                if next_block_index < len(questions):
-                    block = questions[next_block_index]
-                    block_time = block.get("time")
+                if next_block_index < len(catalog):
+                    block_time = catalog.block_time(next_block_index, now.date())
 
                     # Пропускаем блоки без времени (первый блок)
                     if block_time is None:
@@ -1048,139 +1486,335 @@ class InteractiveBot:
 
                     # Проверяем, пришло ли время для блока
                     if block_time <= now:
-                        logging.info(f"Время для блока {next_block_index} пришло для пользователя {user_id}")
-                        await self.send_next_block(chat_id, user_id, next_block_index)
+                        due.setdefault(next_block_index, []).append((chat_id, user_id))
                     else:
-                        time_diff = (block_time - now).total_seconds() / 60
-                        logging.info(
-                            f"До блока {next_block_index} для пользователя {user_id} осталось {time_diff:.1f} минут")
+                        waiting += 1
+
+            started = await self._fan_out_blocks(due)
+
+            # Одна сводная строка на тик вместо строки на каждого пользователя
+            scheduler_logger.info(
+                "Тик планировщика",
+                extra={"users": len(users_data), "active": skipped_active, "started": started, "waiting": waiting},
+            )
 
         except Exception as e:
-            logging.error(f"Ошибка в timer_block_run: {e}", exc_info=True)
+            scheduler_logger.error(f"Ошибка в timer_block_run: {e}", exc_info=True)
+
+    async def _fan_out_blocks(self, due: Dict[int, List[Tuple[int, int]]]) -> int:
+        """
+        Открывает блоки всем, кому они стали доступны, одной пачкой на блок:
+        запись в БД - одним UPDATE, обработка участников - параллельно (не больше FANOUT_CONCURRENCY).
+        Время до доставки последнему участнику пишется в лог.
+        """
+        started = 0
+        for block_index, users in due.items():
+            users = [(chat_id, user_id) for chat_id, user_id in users
+                     if self.sessions.block((chat_id, user_id)) is None]
+            if not users:
+                continue
+
+            started_at = time.perf_counter()
+            block = self.catalog[block_index]
+            handlers = self.block_types[block.kind]
+            if handlers.open_many:
+                deliveries = await handlers.open_many(users, block)
+            else:
+                semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+
+                async def open_one(chat_id, user_id):
+                    async with semaphore:
+                        await self.send_next_block(chat_id, user_id, block_index)
+
+                await asyncio.gather(*(open_one(chat_id, user_id) for chat_id, user_id in users))
+                deliveries = []
+
+            started += len(users)
+            task = asyncio.create_task(self._report_fan_out(block_index, len(users), started_at, deliveries))
+            self._fan_out_reports.add(task)
+            task.add_done_callback(self._fan_out_reports.discard)
+        return started
+
+    async def _report_fan_out(self, block_index: int, users: int, started_at: float, deliveries: List[asyncio.Future]):
+        """Пишет в лог, за сколько блок дошел до последнего участника"""
+        enqueued_ms = round((time.perf_counter() - started_at) * 1000, 1)
+        if deliveries:
+            await asyncio.wait(deliveries)
+        failed = sum(1 for future in deliveries if future.exception() is not None)
+        scheduler_logger.info(
+            f"Блок {block_index} открыт для {users} участников",
+            extra={
+                "block": block_index,
+                "users": users,
+                "enqueued_ms": enqueued_ms,
+                "last_delivery_ms": round((time.perf_counter() - started_at) * 1000, 1),
+                "failed": failed,
+            },
+        )
+
+    def _set_active(self, keys: List[Tuple[int, int]], active: bool = True):
+        """Помечает участников (chat_id, user_id) активными (или неактивными) одним UPDATE на пачку"""
+        for i in range(0, len(keys), SQL_IN_CHUNK):
+            chunk = keys[i:i + SQL_IN_CHUNK]
+            self.cur.execute(
+                f"UPDATE answers SET is_active=?, last_activity=? "
+                f"WHERE (chat_id, user_id) IN (VALUES {', '.join(['(?, ?)'] * len(chunk))})",
+                [int(active), self.clock.db_now()] + [value for key in chunk for value in key]
+            )
+        self.conn.commit()
 
     async def send_next_block(self, chat_id, user_id, block_index):
-        """Отправляет следующий блок вопросов пользователю"""
+        """Открывает блок по расписанию обработчиком его типа"""
         try:
-            user_key = f"{chat_id}_{user_id}"
-
             # Проверяем, не активен ли уже пользователь
-            if user_key in self.active_blocks:
-                logging.info(f"Пользователь {user_id} уже активен в блоке {self.active_blocks[user_key]}")
+            active_block = self.sessions.block((chat_id, user_id))
+            if active_block is not None:
+                logger.info("Пользователь %s уже активен в блоке %s", user_id, active_block)
                 return
 
-            # Если это блок стихотворения (индекс 5)
-            if block_index == 5:
-                logging.info(f"Попытка запуска блока стихотворения для пользователя {user_id}")
-                
-                # Получаем команду пользователя
-                self.cur.execute("SELECT team FROM answers WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
-                result = self.cur.fetchone()
+            block = self.catalog[block_index]
+            await self.block_types[block.kind].open(chat_id, user_id, block)
 
-                if result:
-                    team = result[0]
-                    logging.info(f"Пользователь {user_id} из команды {team}")
+        except Exception as e:
+            logger.error("Ошибка при отправке блока %s пользователю %s: %s", block_index, user_id, e, exc_info=True)
+            # Убираем пользователя из активных в случае ошибки
+            self.sessions.release_block((chat_id, user_id))
 
-                    # Обновляем БД - помечаем что пользователь готов
-                    self.cur.execute(
-                        "UPDATE answers SET current_block=5 WHERE user_id = ? AND chat_id = ?",
-                        (user_id, chat_id)
-                    )
-                    self.conn.commit()
+    # ==================== ТИП БЛОКА: ВОПРОСЫ ====================
 
-                    # Проверяем готовность команды и запускаем стихотворение
-                    poem_started = await self.poem_manager.check_team_readiness_and_start(team)
-
-                    if poem_started:
-                        # Проверяем, участвует ли конкретно этот пользователь в процессе
-                        if self.poem_manager.is_user_in_poem_process(user_id):
-                            logging.info(f"Пользователь {user_id} сразу участвует в стихотворении команды {team}")
-                            # Устанавливаем состояние для ожидания строки стихотворения
-                            state = FSMContext(self.dp.storage, key=("bot", str(chat_id), str(user_id)))
-                            await state.set_state(TeamPoemState.waiting_for_poem_line)
-
-                            # Добавляем пользователя в active_blocks для отслеживания состояния
-                            self.active_blocks[user_key] = 5  # Индекс блока стихотворения
-
-                            # Обновляем БД
-                            self.cur.execute(
-                                "UPDATE answers SET is_active=1 WHERE user_id = ? AND chat_id = ?",
-                                (user_id, chat_id)
-                            )
-                            self.conn.commit()
-
-                            logging.info(f"Пользователь {user_id} добавлен в процесс стихотворения команды {team} и в active_blocks")
-                        else:
-                            logging.info(f"Пользователь {user_id} будет участвовать в стихотворении команды {team} позже")
-                            # Добавляем пользователя в active_blocks даже если он ждет своей очереди
-                            self.active_blocks[user_key] = 5
-                            
-                            # Обновляем БД
-                            self.cur.execute(
-                                "UPDATE answers SET is_active=1 WHERE user_id = ? AND chat_id = ?",
-                                (user_id, chat_id)
-                            )
-                            self.conn.commit()
-                            
-                            # Пользователь будет участвовать когда придёт его очередь
-                            await self.bot.send_message(
-                                chat_id,
-                                "✅ Командное стихотворение уже началось!\n"
-                                "Ожидайте своей очереди для добавления строки."
-                            )
-                        return
-                    else:
-                        logging.info(f"Команда {team} еще не готова к стихотворению")
-                        # Если команда еще не готова, отправляем сообщение ожидания
-                        await self.bot.send_message(
-                            chat_id,
-                            "⏳ Ваша команда еще не готова к выполнению командного задания.\n"
-                            "Дождитесь, пока все участники команды завершат предыдущие блоки."
-                        )
-                        return
+    async def _open_quiz_block(self, chat_id: int, user_id: int, block: Block):
+        """Отправляет блок вопросов пользователю"""
+        # Помечаем пользователя как активного с правильным индексом блока
+        self.sessions.set_block((chat_id, user_id), block.index)
+        self._set_active([(chat_id, user_id)])
+        await self._start_quiz_session(chat_id, user_id, block)
+
+    async def _open_quiz_block_many(self, users: List[Tuple[int, int]], block: Block) -> List[asyncio.Future]:
+        """Отправляет блок вопросов сразу многим участникам; возвращает доставки первого вопроса"""
+        for key in users:
+            self.sessions.set_block(key, block.index)
+        self._set_active(users)
 
-            block = questions[block_index]
-            questions_block = block["text"]
+        semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
 
-            # Помечаем пользователя как активного с правильным индексом блока
-            self.active_blocks[user_key] = block_index
+        async def open_one(chat_id, user_id):
+            async with semaphore:
+                try:
+                    return await self._start_quiz_session(chat_id, user_id, block)
+                except Exception as e:
+                    logger.error("Ошибка при отправке блока %s пользователю %s: %s", block.index, user_id, e, exc_info=True)
+                    self.sessions.release_block((chat_id, user_id))
+                    return None
 
-            # Создаем новое состояние FSM для пользователя
-            state = FSMContext(self.dp.storage, key=("bot", str(chat_id), str(user_id)))
+        results = await asyncio.gather(*(open_one(chat_id, user_id) for chat_id, user_id in users))
+        return [future for future in results if future is not None]
 
-            # Очищаем старое состояние
-            await state.clear()
+    async def _start_quiz_session(self, chat_id: int, user_id: int, block: Block,
+                                  notice: str = "🔔 Ура! Новый блок вопросов доступен!") -> asyncio.Future:
+        """Состояние FSM и первый вопрос блока. Возвращает доставку первого вопроса"""
+        # Создаем новое состояние FSM для пользователя
+        state = user_state(self.bot, self.dp.storage, chat_id, user_id)
+
+        # Очищаем старое состояние
+        await state.clear()
+
+        # Устанавливаем новые данные состояния
+        await state.set_data(_quiz_session(block.index))
+        await state.set_state(BotState.asking)
+
+        # Отправляем сообщения пользователю
+        self.outbox.send(chat_id, notice)
+        delivery = self.outbox.send(chat_id, block.questions[0].text)
+        self.latency.published((chat_id, user_id), block.index, 0, delivery)
+        self.expiry.touch((chat_id, user_id))
+
+        logger.debug("Блок %s отправлен пользователю %s, вопросов в блоке: %s", block.index, user_id, len(block))
+        return delivery
 
-            # Устанавливаем новые данные состояния
-            await state.set_data({
-                "chat_id": chat_id,
-                "user_id": user_id,
-                "block_questions": questions_block,
-                "block_step": 0,
-                "answers": [],
-                "quiz_index": block_index,
-            })
-            await state.set_state(BotState.asking)
-
-            # Обновляем базу данных
+    async def _enter_quiz_block(self, message: types.Message, state: FSMContext, block: Block):
+        """Пользователь завершил предыдущий блок: запускаем следующий, если он уже открыт"""
+        next_block_started = await self.try_start_immediate_next_block(message, state, block.index - 1)
+        if next_block_started:
+            return
+
+        # Если следующий блок недоступен, показываем сообщение ожидания
+        next_time = self.catalog.block_time(block.index, self.clock.today())
+        time_str = next_time.strftime("%H:%M") if next_time else "неизвестное время"
+        self.outbox.send(message.chat.id, f"Спасибо за ваши ответы! Они записаны.\n"
+                                          f"Следующий блок вопросов будет доступен в {time_str}. "
+                                          f"Я отправлю вам уведомление! ⏰")
+        await self._release_block(message, state)
+
+    async def _resume_quiz_block(self, message: types.Message, state: FSMContext, block: Block):
+        """Восстанавливает потерянное состояние FSM блока вопросов и обрабатывает ответ"""
+        if self.sessions.block((message.chat.id, message.from_user.id)) is None:
+            return
+
+        data = await state.get_data()
+        if "block_step" not in data or data.get("quiz_index") != block.index:
+            await state.set_data(_quiz_session(block.index))
+            logger.info("Восстановлено состояние для пользователя %s, блок %s", message.from_user.id, block.index)
+
+        await state.set_state(BotState.asking)
+        await self.process_answer(message, state)
+
+    # ==================== ТИП БЛОКА: КОМАНДНОЕ СТИХОТВОРЕНИЕ ====================
+
+    async def _open_poem_block(self, chat_id: int, user_id: int, block: Block):
+        """Блок стихотворения открылся по расписанию: ставим пользователя в очередь команды"""
+        logger.info("Попытка запуска блока стихотворения для пользователя %s", user_id)
+
+        # Получаем команду пользователя
+        self.cur.execute("SELECT team FROM answers WHERE user_id = ? AND chat_id = ?", (user_id, chat_id))
+        result = self.cur.fetchone()
+        if not result:
+            return
+
+        team = result[0]
+        logger.info("Пользователь %s из команды %s", user_id, team)
+
+        # Обновляем БД - помечаем что пользователь готов
+        self.cur.execute(
+            "UPDATE answers SET current_block=? WHERE user_id = ? AND chat_id = ?",
+            (block.index, user_id, chat_id)
+        )
+        self.conn.commit()
+
+        # Проверяем готовность команды и запускаем стихотворение
+        poem_started = await self.poem_manager.check_team_readiness_and_start(team)
+
+        if not poem_started:
+            logger.info("Команда %s еще не готова к стихотворению", team)
+            # Если команда еще не готова, отправляем сообщение ожидания
+            self.outbox.send(
+                chat_id,
+                "⏳ Ваша команда еще не готова к выполнению командного задания.\n"
+                "Дождитесь, пока все участники команды завершат предыдущие блоки."
+            )
+            return
+
+        # Отмечаем открытый блок в сессии пользователя для отслеживания состояния
+        self.sessions.set_block((chat_id, user_id), block.index)
+        self.cur.execute(
+            "UPDATE answers SET is_active=1 WHERE user_id = ? AND chat_id = ?",
+            (user_id, chat_id)
+        )
+        self.conn.commit()
+
+        # Проверяем, участвует ли конкретно этот пользователь в процессе
+        if self.poem_manager.is_user_in_poem_process(user_id, chat_id):
+            logger.info("Пользователь %s сразу участвует в стихотворении команды %s", user_id, team)
+            # Устанавливаем состояние для ожидания строки стихотворения
+            state = user_state(self.bot, self.dp.storage, chat_id, user_id)
+            await state.set_state(TeamPoemState.waiting_for_poem_line)
+            logger.info("Пользователь %s добавлен в процесс стихотворения команды %s", user_id, team)
+        else:
+            logger.info("Пользователь %s будет участвовать в стихотворении команды %s позже", user_id, team)
+            # Пользователь будет участвовать когда придёт его очередь
+            self.outbox.send(
+                chat_id,
+                "✅ Командное стихотворение уже началось!\n"
+                "Ожидайте своей очереди для добавления строки."
+            )
+
+    async def _enter_poem_block(self, message: types.Message, state: FSMContext, block: Block):
+        """Пользователь завершил последний блок вопросов: проверяем готовность команды к стихотворению"""
+        self.cur.execute("SELECT team FROM answers WHERE user_id = ? AND chat_id = ?",
+                         (message.from_user.id, message.chat.id))
+        result = self.cur.fetchone()
+
+        if result:
+            team = result[0]
+            logger.info("Пользователь %s завершил блок %s, команда: %s", message.from_user.id, block.index - 1, team)
+
+            # Обновляем БД - помечаем что пользователь готов к стихотворению
             self.cur.execute(
-                "UPDATE answers SET is_active=1, last_activity=CURRENT_TIMESTAMP WHERE chat_id=? AND user_id=?",
-                (chat_id, user_id)
+                "UPDATE answers SET current_block=?, is_active=0 WHERE user_id = ? AND chat_id = ?",
+                (block.index, message.from_user.id, message.chat.id)
             )
             self.conn.commit()
 
-            # Отправляем сообщения пользователю
-            await self.bot.send_message(chat_id, "🔔 Ура! Новый блок вопросов доступен!")
-            await self.bot.send_message(chat_id, questions_block[0])
+            # Проверяем готовность команды к стихотворению
+            poem_started = await self.poem_manager.check_team_readiness_and_start(team)
 
-            logging.info(
-                f"Блок {block_index} успешно отправлен пользователю {user_id}, вопросов в блоке: {len(questions_block)}")
+            if poem_started:
+                # Если процесс уже запущен или только что запустился
+                # Проверяем, участвует ли конкретно этот пользователь
+                if self.poem_manager.is_user_in_poem_process(message.from_user.id, message.chat.id):
+                    logger.info("Пользователь %s сразу участвует в стихотворении", message.from_user.id)
+                    # Очищаем старое состояние перед установкой нового
+                    await state.clear()
+                    # Устанавливаем состояние для ожидания строки
+                    await state.set_state(TeamPoemState.waiting_for_poem_line)
 
-        except Exception as e:
-            logging.error(f"Ошибка при отправке блока {block_index} пользователю {user_id}: {e}", exc_info=True)
-            # Убираем пользователя из активных в случае ошибки
-            user_key = f"{chat_id}_{user_id}"
-            if user_key in self.active_blocks:
-                del self.active_blocks[user_key]
+                    # Обновляем БД
+                    self.cur.execute(
+                        "UPDATE answers SET is_active=1 WHERE user_id = ? AND chat_id = ?",
+                        (message.from_user.id, message.chat.id)
+                    )
+                    self.conn.commit()
+                    return
+                else:
+                    logger.info("Пользователь %s будет участвовать в стихотворении позже", message.from_user.id)
+                    # Пользователь будет участвовать в процессе когда придёт его очередь
+                    self.outbox.send(
+                        message.chat.id,
+                        "✅ Вы завершили предыдущие задания!\n"
+                        "Командное стихотворение уже началось. "
+                        "Ожидайте своей очереди для добавления строки."
+                    )
+            else:
+                logger.info("Команда %s еще не готова к стихотворению", team)
+                self.outbox.send(
+                    message.chat.id,
+                    "⏳ Ваша команда еще не готова к выполнению командного задания.\n"
+                    "Дождитесь, пока все участники команды завершат предыдущие блоки.\n"
+                    "Вы получите уведомление, когда задание станет доступным."
+                )
+
+        # Помечаем пользователя как неактивного
+        self.sessions.release_block((message.chat.id, message.from_user.id))
+        self.expiry.discard((message.chat.id, message.from_user.id))
+
+        await state.clear()
+
+    async def _resume_poem_block(self, message: types.Message, state: FSMContext, block: Block):
+        """Восстанавливает состояние стихотворения и передает строку в poem_manager"""
+        if not self.poem_manager.is_user_in_poem_process(message.from_user.id, message.chat.id):
+            logger.info("🎭 [POEM] Пользователь %s не участвует в процессе стихотворения, пропускаем восстановление", message.from_user.id)
+            return
+
+        logger.info("🎭 [POEM] Восстановление состояния стихотворения для пользователя %s", message.from_user.id)
+        self.sessions.set_block((message.chat.id, message.from_user.id), block.index)
+        await state.set_state(TeamPoemState.waiting_for_poem_line)
+        await self.poem_manager.process_poem_line(message, state)
+
+    # ==================== ТИПЫ ВОПРОСОВ ====================
+
+    async def _read_text_answer(self, message: types.Message) -> Optional[str]:
+        return message.text
+
+    async def _read_photo_answer(self, message: types.Message) -> Optional[str]:
+        if not message.photo:
+            self.outbox.send(message.chat.id, "Пожалуйста, отправьте фото 📷")
+            return None
+        return f"photo_file_id:{message.photo[-1].file_id}"
+
+    # ==================================================================
+
+    async def _release_block(self, message: types.Message, state: FSMContext):
+        """Помечает пользователя неактивным после завершения блока"""
+        self.sessions.release_block((message.chat.id, message.from_user.id))
+        self.expiry.discard((message.chat.id, message.from_user.id))
+
+        # Обновляем статус в базе данных
+        self.cur.execute(
+            "UPDATE answers SET is_active=0, last_activity=? WHERE chat_id=? AND user_id=?",
+            (self.clock.db_now(), message.chat.id, message.from_user.id)
+        )
+        self.conn.commit()
+
+        await state.clear()
 
     async def try_start_immediate_next_block(self, message: types.Message, state: FSMContext, current_quiz_index: int):
         """
@@ -1188,18 +1822,22 @@ class InteractiveBot:
         Возвращает True, если следующий блок был запущен, False - если нет.
         """
         try:
-            now = datetime.now()
+            now = self.clock.now()
             chat_id = message.chat.id
             user_id = message.from_user.id
 
             # Ищем следующий доступный блок
-            for next_index in range(current_quiz_index + 1, len(questions)):
+            catalog = self.catalog
+            for next_index in range(current_quiz_index + 1, len(catalog)):
                 if not self.bot_active:
-                    await message.answer("Бот завершил свою работу.")
+                    self.outbox.send(message.chat.id, "Бот завершил свою работу.")
+                    break
+
+                # Немедленно запускаются только блоки вопросов
+                if catalog[next_index].kind != "quiz":
                     break
 
-                next_block = questions[next_index]
-                block_time = next_block.get("time")
+                block_time = catalog.block_time(next_index, now.date())
 
                 # Пропускаем блоки без времени
                 if block_time is None:
@@ -1207,36 +1845,29 @@ class InteractiveBot:
 
                 if block_time <= now:
                     # Следующий блок доступен, запускаем его немедленно
-                    questions_block = next_block["text"]
-                    user_key = f"{chat_id}_{user_id}"
-
-                    # Обновляем активные блоки с правильным индексом
-                    self.active_blocks[user_key] = next_index
+                    # Обновляем открытый блок в сессии
+                    self.sessions.set_block((chat_id, user_id), next_index)
 
                     # Очищаем старое состояние и устанавливаем новое
                     await state.clear()
-                    await state.set_data({
-                        "chat_id": chat_id,
-                        "user_id": user_id,
-                        "block_questions": questions_block,
-                        "block_step": 0,
-                        "answers": [],
-                        "quiz_index": next_index,
-                    })
+                    # Повтор последнего ответа прошлого блока не должен стать ответом на первый вопрос нового
+                    await state.set_data(_quiz_session(next_index, message.message_id))
                     await state.set_state(BotState.asking)
 
                     # Обновляем базу данных
                     self.cur.execute(
-                        "UPDATE answers SET current_block=?, is_active=1, last_activity=CURRENT_TIMESTAMP WHERE chat_id=? AND user_id=?",
-                        (next_index, chat_id, user_id)
+                        "UPDATE answers SET current_block=?, is_active=1, last_activity=? WHERE chat_id=? AND user_id=?",
+                        (next_index, self.clock.db_now(), chat_id, user_id)
                     )
                     self.conn.commit()
 
                     # Отправляем сообщение о новом блоке и первый вопрос
-                    await message.answer("🔔 Следующий блок вопросов уже доступен!")
-                    await message.answer(questions_block[0])
+                    self.outbox.send(message.chat.id, "🔔 Следующий блок вопросов уже доступен!")
+                    delivery = self.outbox.send(message.chat.id, catalog[next_index].questions[0].text)
+                    self.latency.published((chat_id, user_id), next_index, 0, delivery)
+                    self.expiry.touch((chat_id, user_id))
 
-                    logging.info(f"Немедленно запущен блок {next_index} для пользователя {user_id}")
+                    logger.info("Немедленно запущен блок %s для пользователя %s", next_index, user_id)
                     return True
                 else:
                     # Если следующий блок еще недоступен, прекращаем поиск
@@ -1245,181 +1876,305 @@ class InteractiveBot:
             return False
 
         except Exception as e:
-            logging.error(f"Ошибка в try_start_immediate_next_block для пользователя {user_id}: {e}")
+            logger.error("Ошибка в try_start_immediate_next_block для пользователя %s: %s", user_id, e)
             return False
 
     async def process_answer(self, message: types.Message, state: FSMContext):
         data = await state.get_data()
-        questions_block = data.get("block_questions", [])
         step = data.get("block_step", 0)
         answers = data.get("answers", [])
         quiz_index = data.get("quiz_index", 0)
 
         if not self.bot_active:
-            await message.answer("Бот завершил свою работу.")
+            self.outbox.send(message.chat.id, "Бот завершил свою работу.")
             return
 
-        # Проверяем, что у нас есть вопросы и корректный шаг
-        if not questions_block or step >= len(questions_block):
-            logging.error(f"Ошибка: questions_block пустой или step вне границ. "
-                          f"questions_block: {questions_block}, step: {step}")
-            await message.answer("Произошла ошибка. Пожалуйста, попробуйте еще раз или обратитесь к администратору.")
+        # Повторно доставленное сообщение уже записано: message_id в чате только растут
+        if message.message_id <= data.get("answered_message", 0):
+            logger.info("Повторный ответ %s пользователя %s пропущен", message.message_id, message.from_user.id)
             return
 
-        current_question = questions_block[step]
+        # Время ответа - сколько сессия простояла с прошлого вопроса
+        idle = self.expiry.idle_for((message.chat.id, message.from_user.id))
+        self.expiry.touch((message.chat.id, message.from_user.id))
 
-        photo_question_text = (
-            "Сделайте и отправьте креативную фотографию с коллегой с которым чаще всего взаимодействуешь по работе (приветствуется использование ИИ)."
-        )
-        if current_question.strip() == photo_question_text.strip():
-            if not message.photo:
-                await message.answer("Пожалуйста, отправьте фото 📷")
-                return
-            answers.append(f"photo_file_id:{message.photo[-1].file_id}")
-        else:
-            answers.append(message.text)
+        # Текст и тип вопроса берутся из общего каталога: в FSM хранятся только номер блока и шаг
+        if quiz_index >= len(self.catalog) or step >= len(self.catalog[quiz_index]):
+            logger.error(f"Ошибка: шаг {step} вне границ блока {quiz_index}")
+            self.outbox.send(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте еще раз или обратитесь к администратору.")
+            return
+
+        block = self.catalog[quiz_index]
+        question_kind = block.questions[step].kind
+        answer = await self.answer_readers[question_kind](message)
+        if answer is None:
+            return
+        answers.append(answer)
+        if idle is not None:
+            self.stats.record_answer(idle)
+        self.latency.answered((message.chat.id, message.from_user.id), quiz_index, step)
 
         step += 1
-        if step < len(questions_block):
-            await state.update_data(block_step=step, answers=answers)
-            await message.answer(questions_block[step])
+        if step < len(block):
+            await state.update_data(block_step=step, answers=answers, answered_message=message.message_id)
+            # last_activity - по нему выбираются отстающие для напоминаний
+            self.cur.execute(
+                "UPDATE answers SET last_activity=? WHERE chat_id=? AND user_id=?",
+                (self.clock.db_now(), message.chat.id, message.from_user.id)
+            )
+            self.conn.commit()
+            delivery = self.outbox.send(message.chat.id, block.questions[step].text)
+            self.latency.published((message.chat.id, message.from_user.id), quiz_index, step, delivery)
         else:
-            await state.update_data(answers=answers)
+            await state.update_data(answers=answers, answered_message=message.message_id)
             await self.save_answers(message, answers, state)
 
-            # Если это блок 4 (последний перед стихотворением)
-            if quiz_index == 4:
-                # Получаем команду пользователя
-                self.cur.execute("SELECT team FROM answers WHERE user_id = ? AND chat_id = ?",
-                                 (message.from_user.id, message.chat.id))
-                result = self.cur.fetchone()
+            next_index = quiz_index + 1
+            if next_index < len(self.catalog):
+                next_block = self.catalog[next_index]
+                await self.block_types[next_block.kind].enter(message, state, next_block)
+                return
 
-                if result:
-                    team = result[0]
-                    logging.info(f"Пользователь {message.from_user.id} завершил блок 4, команда: {team}")
+            # Все блоки завершены - показываем благодарность
+            self.outbox.send(message.chat.id, "🎉 Поздравляем! Вы успешно прошли все блоки корпоративной игры!\n\n"
+                                              f"Спасибо за активное участие в мероприятии «{self.event.title}». "
+                                              "Ваши ответы записаны и будут учтены при подведении итогов.\n\n"
+                                              "Ожидайте объявления результатов и награждения! 🏆")
+            await self._release_block(message, state)
 
-                    # Обновляем БД - помечаем что пользователь готов к стихотворению
-                    self.cur.execute(
-                        "UPDATE answers SET current_block=5, is_active=0 WHERE user_id = ? AND chat_id = ?",
-                        (message.from_user.id, message.chat.id)
-                    )
-                    self.conn.commit()
+    async def get_all_answers(self):
+        return await self.reads.fetchall("SELECT * FROM answers")
 
-                    # Проверяем готовность команды к стихотворению
-                    poem_started = await self.poem_manager.check_team_readiness_and_start(team)
-
-                    if poem_started:
-                        # Если процесс уже запущен или только что запустился
-                        # Проверяем, участвует ли конкретно этот пользователь
-                        if self.poem_manager.is_user_in_poem_process(message.from_user.id):
-                            logging.info(f"Пользователь {message.from_user.id} сразу участвует в стихотворении")
-                            # Очищаем старое состояние перед установкой нового
-                            await state.clear()
-                            # Устанавливаем состояние для ожидания строки
-                            await state.set_state(TeamPoemState.waiting_for_poem_line)
-
-                            # Обновляем БД
-                            self.cur.execute(
-                                "UPDATE answers SET is_active=1 WHERE user_id = ? AND chat_id = ?",
-                                (message.from_user.id, message.chat.id)
-                            )
-                            self.conn.commit()
-                            return
-                        else:
-                            logging.info(f"Пользователь {message.from_user.id} будет участвовать в стихотворении позже")
-                            # Пользователь будет участвовать в процессе когда придёт его очередь
-                            await message.answer(
-                                "✅ Вы завершили предыдущие задания!\n"
-                                "Командное стихотворение уже началось. "
-                                "Ожидайте своей очереди для добавления строки."
-                            )
-                    else:
-                        logging.info(f"Команда {team} еще не готова к стихотворению")
-                        await message.answer(
-                            "⏳ Ваша команда еще не готова к выполнению командного задания.\n"
-                            "Дождитесь, пока все участники команды завершат предыдущие блоки.\n"
-                            "Вы получите уведомление, когда задание станет доступным."
-                        )
+    def shutdown(self):
+        self.expiry.stop()
+        self.snapshots.stop()
+        self.reads.close()
+        self.conn.close()
+        if self.scheduler.running:
+            self.scheduler.shutdown()
 
-                # Помечаем пользователя как неактивного
-                user_key = f"{message.chat.id}_{message.from_user.id}"
-                if user_key in self.active_blocks:
-                    del self.active_blocks[user_key]
 
-                await state.clear()
+class EventHub:
+    """Один процесс бота, обслуживающий несколько мероприятий одновременно"""
+
+    def __init__(self, token: str, events_path: str = EVENTS_PATH, updates_log_dir: Optional[str] = UPDATES_LOG_DIR,
+                 clock: Optional[Clock] = None, throttle: bool = True):
+        self.bot = Bot(token=token)
+        self.dp = Dispatcher(storage=BoundedMemoryStorage())
+        self.recorder = UpdateRecorder(updates_log_dir, max_bytes=UPDATES_LOG_MAX_MB * 2 ** 20,
+                                       keep=UPDATES_LOG_KEEP) if updates_log_dir else None
+        if self.recorder:
+            self.dp.update.outer_middleware(self.recorder)
+        self.dead_letters = DeadLetterQueue(self.bot, DEAD_LETTERS_DB_PATH)
+        self.outbox = Outbox(self.bot, dead_letters=self.dead_letters)
+        self.jobs = JobRunner(self.bot, self.outbox)
+
+        events = load_events(events_path)
+        self.registry = EventRegistry(events, EVENTS_DB_PATH)
+        # Повторно доставленные апдейты отбрасываются до любых обработчиков (граница хранится в базе привязок)
+        self.dedup = UpdateDeduplicator(self.registry.conn, self.bot.id)
+        self.dp.update.outer_middleware(self.dedup)
+        # Ограничение частоты - до привязки к мероприятию, чтобы отброшенный апдейт не стоил запроса к базе
+        # Воспроизведение записи без пауз выключает ограничение: иначе апдейты отбрасывались бы по реальному времени
+        self.throttle = ThrottleMiddleware(self.outbox, PARTICIPANT_BUDGET, ADMIN_BUDGET, ADMIN_ID,
+                                           THROTTLE_MAX_USERS, clock) if throttle else None
+        if self.throttle:
+            self.dp.message.outer_middleware(self.throttle)
+            self.dp.callback_query.outer_middleware(self.throttle)
+        self.dp.message.outer_middleware(EventBindingMiddleware(self.registry))
+
+        # Общие команды регистрируются до роутеров мероприятий
+        self.router = Router(name="hub")
+        self.dp.include_router(self.router)
+        self._register_handlers()
+
+        self.games = {}
+        for event in events:
+            self.games[event.event_id] = InteractiveBot(self.bot, self.dp, event, self.registry, self.outbox,
+                                                         self.jobs, clock)
+            mark_startup(f"event:{event.event_id}")
+
+    def _register_handlers(self):
+        @self.router.message(Command("events"))
+        async def list_events_cmd(message: Message):
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            counts = self.registry.members_count()
+            current = self.registry.event_id_of(message.from_user.id)
+            lines = [
+                f"{'👉 ' if event_id == current else ''}<b>{event_id}</b> — {event.title} (привязано: {counts[event_id]})"
+                for event_id, event in self.registry.events.items()
+            ]
+            await message.answer("📋 <b>Мероприятия:</b>\n" + "\n".join(lines), parse_mode="HTML")
+
+        @self.router.message(Command("queues"))
+        async def queues_cmd(message: Message):
+            """Метрики очереди исходящих сообщений"""
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
                 return
+            metrics = self.outbox.snapshot()
+            throttle = (
+                f"Ограничение частоты: пользователей {len(self.throttle)}, предупреждений {self.throttle.warned}, "
+                f"отброшено апдейтов {self.throttle.dropped}" if self.throttle else "Ограничение частоты выключено"
+            )
+            await message.answer(
+                "📮 <b>Очередь исходящих:</b>\n"
+                f"Чатов с очередью: {metrics['chats']}\n"
+                f"Сообщений в очереди: {metrics['depth']} (макс. в чате: {metrics['max_chat_depth']})\n"
+                f"Отправляется сейчас: {metrics['in_flight']}\n"
+                f"Поставлено: {metrics['enqueued']}, отправлено запросов: {metrics['sent']}, "
+                f"склеено: {metrics['merged']}, ошибок: {metrics['failed']}\n"
+                f"Максимальная глубина: {metrics['max_depth']}\n\n"
+                f"Сессий FSM в памяти: {len(self.dp.storage)}, вытеснено: {self.dp.storage.evicted}\n"
+                f"{throttle}\n"
+                f"Повторных апдейтов пропущено: {self.dedup.duplicates}",
+                parse_mode="HTML"
+            )
 
-            # Проверяем, есть ли следующий доступный блок
-            next_block_started = await self.try_start_immediate_next_block(message, state, quiz_index)
+        @self.router.message(Command("dlq"))
+        async def dead_letters_cmd(message: Message):
+            """Сообщения, которые не удалось отправить"""
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            counts = self.dead_letters.counts()
+            text = (
+                "📭 <b>Неотправленные сообщения:</b>\n"
+                f"Ждут повтора: {counts.get('pending', 0)}\n"
+                f"Повторы прекращены: {counts.get('failed', 0)}\n"
+                f"Связь с Telegram: {self.dead_letters.breaker.state}\n"
+            )
+            rows = self.dead_letters.recent()
+            if rows:
+                text += "\n<b>Последние:</b>\n"
+                for letter_id, chat_id, error_class, attempts, status, next_attempt_at in rows:
+                    text += f"#{letter_id} чат {chat_id}: {error_class}, попыток {attempts}, {status}\n"
+                text += "\n/dlq_replay [id|all] — повторить отправку"
+            await message.answer(text, parse_mode="HTML")
 
-            if not next_block_started:
-                # Проверяем, все ли блоки завершены
-                if quiz_index + 1 >= len(questions):
-                    # Все блоки завершены - показываем благодарность
-                    await message.answer("🎉 Поздравляем! Вы успешно прошли все блоки корпоративной игры!\n\n"
-                                         "Спасибо за активное участие в мероприятии «Традиции и трансформация». "
-                                         "Ваши ответы записаны и будут учтены при подведении итогов.\n\n"
-                                         "Ожидайте объявления результатов и награждения! 🏆")
-                else:
-                    # Если следующий блок недоступен, показываем сообщение ожидания
-                    next_time = questions[quiz_index + 1]["time"]
-                    time_str = next_time.strftime("%H:%M") if next_time else "неизвестное время"
-                    await message.answer(f"Спасибо за ваши ответы! Они записаны.\n"
-                                         f"Следующий блок вопросов будет доступен в {time_str}. "
-                                         f"Я отправлю вам уведомление! ⏰")
-
-                # Помечаем пользователя как неактивного после завершения блока
-                user_key = f"{message.chat.id}_{message.from_user.id}"
-                if user_key in self.active_blocks:
-                    del self.active_blocks[user_key]
-
-                # Обновляем статус в базе данных
-                self.cur.execute(
-                    "UPDATE answers SET is_active=0, last_activity=CURRENT_TIMESTAMP WHERE chat_id=? AND user_id=?",
-                    (message.chat.id, message.from_user.id)
-                )
-                self.conn.commit()
+        @self.router.message(Command("dlq_replay"))
+        async def dead_letters_replay_cmd(message: Message):
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            args = message.text.split(maxsplit=1)
+            arg = args[1].strip() if len(args) > 1 else ""
+            if arg != "all" and not arg.isdigit():
+                await message.answer("Использование: /dlq_replay <id> или /dlq_replay all")
+                return
+            count = self.dead_letters.replay(None if arg == "all" else int(arg))
+            queued = await self.dead_letters.retry_due()
+            await message.answer(f"🔁 Поставлено на повтор: {count}, в очереди отправки: {queued}")
 
-                await state.clear()
+        @self.router.message(Command("jobs"))
+        async def jobs_cmd(message: Message):
+            """Фоновые задачи администратора"""
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            jobs = self.jobs.list()
+            if not jobs:
+                await message.answer("Фоновых задач нет.")
+                return
+            await message.answer("\n\n".join(job.describe() for job in jobs))
 
-    def get_all_answers(self):
-        self.cur.execute("SELECT * FROM answers")
-        return self.cur.fetchall()
+        @self.router.message(Command("cancel"))
+        async def cancel_job_cmd(message: Message):
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            args = message.text.split()
+            if len(args) < 2 or not args[1].isdigit():
+                await message.answer("Использование: /cancel <id задачи>")
+                return
+            if self.jobs.cancel(int(args[1])):
+                await message.answer(f"🛑 Задача #{args[1]} отменяется")
+            else:
+                await message.answer(f"❌ Нет выполняющейся задачи #{args[1]}")
+
+        @self.router.message(Command("event"))
+        async def switch_event_cmd(message: Message):
+            """Переключает администратора на другое мероприятие"""
+            if message.from_user.id != ADMIN_ID:
+                await message.answer("У вас нет доступа к этой команде.")
+                return
+            args = message.text.split(maxsplit=1)
+            if len(args) < 2 or args[1].strip() not in self.registry.events:
+                await message.answer(f"Использование: /event <id>\nДоступные: {', '.join(self.registry.events)}")
+                return
+            self.registry.bind(message.from_user.id, args[1].strip())
+            await message.answer(f"✅ Админ-команды теперь относятся к мероприятию {args[1].strip()}")
 
     async def main(self):
         try:
-            logging.info("Бот запускается...")
-            await self.set_bot_commands()
+            logger.info(f"Бот запускается, мероприятий: {len(self.games)}")
+            await self.games[self.registry.default.event_id].set_bot_commands()
+            for game in self.games.values():
+                await game.recover()
+            mark_startup("ready")
+            logger.info("Отчет о запуске", extra={"startup_ms": dict(startup_marks)})
+            self.dead_letters.start()
             await self.dp.start_polling(self.bot)
         finally:
-            self.conn.close()
-            if self.scheduler.running:
-                self.scheduler.shutdown()
-            logging.info("Бот остановлен")
+            await self.jobs.shutdown()
+            await self.outbox.drain()
+            await self.dead_letters.stop()
+            self.dead_letters.close()
+            for game in self.games.values():
+                game.shutdown()
+            self.dedup.save()
+            self.registry.close()
+            if self.recorder:
+                self.recorder.close()
+            logger.info("Бот остановлен")
 
 class AdminExport:
-    def __init__(self, bot: Bot, cur: sqlite3.Cursor, admin_id: int,
+    def __init__(self, bot: Bot, snapshots: SnapshotService,
                  creds_json_path: str, spreadsheet_id: str):
         self.bot = bot
-        self.cur = cur
-        self.admin_id = admin_id
+        self.snapshots = snapshots
         self.spreadsheet_id = spreadsheet_id
         self.creds_json_path = creds_json_path
+        self._gc = None
 
-        # Авторизация в Google Sheets
-        scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-        creds = Credentials.from_service_account_file(self.creds_json_path, scopes=scopes)
-        self.gc = gspread.authorize(creds)
-
-    def _get_all_answers_data(self, table_name: str):
+    def _client(self):
+        """
+        Клиент Google Sheets. gspread и google-auth импортируются и авторизуются
+        только при первом экспорте, дальше клиент берется из кэша.
+        """
+        if self._gc is None:
+            started = time.perf_counter()
+            import gspread
+            from google.oauth2.service_account import Credentials
+
+            scopes = ["https://www.googleapis.com/auth/spreadsheets"]
+            creds = Credentials.from_service_account_file(self.creds_json_path, scopes=scopes)
+            self._gc = gspread.authorize(creds)
+            logger.info(f"Google Sheets авторизован за {(time.perf_counter() - started) * 1000:.0f} мс")
+        return self._gc
+
+    def _upload(self, answers_data, poems_data):
+        """Синхронная выгрузка в таблицу, выполняется в отдельном потоке"""
+        spreadsheet = self._client().open_by_key(self.spreadsheet_id)
+
+        sheet = spreadsheet.sheet1  # Можно выбрать нужный лист
+        sheet.clear()  # Чистим лист перед загрузкой
+        sheet.update('A1', answers_data)  # Загружаем данные начиная с ячейки A1
+
+        sheet = spreadsheet.get_worksheet(1)
+        sheet.clear()  # Чистим лист перед загрузкой
+        sheet.update('A1', poems_data)  # Загружаем данные начиная с ячейки A1
+
+    @staticmethod
+    def _get_all_answers_data(conn: sqlite3.Connection, table_name: str):
         if not table_name.isidentifier():
             raise ValueError("Некорректное имя таблицы!")
-        # Берем все строки из таблицы answers
-        query = f"SELECT * FROM {table_name}"
-        self.cur.execute(query)
-
-        columns = [desc[0] for desc in self.cur.description]
-        rows = self.cur.fetchall()
+        # Берем все строки из таблицы снимка
+        cur = conn.execute(f"SELECT * FROM {table_name}")
+        columns = [desc[0] for desc in cur.description]
+        rows = cur.fetchall()
         # Формируем список списков, первая строка - заголовки
         data = [columns]
         for row in rows:
@@ -1427,30 +2182,21 @@ class AdminExport:
             data.append([str(cell) if cell is not None else "" for cell in row])
         return data
 
-    async def export_to_sheet(self, message: Message):
-        # Проверяем, что пишет админ
-        if message.from_user.id != self.admin_id:
-            await message.answer("У вас нет прав на выполнение этой команды.")
-            return
-
-        try:
-            sheet = self.gc.open_by_key(self.spreadsheet_id).sheet1  # Можно выбрать нужный лист
-            data = self._get_all_answers_data("answers")
-            sheet.clear()  # Чистим лист перед загрузкой
-            sheet.update('A1', data)  # Загружаем данные начиная с ячейки A1
-
-            spreadsheet = self.gc.open_by_key(self.spreadsheet_id)
-            sheet = spreadsheet.get_worksheet(1)
-            data = self._get_all_answers_data("poem_contributions")
-            sheet.clear()  # Чистим лист перед загрузкой
-            sheet.update('A1', data)  # Загружаем данные начиная с ячейки A1
-
-            await message.answer("Данные успешно экспортированы в Google Таблицу.")
-        except Exception as e:
-            await message.answer(f"Произошла ошибка при экспорте: {e}")
-            logging.exception("Ошибка при экспорте в Google Sheets")
+    async def export(self, job: Job) -> str:
+        """Фоновая задача /export: данные берутся из свежего снимка, а не из рабочей базы"""
+        snapshot = await self.snapshots.fresh(EXPORT_SNAPSHOT_MAX_AGE_MINUTES * 60)
+        async with self.snapshots.open(snapshot) as conn:
+            answers_data = await asyncio.to_thread(self._get_all_answers_data, conn, "answers")
+            poems_data = await asyncio.to_thread(self._get_all_answers_data, conn, "poem_contributions")
+        job.total = len(answers_data) + len(poems_data) - 2
+        # Сетевые вызовы gspread синхронные - не блокируем ими event loop.
+        # Отмена задачи не прерывает уже начатую выгрузку в потоке
+        await asyncio.to_thread(self._upload, answers_data, poems_data)
+        job.advance(job.total)
+        return f"Данные экспортированы в Google Таблицу (снимок {snapshot.name})."
 
 
 if __name__ == "__main__":
-    tg_bot = InteractiveBot(API_TOKEN)
-    asyncio.run(tg_bot.main())
\ No newline at end of file
+    setup_logging()
+    hub = EventHub(API_TOKEN)
+    asyncio.run(hub.main())
\ No newline at end of file
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional
+
+from aiogram import Bot
+from aiogram.methods import TelegramMethod
+
+from deadletter import CircuitBreaker, CircuitOpenError, DeadLetterQueue
+
+logger = logging.getLogger("bot.outbox")
+
+# Ограничение Telegram на длину текста сообщения
+MESSAGE_LIMIT = 4096
+
+
+@dataclass
+class OutboundMessage:
+    """Сообщение (или другой запрос, см. Outbox.call) в очереди чата"""
+    chat_id: int
+    text: str
+    kwargs: Dict[str, Any]
+    future: asyncio.Future
+    merge: bool = True
+    dead_letter: bool = True  # Сохранить в dead_letters, если отправить не удалось
+    method: Optional[TelegramMethod] = None  # Запрос вместо sendMessage: редактирование, закрепление
+
+
+def _retrieve_exception(future: asyncio.Future):
+    # Ошибку отправки логирует Outbox; забираем ее, чтобы asyncio не ругался на неполученное исключение
+    if not future.cancelled():
+        future.exception()
+
+
+@dataclass
+class OutboxMetrics:
+    enqueued: int = 0
+    sent: int = 0
+    merged: int = 0
+    failed: int = 0
+    max_depth: int = 0
+    in_flight: int = 0
+
+
+class Outbox:
+    """
+    Исходящие сообщения бота.
+
+    У каждого чата своя очередь, которую разбирает отдельная задача, поэтому порядок
+    внутри чата сохраняется, а разные чаты отправляются параллельно (не больше
+    `concurrency` запросов одновременно и не чаще `rate` сообщений в секунду).
+    Идущие подряд текстовые сообщения одного чата без клавиатуры склеиваются в одно.
+    Редактирования и закрепления (`call`) идут через те же очереди, лимит и предохранитель.
+    Неотправленные сообщения сохраняются в `dead_letters` для повторной отправки;
+    пока ее предохранитель разомкнут, сообщения сразу откладываются туда без попытки отправки.
+    """
+
+    def __init__(self, bot: Bot, concurrency: int = 20, rate: float = 25.0,
+                 dead_letters: Optional[DeadLetterQueue] = None):
+        self.bot = bot
+        self.rate = rate
+        self.dead_letters = dead_letters
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queues: Dict[int, Deque[OutboundMessage]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._next_slot = 0.0
+        self.metrics = OutboxMetrics()
+        if dead_letters is not None:
+            dead_letters.attach(self)  # Повторы из dead_letters идут через эту очередь
+
+    def send(self, chat_id: int, text: str, merge: bool = True, dead_letter: bool = True, **kwargs) -> asyncio.Future:
+        """
+        Ставит сообщение в очередь чата и сразу возвращает управление.
+        Результат (Message) можно получить, дождавшись возвращенного future.
+        dead_letter=False - неудачу обрабатывает вызывающий (повтор из dead_letters)
+        """
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_retrieve_exception)
+        self._enqueue(OutboundMessage(chat_id, text, kwargs, future, merge, dead_letter))
+        return future
+
+    def call(self, chat_id: int, method: TelegramMethod) -> asyncio.Future:
+        """
+        Ставит в очередь чата другой запрос к Bot API (EditMessageText, PinChatMessage):
+        после уже поставленных сообщений этого чата, в общем лимите скорости.
+        Не склеивается и в dead_letters не сохраняется - устаревшую правку повторять незачем
+        """
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_retrieve_exception)
+        self._enqueue(OutboundMessage(chat_id, type(method).__name__, {}, future,
+                                      merge=False, dead_letter=False, method=method))
+        return future
+
+    def _enqueue(self, message: OutboundMessage):
+        chat_id = message.chat_id
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        queue.append(message)
+
+        self.metrics.enqueued += 1
+        self.metrics.max_depth = max(self.metrics.max_depth, len(queue))
+
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+
+    @property
+    def breaker(self) -> Optional[CircuitBreaker]:
+        """Предохранитель отправки (есть, только если задана очередь dead_letters)"""
+        return self.dead_letters.breaker if self.dead_letters else None
+
+    def depth(self) -> int:
+        """Сколько сообщений ждут отправки во всех чатах"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def snapshot(self) -> Dict[str, int]:
+        """Метрики очередей для мониторинга"""
+        depths = [len(queue) for queue in self._queues.values()]
+        return {
+            "chats": len(depths),
+            "depth": sum(depths),
+            "max_chat_depth": max(depths, default=0),
+            "in_flight": self.metrics.in_flight,
+            "enqueued": self.metrics.enqueued,
+            "sent": self.metrics.sent,
+            "merged": self.metrics.merged,
+            "failed": self.metrics.failed,
+            "max_depth": self.metrics.max_depth,
+        }
+
+    async def drain(self, timeout: float = 10.0):
+        """Дождаться отправки всего, что уже в очередях"""
+        workers = list(self._workers.values())
+        if workers:
+            await asyncio.wait(workers, timeout=timeout)
+
+    @staticmethod
+    def _can_merge(head: OutboundMessage, nxt: OutboundMessage, length: int) -> bool:
+        return (
+            head.merge and nxt.merge
+            and not head.kwargs.get("reply_markup") and not nxt.kwargs.get("reply_markup")
+            and head.kwargs.get("parse_mode") == nxt.kwargs.get("parse_mode")
+            and length + 2 + len(nxt.text) <= MESSAGE_LIMIT
+        )
+
+    async def _throttle(self):
+        """Глобальное ограничение скорости отправки"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + 1 / self.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _drain(self, chat_id: int):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                batch = [queue.popleft()]
+                length = len(batch[0].text)
+                while queue and self._can_merge(batch[0], queue[0], length):
+                    length += 2 + len(queue[0].text)
+                    batch.append(queue.popleft())
+                await self._deliver(chat_id, batch)
+        finally:
+            del self._workers[chat_id]
+            if not queue:
+                self._queues.pop(chat_id, None)
+
+    async def _deliver(self, chat_id: int, batch):
+        head = batch[0]
+        text = "\n\n".join(message.text for message in batch)
+        breaker = self.breaker
+
+        async with self._semaphore:
+            await self._throttle()
+            if breaker and not breaker.allow():
+                self._fail(chat_id, text, batch, CircuitOpenError("Telegram недоступен"))
+                return
+            probe = breaker is not None and breaker.probing
+            self.metrics.in_flight += 1
+            try:
+                if head.method is not None:
+                    result = await self.bot(head.method)
+                else:
+                    result = await self.bot.send_message(chat_id, text, **head.kwargs)
+            except Exception as e:
+                if breaker:
+                    breaker.record(e)
+                logger.error("Не удалось выполнить %s в чате %s: %s",
+                             type(head.method).__name__ if head.method else "SendMessage", chat_id, e)
+                self._fail(chat_id, text, batch, e)
+                return
+            finally:
+                self.metrics.in_flight -= 1
+                if probe:
+                    breaker.end_probe()
+
+        if breaker:
+            breaker.record()
+        self.metrics.sent += 1
+        self.metrics.merged += len(batch) - 1
+        for message in batch:
+            if not message.future.done():
+                message.future.set_result(result)
+
+    def _fail(self, chat_id: int, text: str, batch, error: Exception):
+        self.metrics.failed += len(batch)
+        if self.dead_letters and batch[0].dead_letter:
+            self.dead_letters.add(chat_id, text, batch[0].kwargs, error)
+        for message in batch:
+            if not message.future.done():
+                message.future.set_exception(error)
@@ -3,14 +3,27 @@ import logging
 import sqlite3
 import json
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
 from enum import Enum
 
 from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.methods import EditMessageText, PinChatMessage
 
+from deadletter import chat_unavailable
+from outbox import Outbox
+from storage import user_state
+from sessions import SessionTable
+from clock import Clock
+from latency import LatencyTracker
+from stats import LiveStats
+
+logger = logging.getLogger("poem")
+
+PROMPT_RETRY_DELAY = 5.0  # Секунд до повтора недоставленного приглашения к ходу (не меньше)
 
 # ==================== DATACLASSES И ENUMS ====================
 
@@ -22,7 +35,7 @@ class PoemStatus(Enum):
     CANCELLED = "cancelled"
 
 
-@dataclass
+@dataclass(slots=True)
 class TeamMember:
     """Информация об участнике команды"""
     user_id: int
@@ -33,9 +46,11 @@ class TeamMember:
     has_contributed: bool = False
     contribution: str = ""
     skipped: bool = False  # Добавлено для отслеживания пропусков
+    progress_message_id: Optional[int] = None  # Закрепленное сообщение с прогрессом
+    progress_text: str = ""  # Последний отправленный текст прогресса
 
 
-@dataclass
+@dataclass(slots=True)
 class TeamPoem:
     """Состояние командного стихотворения"""
     team: str
@@ -45,7 +60,12 @@ class TeamPoem:
     current_member_index: int = 0
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
+    turn_started_at: Optional[datetime] = None  # Когда текущему участнику передан ход
     _ready_for_completion: bool = False
+    _row_id: Optional[int] = field(default=None, repr=False)  # Строка в team_poems
+    _rendered_lines: List[str] = field(default_factory=list, repr=False)  # Кэш отрисованных строк
+    _progress_task: Optional[asyncio.Task] = field(default=None, repr=False)  # Отложенное обновление прогресса
+    _progress_sent_at: float = 0.0
 
     def get_current_member(self) -> Optional[TeamMember]:
         """Получить текущего участника в очереди"""
@@ -54,7 +74,7 @@ class TeamPoem:
             return self.members[self.current_member_index]
         
         # Если индекс вышел за пределы, возвращаем None
-        logging.debug(f"current_member_index {self.current_member_index} вышел за пределы [0, {len(self.members)})")
+        logger.debug("current_member_index %s вышел за пределы [0, %s)", self.current_member_index, len(self.members))
         return None
 
     def get_poem_text(self) -> str:
@@ -62,9 +82,11 @@ class TeamPoem:
         if not self.lines:
             return "Стихотворение еще не начато..."
 
-        poem_text = "📜 **Наше командное стихотворение:**\n\n"
-        for i, line in enumerate(self.lines, 1):
-            poem_text += f"{i}. {line}\n"
+        # Отрисовываем только строки, добавленные с прошлого вызова
+        for i in range(len(self._rendered_lines), len(self.lines)):
+            self._rendered_lines.append(f"{i + 1}. {self.lines[i]}\n")
+
+        poem_text = "📜 **Наше командное стихотворение:**\n\n" + "".join(self._rendered_lines)
         
         # Добавляем информацию о пропущенных участниках
         skipped_members = [m for m in self.members if m.skipped and not m.has_contributed]
@@ -93,7 +115,7 @@ class TeamPoem:
             self.current_member_index += 1
         else:
             # Это был последний участник, стихотворение готово к завершению
-            logging.info(f"Последний участник {member.fio} добавил строку, стихотворение готово к завершению")
+            logger.info("Последний участник %s добавил строку, стихотворение готово к завершению", member.fio)
             # Устанавливаем статус готовности к завершению
             self.status = PoemStatus.IN_PROGRESS  # Остается IN_PROGRESS, но готово к завершению
             # Устанавливаем current_member_index в -1, чтобы _process_next_member завершил стихотворение
@@ -114,7 +136,7 @@ class TeamPoem:
             self.current_member_index += 1
         else:
             # Это был последний участник, стихотворение готово к завершению
-            logging.info(f"Последний участник {member.fio} пропущен, стихотворение готово к завершению")
+            logger.info("Последний участник %s пропущен, стихотворение готово к завершению", member.fio)
             # Устанавливаем current_member_index в -1, чтобы _process_next_member завершил стихотворение
             self.current_member_index = -1
             # Помечаем стихотворение как готовое к завершению
@@ -136,17 +158,26 @@ class TeamPoemManager:
     Обеспечивает последовательное получение строк от участников команды.
     """
 
-    def __init__(self, bot: Bot, db_connection: sqlite3.Connection, dp=None):
+    def __init__(self, bot: Bot, db_connection: sqlite3.Connection, dp=None, catalog_store=None,
+                 event_title: str = "Традиции и трансформация", outbox: Optional[Outbox] = None,
+                 sessions: Optional[SessionTable] = None, stats: Optional[LiveStats] = None,
+                 latency: Optional[LatencyTracker] = None, clock: Optional[Clock] = None):
         self.bot = bot
+        self.outbox = outbox or Outbox(bot)  # Очередь исходящих сообщений (общая с основным ботом)
         self.conn = db_connection
         self.cur = db_connection.cursor()
         self.dp = dp  # Сохраняем ссылку на Dispatcher для управления состояниями
+        self.catalog_store = catalog_store  # Каталог вопросов: номер блока стихотворения
+        self.event_title = event_title
 
         # Хранилище состояний стихотворений по командам
         self.team_poems: Dict[str, TeamPoem] = {}
 
-        # Маппинг user_id -> team для быстрого поиска
-        self.user_to_team: Dict[int, str] = {}
+        # Таблица сессий участников (общая с основным ботом): команда участника идущего стихотворения
+        self.sessions = sessions if sessions is not None else SessionTable()
+        self.stats = stats  # Счетчики /stats основного бота
+        self.latency = latency  # Время ходов: шаг - номер строки стихотворения
+        self.clock = clock or Clock()  # Начало хода и таймаут ответа - по часам мероприятия
 
         # Инициализация таблицы для хранения стихотворений
         self._init_poem_table()
@@ -156,8 +187,35 @@ class TeamPoemManager:
 
         # Активные таймеры для участников
         self.active_timers: Dict[int, asyncio.Task] = {}
-
-        logging.info("TeamPoemManager инициализирован")
+        # Фоновые ожидания доставки и обновления прогресса (ссылки нужны, чтобы задачи не собрал GC)
+        self._background: Set[asyncio.Task] = set()
+
+        # Обновления закрепленного сообщения с прогрессом (в секундах):
+        # изменения за progress_debounce склеиваются в одно редактирование,
+        # и редактирования идут не чаще раза в progress_min_interval
+        self.progress_debounce = 2.0
+        self.progress_min_interval = 10.0
+
+        logger.info("TeamPoemManager инициализирован")
+
+    @property
+    def enabled(self) -> bool:
+        """В каталоге есть блок стихотворения - без него командное стихотворение недоступно"""
+        return self.catalog_store is not None and self.catalog_store.catalog.poem_index is not None
+
+    @property
+    def block_index(self) -> int:
+        """Номер блока стихотворения в каталоге"""
+        if not self.enabled:
+            raise RuntimeError("В каталоге вопросов нет блока стихотворения")
+        return self.catalog_store.catalog.poem_index
+
+    @property
+    def finished_block(self) -> int:
+        """Значение current_block у участников, завершивших все задания"""
+        if not self.enabled:
+            raise RuntimeError("В каталоге вопросов нет блока стихотворения")
+        return len(self.catalog_store.catalog)
 
     def _init_poem_table(self):
         """Создание таблицы для хранения командных стихотворений"""
@@ -183,12 +241,21 @@ class TeamPoemManager:
                 fio TEXT,
                 line_number INTEGER,
                 contribution TEXT,
-                contributed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                contributed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                message_id INTEGER
             )
         """)
+        columns = [row[1] for row in self.cur.execute("PRAGMA table_info(poem_contributions)")]
+        if "message_id" not in columns:
+            self.cur.execute("ALTER TABLE poem_contributions ADD COLUMN message_id INTEGER")
+        # Сообщение со строкой записывается один раз, даже если Telegram доставил его повторно
+        self.cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_poem_contributions_message
+            ON poem_contributions (chat_id, message_id)
+        """)
 
         self.conn.commit()
-        logging.info("Таблицы для стихотворений созданы")
+        logger.info("Таблицы для стихотворений созданы")
 
     async def check_team_readiness_and_start(self, team: str) -> bool:
         """
@@ -200,44 +267,47 @@ class TeamPoemManager:
         Returns:
             bool: True если процесс запущен или уже запущен ранее
         """
+        if not self.enabled:
+            logger.warning("Стихотворение для команды %s не запущено: в каталоге нет блока стихотворения", team)
+            return False
         try:
-            logging.info(f"Проверка готовности команды {team} к стихотворению")
+            logger.info("Проверка готовности команды %s к стихотворению", team)
             
             # Проверяем, не запущен ли уже процесс для этой команды
             if team in self.team_poems:
                 if self.team_poems[team].status == PoemStatus.IN_PROGRESS:
-                    logging.info(f"Процесс стихотворения для команды {team} уже запущен")
+                    logger.info("Процесс стихотворения для команды %s уже запущен", team)
                     return True  # Возвращаем True, так как процесс уже идёт
                 elif self.team_poems[team].status == PoemStatus.COMPLETED:
-                    logging.info(f"Стихотворение команды {team} уже завершено")
+                    logger.info("Стихотворение команды %s уже завершено", team)
                     return True  # Возвращаем True, так как задание выполнено
 
-            # Проверяем, все ли участники команды готовы (достигли блока 5)
+            # Проверяем, все ли участники команды готовы (достигли блока стихотворения)
             self.cur.execute("""
                 SELECT COUNT(*) as total,
-                       SUM(CASE WHEN current_block >= 5 THEN 1 ELSE 0 END) as ready
+                       SUM(CASE WHEN current_block >= ? THEN 1 ELSE 0 END) as ready
                 FROM answers
                 WHERE team = ?
-            """, (team,))
+            """, (self.block_index, team))
 
             result = self.cur.fetchone()
             if not result:
-                logging.warning(f"Нет данных о команде {team} в БД")
+                logger.warning("Нет данных о команде %s в БД", team)
                 return False
 
             total, ready = result
-            logging.info(f"Команда {team}: {ready}/{total} участников готовы к стихотворению")
+            logger.info("Команда %s: %s/%s участников готовы к стихотворению", team, ready, total)
 
             # Запускаем только когда ВСЕ участники готовы
             if ready == total and total > 0:
-                logging.info(f"Все участники команды {team} готовы ({ready}/{total}). Запускаем стихотворение.")
+                logger.info("Все участники команды %s готовы (%s/%s). Запускаем стихотворение.", team, ready, total)
                 return await self.start_team_poem_block(team)
             else:
-                logging.info(f"Команда {team}: только {ready}/{total} участников готовы к стихотворению")
+                logger.info("Команда %s: только %s/%s участников готовы к стихотворению", team, ready, total)
                 return False
 
         except Exception as e:
-            logging.error(f"Ошибка при проверке готовности команды {team}: {e}", exc_info=True)
+            logger.error("Ошибка при проверке готовности команды %s: %s", team, e, exc_info=True)
             return False
 
     async def start_team_poem_block(self, team: str) -> bool:
@@ -250,20 +320,23 @@ class TeamPoemManager:
         Returns:
             bool: True если процесс успешно запущен
         """
+        if not self.enabled:
+            logger.warning("Стихотворение для команды %s не запущено: в каталоге нет блока стихотворения", team)
+            return False
         try:
-            logging.info(f"Запуск процесса стихотворения для команды {team}")
+            logger.info("Запуск процесса стихотворения для команды %s", team)
             
             # Проверяем, не запущен ли уже процесс для этой команды
             if team in self.team_poems and self.team_poems[team].status == PoemStatus.IN_PROGRESS:
-                logging.warning(f"Процесс стихотворения для команды {team} уже запущен")
+                logger.warning("Процесс стихотворения для команды %s уже запущен", team)
                 return False
 
             # Получаем всех участников команды в порядке регистрации
             members = self._get_team_members(team)
-            logging.info(f"Получено {len(members)} участников для команды {team}")
+            logger.info("Получено %s участников для команды %s", len(members), team)
 
             if not members:
-                logging.warning(f"Нет участников в команде {team}")
+                logger.warning("Нет участников в команде %s", team)
                 return False
 
             # Создаем объект стихотворения
@@ -271,49 +344,46 @@ class TeamPoemManager:
                 team=team,
                 status=PoemStatus.IN_PROGRESS,
                 members=members,
-                started_at=datetime.now()
+                started_at=self.clock.now()
             )
 
             self.team_poems[team] = poem
 
             # Обновляем маппинг пользователей
             for member in members:
-                self.user_to_team[member.user_id] = team
-                logging.info(f"Добавлен участник {member.fio} (user_id: {member.user_id}) в команду {team}")
+                self.sessions.set_team((member.chat_id, member.user_id), team)
+                logger.debug("Добавлен участник %s (user_id: %s) в команду %s", member.fio, member.user_id, team)
 
             # Отправляем инструкцию всем участникам команды
             await self._send_instructions_to_team(poem)
 
-            # Запускаем процесс с первым участником
+            # Запускаем процесс с первым участником (состояние сохраняется в БД при каждой передаче хода)
             await self._request_line_from_member(poem.members[0], poem)
 
-            # Сохраняем в БД
-            self._save_poem_state(poem)
-
-            logging.info(f"Процесс стихотворения успешно запущен для команды {team} с {len(members)} участниками")
+            logger.info("Процесс стихотворения успешно запущен для команды %s с %s участниками", team, len(members))
             return True
 
         except Exception as e:
-            logging.error(f"Ошибка при запуске стихотворения для команды {team}: {e}", exc_info=True)
+            logger.error("Ошибка при запуске стихотворения для команды %s: %s", team, e, exc_info=True)
             return False
 
     def _get_team_members(self, team: str) -> List[TeamMember]:
         """Получить список участников команды из БД"""
-        logging.info(f"🎭 [POEM] Поиск участников команды {team} с current_block >= 5")
+        logger.info("🎭 [POEM] Поиск участников команды %s", team)
         
         self.cur.execute("""
             SELECT user_id, chat_id, fio, username, current_block
             FROM answers
-            WHERE team = ? --AND current_block >= 5
+            WHERE team = ?
             ORDER BY id -- Порядок регистрации
         """, (team,))
 
         rows = self.cur.fetchall()
-        logging.info(f"🎭 [POEM] Найдено {len(rows)} участников команды {team} с current_block >= 5")
+        logger.info("🎭 [POEM] Найдено %s участников команды %s", len(rows), team)
         
         # Логируем детали для отладки
         for row in rows:
-            logging.info(f"🎭 [POEM] Участник: user_id={row[0]}, chat_id={row[1]}, fio={row[2]}, username={row[3]}, current_block={row[4]}")
+            logger.debug("🎭 [POEM] Участник: user_id=%s, chat_id=%s, fio=%s, username=%s, current_block=%s", row[0], row[1], row[2], row[3], row[4])
 
         members = []
         for i, row in enumerate(rows):
@@ -325,7 +395,7 @@ class TeamPoemManager:
                 order=i
             ))
 
-        logging.info(f"🎭 [POEM] Создано {len(members)} объектов TeamMember для команды {team}")
+        logger.info("🎭 [POEM] Создано %s объектов TeamMember для команды %s", len(members), team)
         return members
 
     async def _send_instructions_to_team(self, poem: TeamPoem):
@@ -350,24 +420,47 @@ class TeamPoemManager:
 
         instruction_text += "\n💫 Удачи в творчестве!"
 
-        # Отправляем всем участникам
+        # Отправляем всем участникам; ошибки отправки логирует очередь
         for member in poem.members:
-            try:
-                await self.bot.send_message(
-                    member.chat_id,
-                    instruction_text,
-                    parse_mode="Markdown"
-                )
-            except Exception as e:
-                logging.error(f"Не удалось отправить инструкцию участнику {member.user_id}: {e}")
+            self.outbox.send(member.chat_id, instruction_text, parse_mode="Markdown")
+
+        # Сообщение с прогрессом отправляется один раз и закрепляется, дальше оно только редактируется.
+        # Его нельзя склеивать с другими - иначе при редактировании пропадет остальной текст.
+        # Закрепление ставится в очередь по факту доставки - обработчик доставки не ждет
+        progress_text = self._render_progress(poem)
+        for member in poem.members:
+            delivery = self.outbox.send(member.chat_id, progress_text, merge=False, parse_mode="Markdown")
+            delivery.add_done_callback(
+                lambda future, member=member: self._pin_progress(poem, member, progress_text, future)
+            )
+
+    def _pin_progress(self, poem: TeamPoem, member: TeamMember, text: str, delivery: asyncio.Future):
+        """Сообщение с прогрессом доставлено: запомнить его и закрепить"""
+        if delivery.cancelled() or delivery.exception():
+            logger.warning("Не удалось отправить прогресс участнику %s", member.user_id)
+            return
+        sent = delivery.result()
+        member.progress_message_id = sent.message_id
+        member.progress_text = text
+        self.outbox.call(member.chat_id, PinChatMessage(
+            chat_id=member.chat_id, message_id=sent.message_id, disable_notification=True
+        ))
+        # Пока сообщение шло, прогресс мог измениться - правку до него не довели
+        if self._render_progress(poem) != text:
+            self._schedule_progress_update(poem)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
 
     async def _request_line_from_member(self, member: TeamMember, poem: TeamPoem):
         """Запросить строку у конкретного участника"""
         try:
             # Устанавливаем состояние FSM для участника
             if self.dp:
-                from aiogram.fsm.context import FSMContext
-                state = FSMContext(self.dp.storage, key=("bot", str(member.chat_id), str(member.user_id)))
+                state = user_state(self.bot, self.dp.storage, member.chat_id, member.user_id)
                 # Очищаем старое состояние перед установкой нового
                 await state.clear()
                 await state.set_state(TeamPoemState.waiting_for_poem_line)
@@ -376,13 +469,17 @@ class TeamPoemManager:
                     "waiting_for_poem": True,
                     "poem_member_id": member.user_id  # Добавляем идентификатор участника
                 })
-                logging.info(f"Установлено состояние TeamPoemState.waiting_for_poem_line для user_id={member.user_id}")
+                logger.info("Установлено состояние TeamPoemState.waiting_for_poem_line для user_id=%s", member.user_id)
 
             # Формируем сообщение с текущим стихотворением
             message_text = f"🖊 **{member.fio}, ваша очередь!**\n\n"
 
             if poem.lines:
-                message_text += poem.get_poem_text() + "\n"
+                # Полный текст - в закрепленном сообщении, здесь только последняя строка для рифмы
+                message_text += (
+                    f"Последняя строка:\n➡️ _{poem.lines[-1]}_\n\n"
+                    "📌 Весь текст стихотворения - в закрепленном сообщении.\n\n"
+                )
             else:
                 message_text += "Вы начинаете стихотворение о нашей компании!\n\n"
 
@@ -392,11 +489,11 @@ class TeamPoemManager:
                 f"⏰ У вас есть {self.response_timeout} минуты на ответ."
             )
 
-            await self.bot.send_message(
-                member.chat_id,
-                message_text,
-                parse_mode="Markdown"
-            )
+            if self.latency:
+                self.latency.published((member.chat_id, member.user_id), self.block_index, len(poem.lines) + 1)
+            # Приглашение не откладывается в dead_letters: повтор после конца хода не нужен,
+            # недоставленное приглашение повторяет _watch_prompt, пока ход за участником
+            delivery = self.outbox.send(member.chat_id, message_text, dead_letter=False, parse_mode="Markdown")
 
             # Обновляем БД - помечаем пользователя как активного
             self.cur.execute(
@@ -405,52 +502,113 @@ class TeamPoemManager:
             )
             self.conn.commit()
 
-            # Запускаем таймер ожидания
-            timer_task = asyncio.create_task(
-                self._timeout_handler(member, poem)
-            )
-            self.active_timers[member.user_id] = timer_task
+            # Запускаем таймер ожидания и сохраняем ход, чтобы восстановить его после перезапуска
+            poem.turn_started_at = self.clock.now()
+            self._arm_timer(member, poem)
+            self._save_poem_state(poem)
 
-            logging.info(f"Запрошена строка у участника {member.fio} (user_id: {member.user_id})")
+            # Доставку ждет фоновая задача: обработчик строки предыдущего участника не ждет сеть
+            self._spawn(self._watch_prompt(member, poem, delivery, message_text))
+
+            logger.info("Запрошена строка у участника %s (user_id: %s)", member.fio, member.user_id)
 
         except Exception as e:
-            logging.error(f"Ошибка при запросе строки у участника {member.user_id}: {e}")
+            logger.error("Ошибка при запросе строки у участника %s: %s", member.user_id, e)
             # Пропускаем участника и переходим к следующему
             poem.skip_member(member)
             await self._process_next_member(poem)
 
-    async def _timeout_handler(self, member: TeamMember, poem: TeamPoem):
+    @staticmethod
+    def _has_turn(member: TeamMember, poem: TeamPoem) -> bool:
+        return (poem.status == PoemStatus.IN_PROGRESS and poem.get_current_member() is member
+                and not member.has_contributed and not member.skipped)
+
+    def _cancel_timer(self, member: TeamMember):
+        timer = self.active_timers.pop(member.user_id, None)
+        if timer:
+            timer.cancel()
+
+    async def _watch_prompt(self, member: TeamMember, poem: TeamPoem, delivery: asyncio.Future, text: str):
+        """
+        Итог доставки приглашения к ходу. Ход пропускается, только если чат участника
+        недоступен (бот заблокирован, чат удален). При сбое связи или разомкнутом
+        предохранителе ход остается за участником: таймер останавливается, приглашение
+        повторяется после восстановления связи, и время хода отсчитывается заново
+        """
+        parse_mode = "Markdown"
+        retried = False
+        while True:
+            try:
+                await delivery
+                break
+            except Exception as e:
+                if not self._has_turn(member, poem):
+                    return
+                if chat_unavailable(e) or (isinstance(e, TelegramBadRequest) and parse_mode is None):
+                    logger.error("Не удалось отправить приглашение к ходу участнику %s: %s", member.user_id, e)
+                    self._cancel_timer(member)
+                    poem.skip_member(member)
+                    await self._process_next_member(poem)
+                    return
+                if isinstance(e, TelegramBadRequest):
+                    # Разметку сломало ФИО или строка стихотворения - повторяем простым текстом
+                    parse_mode = None
+                else:
+                    logger.warning("Приглашение к ходу участнику %s не доставлено (%s), ход ждет связи",
+                                   member.user_id, type(e).__name__)
+                    self._cancel_timer(member)
+                    breaker = self.outbox.breaker
+                    await asyncio.sleep(max(PROMPT_RETRY_DELAY, breaker.retry_in() if breaker else 0.0))
+                    if not self._has_turn(member, poem):
+                        return
+                retried = True
+                delivery = self.outbox.send(member.chat_id, text, dead_letter=False, parse_mode=parse_mode)
+
+        if self.latency:
+            self.latency.delivered((member.chat_id, member.user_id))
+        if retried and self._has_turn(member, poem):
+            self._cancel_timer(member)
+            poem.turn_started_at = self.clock.now()
+            self._arm_timer(member, poem)
+            self._save_poem_state(poem)
+
+    def _arm_timer(self, member: TeamMember, poem: TeamPoem, delay: Optional[float] = None):
+        """Запустить таймер ожидания строки (delay - оставшееся время в секундах)"""
+        self.active_timers[member.user_id] = asyncio.create_task(self._timeout_handler(member, poem, delay))
+
+    async def _timeout_handler(self, member: TeamMember, poem: TeamPoem, delay: Optional[float] = None):
         """Обработчик таймаута для участника"""
         try:
-            await asyncio.sleep(self.response_timeout * 60)
+            await self.clock.sleep(self.response_timeout * 60 if delay is None else delay)
 
             # Проверяем, не ответил ли участник
             if not member.has_contributed and not member.skipped:
-                logging.warning(f"Таймаут для участника {member.fio} (user_id: {member.user_id})")
+                logger.warning("Таймаут для участника %s (user_id: %s)", member.fio, member.user_id)
 
                 # Помечаем участника как пропущенного
                 poem.skip_member(member)
+                if self.latency:
+                    self.latency.abandon((member.chat_id, member.user_id))
 
                 # Добавляем пропуск в стихотворение
                 skip_line = f"[Пропущено участником {member.fio}]"
                 poem.lines.append(skip_line)
 
+                self._schedule_progress_update(poem)
+
                 # Уведомляем участника
-                try:
-                    await self.bot.send_message(
-                        member.chat_id,
-                        "⏰ Время истекло! Ваш ход пропущен.\n"
-                        "Передаем слово следующему участнику.",
-                        parse_mode="Markdown"
-                    )
-                except:
-                    pass
+                self.outbox.send(
+                    member.chat_id,
+                    "⏰ Время истекло! Ваш ход пропущен.\n"
+                    "Передаем слово следующему участнику.",
+                    parse_mode="Markdown"
+                )
 
                 # Переходим к следующему или завершаем стихотворение
                 await self._process_next_member(poem)
 
         except asyncio.CancelledError:
-            logging.info(f"Таймер для участника {member.user_id} отменен")
+            logger.info("Таймер для участника %s отменен", member.user_id)
 
     async def process_poem_line(self, message: types.Message, state: FSMContext) -> bool:
         """
@@ -469,12 +627,12 @@ class TeamPoemManager:
 
             # Проверяем состояние FSM
             state_data = await state.get_data()
-            logging.info(f"Обработка строки стихотворения от user_id={user_id}, state_data={state_data}")
+            logger.debug("Обработка строки стихотворения от user_id=%s, state_data=%s", user_id, state_data)
 
             # Находим команду участника
-            team = self.user_to_team.get(user_id)
+            team = self.sessions.team((chat_id, user_id))
             if not team or team not in self.team_poems:
-                logging.warning(f"Пользователь {user_id} не найден в команде или команда не активна")
+                logger.warning("Пользователь %s не найден в команде или команда не активна", user_id)
                 await message.answer("❌ Вы не участвуете в создании стихотворения.")
                 return False
 
@@ -483,7 +641,7 @@ class TeamPoemManager:
             # Проверяем, что это очередь данного участника
             current_member = poem.get_current_member()
             if not current_member or current_member.user_id != user_id:
-                logging.warning(f"Пользователь {user_id} пытается ответить не в свою очередь. Текущий: {current_member.user_id if current_member else 'None'}")
+                logger.warning("Пользователь %s пытается ответить не в свою очередь. Текущий: %s", user_id, current_member.user_id if current_member else 'None')
                 await message.answer(
                     "⏳ Сейчас не ваша очередь. Дождитесь своего хода."
                 )
@@ -491,13 +649,13 @@ class TeamPoemManager:
 
             # Дополнительная проверка: убеждаемся, что участник действительно должен отвечать
             if current_member.has_contributed or current_member.skipped:
-                logging.warning(f"Пользователь {user_id} уже ответил или был пропущен")
+                logger.warning("Пользователь %s уже ответил или был пропущен", user_id)
                 await message.answer("❌ Вы уже ответили на этот вопрос.")
                 return False
 
             # Проверяем, что участник действительно является текущим в очереди
             if poem.current_member_index < 0 or poem.current_member_index >= len(poem.members):
-                logging.warning(f"Некорректный current_member_index: {poem.current_member_index} для команды с {len(poem.members)} участниками")
+                logger.warning("Некорректный current_member_index: %s для команды с %s участниками", poem.current_member_index, len(poem.members))
                 await message.answer("❌ Произошла ошибка в процессе. Попробуйте еще раз.")
                 return False
 
@@ -512,30 +670,33 @@ class TeamPoemManager:
                 await message.answer("❌ Строка не может быть пустой. Попробуйте еще раз.")
                 return False
 
+            if self.latency:
+                self.latency.answered((chat_id, user_id), self.block_index, len(poem.lines) + 1)
             poem.add_line(line_text, current_member)
 
             # Сохраняем в БД
-            self._save_contribution(poem.team, current_member, line_text, len(poem.lines))
+            self._save_contribution(poem.team, current_member, line_text, len(poem.lines), message.message_id)
 
             # Отправляем подтверждение
-            await message.answer(
+            self.outbox.send(
+                chat_id,
                 "✅ Ваша строка добавлена в стихотворение!\n"
                 "Спасибо за ваш вклад! 🎭"
             )
 
-            # Уведомляем всю команду о прогрессе
-            await self._notify_team_progress(poem, current_member)
+            # Обновляем закрепленный прогресс у всей команды
+            self._schedule_progress_update(poem)
 
             # Переходим к следующему участнику или завершаем
             completed_user_ids = await self._process_next_member(poem)
 
-            logging.info(f"Строка стихотворения от пользователя {user_id} успешно обработана: '{line_text}'")
+            logger.info("Строка стихотворения от пользователя %s успешно обработана", user_id)
             
             # Возвращаем информацию о завершивших пользователях
             return completed_user_ids if completed_user_ids else True
 
         except Exception as e:
-            logging.error(f"Ошибка при обработке строки стихотворения от user_id={user_id}: {e}", exc_info=True)
+            logger.error("Ошибка при обработке строки стихотворения от user_id=%s: %s", user_id, e, exc_info=True)
             await message.answer("❌ Произошла ошибка. Попробуйте еще раз.")
             return False
 
@@ -557,25 +718,25 @@ class TeamPoemManager:
                 index_out_of_bounds = poem.current_member_index < 0 or poem.current_member_index >= len(poem.members)
                 
                 if all_processed or poem._ready_for_completion or index_out_of_bounds:
-                    logging.info(f"Стихотворение команды {poem.team} готово к завершению. "
-                               f"Все обработаны: {all_processed}, готово к завершению: {poem._ready_for_completion}, "
-                               f"индекс вне границ: {index_out_of_bounds}")
+                    logger.info("Стихотворение команды %s готово к завершению. "
+                                "Все обработаны: %s, готово к завершению: %s, индекс вне границ: %s",
+                                poem.team, all_processed, poem._ready_for_completion, index_out_of_bounds)
                     completed_user_ids = await self._complete_team_poem(poem)
                     return completed_user_ids
                 else:
-                    logging.warning(f"Стихотворение команды {poem.team} не может быть завершено - "
-                                  f"не все участники обработаны и не готово к завершению")
+                    logger.warning("Стихотворение команды %s не может быть завершено - "
+                                   "не все участники обработаны и не готово к завершению", poem.team)
                     return []
 
         except Exception as e:
-            logging.error(f"Ошибка при переходе к следующему участнику: {e}")
+            logger.error(f"Ошибка при переходе к следующему участнику: {e}")
             return []
 
     async def _complete_team_poem(self, poem: TeamPoem):
         """Завершение создания командного стихотворения"""
         try:
             poem.status = PoemStatus.COMPLETED
-            poem.completed_at = datetime.now()
+            poem.completed_at = self.clock.now()
 
             # Отменяем все активные таймеры для этой команды
             for member in poem.members:
@@ -583,6 +744,11 @@ class TeamPoemManager:
                     self.active_timers[member.user_id].cancel()
                     del self.active_timers[member.user_id]
 
+            # Финальное состояние прогресса - сразу, без паузы, но в фоне
+            if poem._progress_task:
+                poem._progress_task.cancel()
+            self._spawn(self._flush_progress(poem))
+
             # Формируем финальное сообщение
             completion_text = (
                     "🎉 **СТИХОТВОРЕНИЕ ЗАВЕРШЕНО!**\n\n"
@@ -600,30 +766,22 @@ class TeamPoemManager:
 
             # Отправляем всем участникам команды
             for member in poem.members:
-                try:
-                    await self.bot.send_message(
-                        member.chat_id,
-                        completion_text,
-                        parse_mode="Markdown"
-                    )
-
-                    # Обновляем состояние участника в БД - помечаем как завершившего все задания
-                    self.cur.execute(
-                        "UPDATE answers SET current_block=6, is_active=0 WHERE user_id=? AND chat_id=?",
-                        (member.user_id, member.chat_id)
-                    )
-
-                    # Отправляем финальное сообщение о завершении всех блоков
-                    await self.bot.send_message(
-                        member.chat_id,
-                        "🎊 Поздравляем! Вы успешно прошли все блоки корпоративной игры!\n\n"
-                        "Спасибо за активное участие в мероприятии «Традиции и трансформация». "
-                        "Ваши ответы записаны и будут учтены при подведении итогов.\n\n"
-                        "Ожидайте объявления результатов и награждения! 🏆"
-                    )
-
-                except Exception as e:
-                    logging.error(f"Не удалось отправить финал участнику {member.user_id}: {e}")
+                self.outbox.send(member.chat_id, completion_text, parse_mode="Markdown")
+
+                # Обновляем состояние участника в БД - помечаем как завершившего все задания
+                self.cur.execute(
+                    "UPDATE answers SET current_block=?, is_active=0 WHERE user_id=? AND chat_id=?",
+                    (self.finished_block, member.user_id, member.chat_id)
+                )
+
+                # Отправляем финальное сообщение о завершении всех блоков
+                self.outbox.send(
+                    member.chat_id,
+                    "🎊 Поздравляем! Вы успешно прошли все блоки корпоративной игры!\n\n"
+                    f"Спасибо за активное участие в мероприятии «{self.event_title}». "
+                    "Ваши ответы записаны и будут учтены при подведении итогов.\n\n"
+                    "Ожидайте объявления результатов и награждения! 🏆"
+                )
 
             self.conn.commit()
 
@@ -632,37 +790,73 @@ class TeamPoemManager:
 
             # Очищаем данные
             del self.team_poems[poem.team]
+            # Участники завершили все задания - их сессии больше не нужны
             for member in poem.members:
-                self.user_to_team.pop(member.user_id, None)
+                self.sessions.discard((member.chat_id, member.user_id))
+            if self.stats:
+                self.stats.record_poem_completed(self.block_index, len(poem.members))
 
-            # Возвращаем список пользователей для очистки из active_blocks
+            # Возвращаем список завершивших пользователей
             return [member.user_id for member in poem.members]
 
-            logging.info(f"Стихотворение команды {poem.team} успешно завершено")
+            logger.info("Стихотворение команды %s успешно завершено", poem.team)
 
         except Exception as e:
-            logging.error(f"Ошибка при завершении стихотворения: {e}")
-
-    async def _notify_team_progress(self, poem: TeamPoem, last_contributor: TeamMember):
-        """Уведомить команду о прогрессе создания стихотворения"""
-        progress_text = (
-            f"📝 **Обновление стихотворения**\n\n"
-            f"{last_contributor.fio} добавил(а) строку:\n"
-            f"➡️ _{poem.lines[-1]}_\n\n"
-            f"Строк написано: {len(poem.lines)}/{len(poem.members)}"
-        )
+            logger.error(f"Ошибка при завершении стихотворения: {e}")
 
-        # Отправляем всем, кроме автора последней строки
-        for member in poem.members:
-            if member.user_id != last_contributor.user_id:
-                try:
-                    await self.bot.send_message(
-                        member.chat_id,
-                        progress_text,
-                        parse_mode="Markdown"
-                    )
-                except:
-                    pass
+    def _render_progress(self, poem: TeamPoem) -> str:
+        """Текст закрепленного сообщения с прогрессом"""
+        text = (
+            f"📝 **Прогресс стихотворения команды {poem.team}**\n"
+            f"Строк написано: {len(poem.lines)}/{len(poem.members)}\n"
+        )
+        current_member = poem.get_current_member()
+        if poem.status == PoemStatus.COMPLETED:
+            text += "✅ Стихотворение завершено!\n"
+        elif current_member:
+            text += f"✍️ Сейчас пишет: {current_member.fio}\n"
+        return text + "\n" + poem.get_poem_text()
+
+    def _schedule_progress_update(self, poem: TeamPoem):
+        """Запланировать обновление прогресса. Если обновление уже ждет - оно возьмет свежее состояние"""
+        if poem._progress_task and not poem._progress_task.done():
+            return
+        loop = asyncio.get_running_loop()
+        delay = max(self.progress_debounce, poem._progress_sent_at + self.progress_min_interval - loop.time())
+        poem._progress_task = asyncio.create_task(self._flush_progress(poem, delay))
+
+    async def _flush_progress(self, poem: TeamPoem, delay: float = 0.0):
+        """Отредактировать закрепленные сообщения, текст которых устарел"""
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            return
+
+        # Изменения, пришедшие во время редактирования, запланируют новое обновление
+        poem._progress_task = None
+        poem._progress_sent_at = asyncio.get_running_loop().time()
+
+        # Правки идут через очередь исходящих: общий лимит скорости, порядок в чате и предохранитель
+        text = self._render_progress(poem)
+        edits = [
+            (member, self.outbox.call(member.chat_id, EditMessageText(
+                text=text, chat_id=member.chat_id, message_id=member.progress_message_id, parse_mode="Markdown"
+            )))
+            for member in poem.members
+            if member.progress_message_id is not None and member.progress_text != text
+        ]
+        for member, future in edits:
+            try:
+                await future
+                member.progress_text = text
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    member.progress_text = text
+                else:
+                    logger.warning("Не удалось обновить прогресс участника %s: %s", member.user_id, e)
+            except Exception as e:
+                logger.warning("Не удалось обновить прогресс участника %s: %s", member.user_id, e)
 
     def _save_poem_state(self, poem: TeamPoem):
         """Сохранить состояние стихотворения в БД"""
@@ -674,46 +868,130 @@ class TeamPoemManager:
                 'members': [
                     {
                         'user_id': m.user_id,
+                        'chat_id': m.chat_id,
                         'fio': m.fio,
+                        'username': m.username,
                         'has_contributed': m.has_contributed,
                         'contribution': m.contribution,
-                        'skipped': m.skipped
+                        'skipped': m.skipped,
+                        'progress_message_id': m.progress_message_id
                     }
                     for m in poem.members
                 ],
-                'current_member_index': poem.current_member_index
+                'current_member_index': poem.current_member_index,
+                'turn_started_at': poem.turn_started_at.isoformat() if poem.turn_started_at else None
             }
-
-            self.cur.execute("""
-                INSERT OR REPLACE INTO team_poems 
-                (team, status, poem_data, started_at, completed_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
-                poem.team,
+            params = (
                 poem.status.value,
                 json.dumps(poem_data, ensure_ascii=False),
                 poem.started_at,
                 poem.completed_at
-            ))
+            )
+
+            # Одна строка на запуск стихотворения: первая запись вставляет ее, следующие обновляют
+            if poem._row_id is None:
+                self.cur.execute("""
+                    INSERT INTO team_poems
+                    (team, status, poem_data, started_at, completed_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (poem.team,) + params)
+                poem._row_id = self.cur.lastrowid
+            else:
+                self.cur.execute("""
+                    UPDATE team_poems SET status=?, poem_data=?, started_at=?, completed_at=?
+                    WHERE id=?
+                """, params + (poem._row_id,))
 
             self.conn.commit()
 
         except Exception as e:
-            logging.error(f"Ошибка при сохранении состояния стихотворения: {e}")
+            logger.error(f"Ошибка при сохранении состояния стихотворения: {e}")
 
-    def _save_contribution(self, team: str, member: TeamMember, line: str, line_number: int):
-        """Сохранить индивидуальный вклад в БД"""
+    def _save_contribution(self, team: str, member: TeamMember, line: str, line_number: int, message_id: int):
+        """Сохранить индивидуальный вклад в БД (повтор того же сообщения игнорируется)"""
         try:
             self.cur.execute("""
-                INSERT INTO poem_contributions
-                (team, user_id, chat_id, fio, line_number, contribution)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (team, member.user_id, member.chat_id, member.fio, line_number, line))
+                INSERT OR IGNORE INTO poem_contributions
+                (team, user_id, chat_id, fio, line_number, contribution, message_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (team, member.user_id, member.chat_id, member.fio, line_number, line, message_id))
 
             self.conn.commit()
 
         except Exception as e:
-            logging.error(f"Ошибка при сохранении вклада: {e}")
+            logger.error(f"Ошибка при сохранении вклада: {e}")
+
+    async def restore(self) -> List[int]:
+        """
+        Восстановить незавершенные стихотворения после перезапуска бота:
+        очередь, строки, таймер текущего участника и его состояние FSM.
+
+        Returns:
+            List[int]: user_id участников восстановленных стихотворений
+        """
+        self.cur.execute("""
+            SELECT id, team, poem_data, started_at FROM team_poems
+            WHERE id IN (SELECT MAX(id) FROM team_poems GROUP BY team) AND status = ?
+        """, (PoemStatus.IN_PROGRESS.value,))
+        rows = self.cur.fetchall()
+        if rows and not self.enabled:
+            logger.warning(f"Незавершенные стихотворения ({len(rows)}) не восстановлены: в каталоге нет блока стихотворения")
+            return []
+
+        restored = []
+        now = self.clock.now()
+        for row_id, team, raw_data, started_at in rows:
+            data = json.loads(raw_data)
+            members = [
+                TeamMember(
+                    user_id=m['user_id'],
+                    chat_id=m.get('chat_id', m['user_id']),  # В личном чате chat_id совпадает с user_id
+                    fio=m['fio'],
+                    username=m.get('username', ''),
+                    order=i,
+                    has_contributed=m['has_contributed'],
+                    contribution=m['contribution'],
+                    skipped=m['skipped'],
+                    progress_message_id=m.get('progress_message_id')
+                )
+                for i, m in enumerate(data['members'])
+            ]
+            if not members:
+                continue
+
+            turn_started_at = data.get('turn_started_at')
+            poem = TeamPoem(
+                team=team,
+                status=PoemStatus.IN_PROGRESS,
+                members=members,
+                lines=data['lines'],
+                current_member_index=data['current_member_index'],
+                started_at=datetime.fromisoformat(started_at) if started_at else None,
+                turn_started_at=datetime.fromisoformat(turn_started_at) if turn_started_at else now,
+                _ready_for_completion=data['current_member_index'] < 0,
+                _row_id=row_id
+            )
+            self.team_poems[team] = poem
+            for member in members:
+                self.sessions.set_team((member.chat_id, member.user_id), team)
+            restored.extend(member.user_id for member in members)
+
+            current_member = poem.get_current_member()
+            if current_member is None:
+                await self._process_next_member(poem)
+                continue
+
+            # Оставшееся время хода; если оно истекло, пока бот был выключен, ход пропускается сразу
+            elapsed = (now - poem.turn_started_at).total_seconds()
+            self._arm_timer(current_member, poem, max(0.0, self.response_timeout * 60 - elapsed))
+            if self.dp:
+                state = user_state(self.bot, self.dp.storage, current_member.chat_id, current_member.user_id)
+                await state.set_state(TeamPoemState.waiting_for_poem_line)
+                await state.set_data({"team": team, "waiting_for_poem": True, "poem_member_id": current_member.user_id})
+
+        if rows:
+            logger.info(f"Восстановлено стихотворений: {len(rows)}, участников: {len(restored)}")
+        return restored
 
     async def reset_user_poem_state(self, user_id: int, chat_id: int) -> bool:
         """
@@ -729,7 +1007,7 @@ class TeamPoemManager:
         """
         try:
             # Находим команду пользователя
-            team = self.user_to_team.get(user_id)
+            team = self.sessions.team((chat_id, user_id))
             if not team or team not in self.team_poems:
                 return False
 
@@ -758,22 +1036,23 @@ class TeamPoemManager:
             return False
 
         except Exception as e:
-            logging.error(f"Ошибка при сбросе состояния пользователя {user_id}: {e}")
+            logger.error("Ошибка при сбросе состояния пользователя %s: %s", user_id, e)
             return False
 
-    def is_user_in_poem_process(self, user_id: int) -> bool:
+    def is_user_in_poem_process(self, user_id: int, chat_id: int) -> bool:
         """
         Проверить, участвует ли пользователь в процессе создания стихотворения.
 
         Args:
             user_id: ID пользователя
+            chat_id: ID чата
 
         Returns:
             bool: True если пользователь участвует в активном процессе
         """
-        team = self.user_to_team.get(user_id)
+        team = self.sessions.team((chat_id, user_id))
         if not team or team not in self.team_poems:
-            logging.info(f"🎭 [POEM] Проверка участия пользователя {user_id} в процессе: False (нет команды или команда не активна)")
+            logger.debug("🎭 [POEM] Проверка участия пользователя %s в процессе: False (нет команды или команда не активна)", user_id)
             return False
 
         poem = self.team_poems[team]
@@ -781,7 +1060,7 @@ class TeamPoemManager:
         
         if is_in_process:
             current_member = poem.get_current_member()
-            logging.info(f"🎭 [POEM] Пользователь {user_id} в команде {team}, текущий участник: {current_member.user_id if current_member else 'None'}")
+            logger.debug("🎭 [POEM] Пользователь %s в команде %s, текущий участник: %s", user_id, team, current_member.user_id if current_member else 'None')
         
         return is_in_process
 
@@ -806,7 +1085,7 @@ class TeamPoemManager:
                 SELECT status, poem_data, started_at, completed_at
                 FROM team_poems
                 WHERE team = ?
-                ORDER BY created_at DESC LIMIT 1
+                ORDER BY id DESC LIMIT 1
             """, (team,))
 
             result = self.cur.fetchone()
@@ -824,5 +1103,5 @@ class TeamPoemManager:
             return None
 
         except Exception as e:
-            logging.error(f"Ошибка при получении статистики: {e}")
+            logger.error(f"Ошибка при получении статистики: {e}")
             return None
\ No newline at end of file
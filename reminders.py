@@ -0,0 +1,147 @@
+import logging
+import sqlite3
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from clock import Clock
+from outbox import Outbox
+
+logger = logging.getLogger("bot.reminders")
+
+# Виды политик напоминаний
+IDLE = "idle"                  # Участник открыл блок и давно не отвечает
+TEAM_BLOCKER = "team_blocker"  # Участник не дошел до стихотворения, а его команда уже ждет
+POLICY_KINDS = (IDLE, TEAM_BLOCKER)
+
+
+@dataclass(frozen=True)
+class ReminderPolicy:
+    policy_id: int
+    kind: str
+    block: int          # Для IDLE - номер блока, для TEAM_BLOCKER - номер блока стихотворения
+    after_minutes: int  # Сколько минут бездействия до напоминания
+    text: str
+
+
+class ReminderScheduler:
+    """
+    Напоминания отстающим участникам по политикам администратора.
+
+    Каждая политика - один запрос по индексу (current_block, last_activity), поэтому
+    проверка не просматривает всю таблицу answers. Напоминание отправляется через
+    общую очередь исходящих и не чаще одного раза на участника и блок.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, outbox: Outbox, poem_block: Callable[[], Optional[int]],
+                 clock: Optional[Clock] = None):
+        self.conn = conn
+        self.outbox = outbox
+        self.poem_block = poem_block  # Номер блока стихотворения в текущем каталоге
+        self.clock = clock or Clock()  # Бездействие считается по часам мероприятия, как и last_activity
+        self._init_tables()
+
+    def _init_tables(self):
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_answers_block_activity ON answers (current_block, last_activity)"
+        )
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS reminder_policies (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                block INTEGER NOT NULL,
+                after_minutes INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS reminders_sent (
+                user_id INTEGER NOT NULL,
+                block INTEGER NOT NULL,
+                policy_id INTEGER NOT NULL,
+                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, block)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    # ==================== ПОЛИТИКИ ====================
+
+    def policies(self) -> List[ReminderPolicy]:
+        rows = self.conn.execute(
+            "SELECT id, kind, block, after_minutes, text FROM reminder_policies ORDER BY id"
+        ).fetchall()
+        return [ReminderPolicy(*row) for row in rows]
+
+    def add_policy(self, kind: str, block: int, after_minutes: int, text: str) -> int:
+        if kind not in POLICY_KINDS:
+            raise ValueError(f"Неизвестный вид напоминания '{kind}'")
+        if after_minutes <= 0:
+            raise ValueError("Время бездействия должно быть больше нуля")
+        cur = self.conn.execute(
+            "INSERT INTO reminder_policies (kind, block, after_minutes, text) VALUES (?, ?, ?, ?)",
+            (kind, block, after_minutes, text)
+        )
+        self.conn.commit()
+        logger.info(f"Добавлена политика напоминаний #{cur.lastrowid}: {kind}, блок {block}, {after_minutes} мин")
+        return cur.lastrowid
+
+    def remove_policy(self, policy_id: int) -> bool:
+        removed = self.conn.execute("DELETE FROM reminder_policies WHERE id=?", (policy_id,)).rowcount
+        self.conn.commit()
+        return bool(removed)
+
+    def sent_count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM reminders_sent").fetchone()[0]
+
+    # ==================== ПРОВЕРКА ====================
+
+    def _due_idle(self, policy: ReminderPolicy):
+        return self.conn.execute("""
+            SELECT a.chat_id, a.user_id FROM answers a
+            WHERE a.current_block = ? AND a.last_activity < datetime(?, ?) AND a.is_active = 1
+              AND NOT EXISTS (SELECT 1 FROM reminders_sent r WHERE r.user_id = a.user_id AND r.block = ?)
+        """, (policy.block, self.clock.db_now(), f"-{policy.after_minutes} minutes", policy.block)).fetchall()
+
+    def _due_team_blockers(self, policy: ReminderPolicy):
+        # Участники каждого блока до стихотворения - отдельным запросом по индексу
+        due = []
+        for block in range(policy.block):
+            due.extend(self.conn.execute("""
+                SELECT a.chat_id, a.user_id FROM answers a
+                WHERE a.current_block = ? AND a.last_activity < datetime(?, ?)
+                  AND a.team IN (SELECT team FROM answers WHERE current_block >= ?)
+                  AND NOT EXISTS (SELECT 1 FROM reminders_sent r WHERE r.user_id = a.user_id AND r.block = ?)
+            """, (block, self.clock.db_now(), f"-{policy.after_minutes} minutes", policy.block, policy.block)).fetchall())
+        return due
+
+    def run_once(self) -> int:
+        """Проверить все политики и поставить напоминания в очередь. Возвращает число напоминаний"""
+        queued = 0
+        for policy in self.policies():
+            if policy.kind == TEAM_BLOCKER:
+                # Политика стихотворения следует за каталогом, если номер блока в нем изменился
+                policy_block = self.poem_block()
+                if policy_block is None:
+                    continue
+                if policy_block != policy.block:
+                    policy = ReminderPolicy(policy.policy_id, policy.kind, policy_block,
+                                            policy.after_minutes, policy.text)
+                due = self._due_team_blockers(policy)
+            else:
+                due = self._due_idle(policy)
+
+            for chat_id, user_id in due:
+                # Запись о напоминании - до отправки: повторная проверка его уже не выберет
+                inserted = self.conn.execute(
+                    "INSERT OR IGNORE INTO reminders_sent (user_id, block, policy_id) VALUES (?, ?, ?)",
+                    (user_id, policy.block, policy.policy_id)
+                ).rowcount
+                if inserted:
+                    self.outbox.send(chat_id, policy.text)
+                    queued += 1
+        self.conn.commit()
+
+        if queued:
+            logger.info(f"Поставлено напоминаний: {queued}")
+        return queued
@@ -0,0 +1,314 @@
+"""
+Запись и воспроизведение входящих апдейтов.
+
+Если задан UPDATES_LOG_DIR, бот записывает каждый апдейт с отметкой времени
+в сжатый JSONL (<каталог>/updates-<дата>-<время>.jsonl.gz, см. UpdateRecorder). Скрипт
+воспроизводит такую запись на свежем экземпляре бота: в пустом временном
+каталоге с копией config/ и с поддельным Bot API, который сразу отвечает
+успехом. Выводит пропускную способность, время обработки апдейтов рядом
+с временем, записанным в бою, и число вызовов API; переписку бота можно сохранить и сравнить с прошлым
+прогоном - это регрессионная проверка на реальном дне мероприятия.
+
+    python replay.py updates/updates-20260410-090000.jsonl.gz [--speed 0] [--api-latency 0]
+                     [--rate 25] [--save-transcript FILE] [--compare FILE]
+
+--speed 1 - в реальном темпе, 10 - в 10 раз быстрее, 0 - без пауз. Без пауз
+апдейты разных чатов обрабатываются параллельно, одного чата - по порядку.
+Расписание блоков идет по часам компьютера; день мероприятия целиком
+в ускоренном времени прогоняет simulate.py.
+"""
+import argparse
+import asyncio
+import gzip
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetMe, TelegramMethod
+from aiogram.types import Chat, Message, TelegramObject, Update, User
+
+logger = logging.getLogger("bot.replay")
+
+FLUSH_EVERY = 100         # Апдейтов между сбросами буфера gzip на диск
+FLUSH_INTERVAL = 5.0      # ...или секунд
+TRANSCRIPT_PREVIEW = 120  # Символов расхождения в выводе --compare
+
+
+class UpdateRecorder(BaseMiddleware):
+    """
+    Внешний middleware апдейтов: пишет каждый апдейт в сжатый JSONL.
+
+    Строка: {"t": секунды от начала файла, "ms": время обработки, "update": апдейт}.
+    Строка пишется после обработки, поэтому в файле апдейты упорядочены по
+    завершению; воспроизведение сортирует их по "t". Буфер gzip сбрасывается
+    раз в FLUSH_EVERY апдейтов или FLUSH_INTERVAL секунд - при аварийной
+    остановке теряется только хвост записи. Когда сжатый файл дорастает до
+    `max_bytes`, запись продолжается в новый; файлов хранится не больше `keep`,
+    самые старые удаляются.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 50 * 2 ** 20, keep: int = 20):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self._suffixes = itertools.count(1)  # Файлы одной секунды: суффикс не повторяется после удаления старых
+        self._open()
+
+    def _open(self):
+        stamp = f"{datetime.now():%Y%m%d-%H%M%S}"
+        self.path = self.directory / f"updates-{stamp}.jsonl.gz"
+        while self.path.exists():
+            self.path = self.directory / f"updates-{stamp}-{next(self._suffixes)}.jsonl.gz"
+        self._file = gzip.open(self.path, "wt", encoding="utf-8")
+        self._started = time.monotonic()
+        self._unflushed = 0
+        self._flushed_at = self._started
+        self._rotate()
+        logger.info(f"Входящие апдейты записываются в {self.path}")
+
+    def _rotate(self):
+        files = sorted(self.directory.glob("updates-*.jsonl.gz"), key=lambda path: path.stat().st_mtime)
+        old = [path for path in files if path != self.path]
+        for path in old[:max(0, len(files) - self.keep)]:
+            path.unlink(missing_ok=True)
+            logger.info(f"Удалена старая запись апдейтов {path.name}")
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        received = time.monotonic()
+        try:
+            return await handler(event, data)
+        finally:
+            self._write(event, received)
+
+    def _write(self, update: Update, received: float):
+        now = time.monotonic()
+        record = {
+            "t": round(max(0.0, received - self._started), 3),  # Апдейт, начатый до смены файла, - в его начало
+            "ms": round((now - received) * 1000, 1),
+            "update": update.model_dump(mode="json", exclude_none=True, by_alias=True),
+        }
+        try:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._unflushed += 1
+            if self._unflushed >= FLUSH_EVERY or now - self._flushed_at >= FLUSH_INTERVAL:
+                self._file.flush()
+                self._unflushed = 0
+                self._flushed_at = now
+                if self.path.stat().st_size >= self.max_bytes:
+                    self._file.close()
+                    self._open()
+        except Exception as e:
+            logger.error(f"Не удалось записать апдейт {update.update_id}: {e}")
+
+    def close(self):
+        self._file.close()
+
+
+def load_records(path: str) -> List[dict]:
+    """Записи апдейтов по времени поступления"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+class ReplaySession(BaseSession):
+    """
+    Поддельный Bot API: запросы не уходят в Telegram, а сразу завершаются успехом
+    через `latency` секунд. Методы, возвращающие Message, получают сообщение
+    с новым message_id; отправленные тексты сохраняются в переписку по чатам
+    и передаются в `on_message(chat_id, text)`, если он задан.
+    """
+
+    def __init__(self, latency: float = 0.0, on_message: Optional[Callable[[int, str], None]] = None):
+        super().__init__()
+        self.latency = latency
+        self.on_message = on_message
+        self.calls: Counter = Counter()
+        self.transcript: Dict[str, List[str]] = defaultdict(list)
+        self._message_ids = itertools.count(1)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True):
+        yield b""
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        name = type(method).__name__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if isinstance(method, GetMe):
+            return User(id=bot.id, is_bot=True, first_name="replay")
+        chat_id = getattr(method, "chat_id", None)
+        text = getattr(method, "text", None) or getattr(method, "caption", None)
+        # Переписка - без правок сообщений (прогресс обновляется по таймеру и зависит от темпа)
+        if chat_id is not None and text and not name.startswith("Edit"):
+            self.transcript[str(chat_id)].append(text)
+            if self.on_message:
+                self.on_message(int(chat_id), text)
+        if "Message" in str(method.__returning__) and chat_id is not None:
+            return Message(message_id=next(self._message_ids), date=datetime.now(),
+                           chat=Chat(id=int(chat_id), type="private"), text=text)
+        return True
+
+
+def fresh_hub(session: BaseSession, clock=None, throttle: bool = False) -> Tuple[Any, str]:
+    """
+    Свежий EventHub в пустом временном каталоге с копией config/: базы мероприятий,
+    снимки и очереди создаются заново. Возвращает хаб и временный каталог.
+    Ограничение частоты по умолчанию выключено: запись без пауз подает апдейты
+    одного участника подряд, и по реальному времени они бы отбрасывались
+    """
+    source = Path(__file__).resolve().parent
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    shutil.copytree(source / "config", Path(workdir) / "config")
+    os.chdir(workdir)
+    sys.path.insert(0, str(source))
+    import main
+
+    hub = main.EventHub("1:replay", updates_log_dir=None, clock=clock, throttle=throttle)
+    hub.bot.session = session
+    return hub, workdir
+
+
+async def close_hub(hub, workdir: str):
+    await hub.jobs.shutdown()
+    for game in hub.games.values():
+        game.shutdown()
+    hub.dead_letters.close()
+    hub.dedup.save()
+    hub.registry.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _chat_of(update: Update) -> int:
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query:
+        return update.callback_query.from_user.id
+    return 0
+
+
+def _percentile(values: List[float], p: float) -> float:
+    return values[min(len(values) - 1, int(p * len(values)))] if values else 0.0
+
+
+def _transcript(session: ReplaySession) -> Dict[str, str]:
+    # Склейка сообщений в Outbox зависит от темпа, поэтому сравнивается текст чата целиком
+    return {chat_id: "\n\n".join(texts) for chat_id, texts in session.transcript.items()}
+
+
+def _compare(current: Dict[str, str], path: str) -> int:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        expected = json.load(f)
+    differ = sorted(set(current) | set(expected), key=lambda chat: (chat not in expected, chat))
+    differ = [chat for chat in differ if current.get(chat) != expected.get(chat)]
+    print(f"\nПереписка: чатов {len(current)}, отличается от {path}: {len(differ)}")
+    for chat in differ[:10]:
+        old, new = expected.get(chat, ""), current.get(chat, "")
+        at = next((i for i, (a, b) in enumerate(zip(old, new)) if a != b), min(len(old), len(new)))
+        print(f"  чат {chat}, символ {at}:\n    было:  {old[at:at + TRANSCRIPT_PREVIEW]!r}\n"
+              f"    стало: {new[at:at + TRANSCRIPT_PREVIEW]!r}")
+    return len(differ)
+
+
+async def replay(path: str, speed: float, api_latency: float, rate: Optional[float],
+                 save_transcript: Optional[str], compare: Optional[str]) -> int:
+    records = load_records(path)
+    print(f"Апдейтов: {len(records)}, длительность записи: {records[-1]['t'] if records else 0:.0f} с")
+
+    session = ReplaySession(api_latency)
+    hub, workdir = fresh_hub(session)
+    if rate:
+        hub.outbox.rate = rate
+    for game in hub.games.values():
+        await game.recover()
+
+    durations: List[float] = []
+    errors = Counter()
+    chains: Dict[int, asyncio.Task] = {}
+
+    async def feed(update: Update, previous: Optional[asyncio.Task]):
+        if previous:
+            await asyncio.gather(previous, return_exceptions=True)
+        started = time.perf_counter()
+        try:
+            await hub.dp.feed_update(hub.bot, update)
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        durations.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for record in records:
+        if speed:
+            delay = record["t"] / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        update = Update.model_validate(record["update"], context={"bot": hub.bot})
+        chat = _chat_of(update)
+        chains[chat] = asyncio.create_task(feed(update, chains.get(chat)))
+    await asyncio.gather(*chains.values())
+    handled = time.perf_counter() - started
+    await hub.outbox.drain()
+    drained = time.perf_counter() - started
+    await close_hub(hub, workdir)
+
+    durations.sort()
+    recorded = sorted(record["ms"] / 1000 for record in records if "ms" in record)
+    print(f"Обработано за {handled:.2f} с ({len(records) / handled if handled else 0:.0f} апдейтов/с), "
+          f"очередь исходящих разобрана за {drained:.2f} с")
+    print(f"Время обработки апдейта: медиана {_percentile(durations, 0.5) * 1000:.1f} мс, "
+          f"95% — {_percentile(durations, 0.95) * 1000:.1f} мс, макс. {_percentile(durations, 1.0) * 1000:.1f} мс")
+    if recorded:
+        print(f"В записи (бой):          медиана {_percentile(recorded, 0.5) * 1000:.1f} мс, "
+              f"95% — {_percentile(recorded, 0.95) * 1000:.1f} мс, макс. {_percentile(recorded, 1.0) * 1000:.1f} мс")
+    print(f"Ошибок обработчиков: {sum(errors.values())}" + (f" {dict(errors)}" if errors else ""))
+    print("Вызовы API: " + ", ".join(f"{name} {count}" for name, count in session.calls.most_common()))
+
+    transcript = _transcript(session)
+    if save_transcript:
+        with gzip.open(save_transcript, "wt", encoding="utf-8") as f:
+            json.dump(transcript, f, ensure_ascii=False)
+        print(f"Переписка сохранена в {save_transcript}")
+    if compare:
+        return 1 if _compare(transcript, compare) else 0
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", help="Запись апдейтов (.jsonl.gz)")
+    parser.add_argument("--speed", type=float, default=0.0, help="Темп: 1 - реальный, 0 - без пауз")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Задержка ответа Bot API, мс")
+    parser.add_argument("--rate", type=float, default=None, help="Лимит исходящих сообщений в секунду")
+    parser.add_argument("--save-transcript", help="Сохранить переписку бота (.json.gz)")
+    parser.add_argument("--compare", help="Сравнить переписку с сохраненной ранее")
+    args = parser.parse_args()
+
+    # Пути записи и переписки - относительно каталога запуска, а не временного каталога бота
+    log = os.path.abspath(args.log)
+    save = os.path.abspath(args.save_transcript) if args.save_transcript else None
+    compare = os.path.abspath(args.compare) if args.compare else None
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(asyncio.run(replay(log, args.speed, args.api_latency / 1000, args.rate, save, compare)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import csv
+import io
+import logging
+import re
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger("bot.roster")
+
+# Заголовки колонок списка участников (регистр и пробелы не важны)
+HEADERS = {
+    "username": ("username", "telegram", "телеграм", "логин", "ник"),
+    "fio": ("fio", "фио", "фи", "имя", "участник"),
+    "team": ("team", "команда", "цвет", "браслет"),
+}
+USERNAME_RE = re.compile(r"[a-z][a-z0-9_]{4,31}")  # Формат username в Telegram
+MAX_ERRORS_SHOWN = 20
+
+
+class RosterRow(NamedTuple):
+    username: str  # Без @, в нижнем регистре
+    fio: str
+    team: str
+
+
+@dataclass
+class ImportReport:
+    """Итог импорта: сколько строк добавлено и обновлено, что отклонено и почему"""
+    added: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    errors: List[str] = field(default_factory=list)     # Строки файла с ошибками
+    conflicts: List[str] = field(default_factory=list)  # Расхождения с уже зарегистрированными
+
+    def text(self) -> str:
+        lines = [f"Добавлено: {self.added}, обновлено: {self.updated}, без изменений: {self.unchanged}"]
+        for title, items in (("Ошибки в файле", self.errors), ("Конфликты", self.conflicts)):
+            if items:
+                lines.append(f"\n{title} ({len(items)}):")
+                lines.extend(f"• {item}" for item in items[:MAX_ERRORS_SHOWN])
+                if len(items) > MAX_ERRORS_SHOWN:
+                    lines.append(f"… и еще {len(items) - MAX_ERRORS_SHOWN}")
+        return "\n".join(lines)
+
+
+def normalize_username(value: Optional[str]) -> str:
+    return (value or "").strip().lstrip("@").lower()
+
+
+def _read_csv(content: bytes) -> List[Sequence[str]]:
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = content.decode("cp1251")  # CSV из русского Excel
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    return list(csv.reader(io.StringIO(text), dialect))
+
+
+def _read_xlsx(content: bytes) -> List[Sequence[str]]:
+    # openpyxl нужен только для импорта из Excel - импортируется при первом таком файле
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("Для импорта XLSX установите openpyxl или сохраните список в CSV")
+    workbook = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        return [["" if cell is None else str(cell) for cell in row]
+                for row in workbook.active.iter_rows(values_only=True)]
+    finally:
+        workbook.close()
+
+
+def parse_roster(filename: str, content: bytes, teams: Iterable[str]) -> Tuple[List[RosterRow], List[str]]:
+    """
+    Разобрать список участников (CSV или XLSX) с колонками username, ФИО и команда.
+    Возвращает корректные строки и описания ошибок; нечитаемый файл - ValueError
+    """
+    if filename.lower().endswith(".xlsx"):
+        table = _read_xlsx(content)
+    elif filename.lower().endswith((".csv", ".txt")):
+        table = _read_csv(content)
+    else:
+        raise ValueError("Поддерживаются файлы .csv и .xlsx")
+    if not table:
+        raise ValueError("Файл пуст")
+
+    header = [str(cell).strip().lower() for cell in table[0]]
+    columns = {}
+    for name, aliases in HEADERS.items():
+        found = [i for i, cell in enumerate(header) if cell in aliases]
+        if not found:
+            raise ValueError(f"Нет колонки '{aliases[0]}' (допустимые заголовки: {', '.join(aliases)})")
+        columns[name] = found[0]
+
+    teams_by_key = {team.strip().lower(): team for team in teams}
+    rows: List[RosterRow] = []
+    errors: List[str] = []
+    seen: Dict[str, int] = {}
+    for line, cells in enumerate(table[1:], start=2):
+        def cell(name: str) -> str:
+            index = columns[name]
+            return str(cells[index]).strip() if index < len(cells) else ""
+
+        if not any(str(value).strip() for value in cells):
+            continue
+        username, fio, team = normalize_username(cell("username")), cell("fio"), cell("team")
+        if not USERNAME_RE.fullmatch(username):
+            errors.append(f"строка {line}: некорректный username '{cell('username')}'")
+        elif not fio:
+            errors.append(f"строка {line}: не указано ФИО")
+        elif team.lower() not in teams_by_key:
+            errors.append(f"строка {line}: неизвестная команда '{team}'")
+        elif username in seen:
+            errors.append(f"строка {line}: @{username} уже есть в строке {seen[username]}")
+        else:
+            seen[username] = line
+            rows.append(RosterRow(username, fio, teams_by_key[team.lower()]))
+    return rows, errors
+
+
+class Roster:
+    """
+    Список участников, известный заранее: username -> ФИО и команда.
+
+    Таблица WITHOUT ROWID с ключом username, поэтому /start находит участника
+    одним поиском по первичному ключу и сразу регистрирует его с командой -
+    без ввода ФИО и выбора браслета. claimed_by - кто уже зарегистрировался
+    по строке; такие строки импорт не перезаписывает, а сообщает о конфликте.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS roster (
+                username TEXT PRIMARY KEY,
+                fio TEXT NOT NULL,
+                team TEXT NOT NULL,
+                claimed_by INTEGER
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def import_rows(self, rows: List[RosterRow], errors: List[str]) -> ImportReport:
+        """Загрузить строки одной транзакцией: новые добавить, незанятые обновить, занятые не трогать"""
+        report = ImportReport(errors=list(errors))
+        existing = {
+            username: (fio, team, claimed_by)
+            for username, fio, team, claimed_by in self.conn.execute("SELECT username, fio, team, claimed_by FROM roster")
+        }
+        writes = []
+        for row in rows:
+            current = existing.get(row.username)
+            if current is None:
+                report.added += 1
+            elif current[:2] == (row.fio, row.team):
+                report.unchanged += 1
+                continue
+            elif current[2] is not None:
+                report.conflicts.append(
+                    f"@{row.username} уже зарегистрирован как {current[0]} ({current[1]}), "
+                    f"в файле - {row.fio} ({row.team})"
+                )
+                continue
+            else:
+                report.updated += 1
+            writes.append(row)
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO roster (username, fio, team) VALUES (?, ?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET fio = excluded.fio, team = excluded.team",
+                writes
+            )
+        logger.info(f"Импорт списка участников: добавлено {report.added}, обновлено {report.updated}, "
+                    f"конфликтов {len(report.conflicts)}, ошибок {len(report.errors)}")
+        return report
+
+    def claim(self, username: Optional[str], user_id: int) -> Optional[RosterRow]:
+        """Строка списка для пользователя с этим username, если ее еще не занял другой пользователь"""
+        username = normalize_username(username)
+        if not username:
+            return None
+        row = self.conn.execute(
+            "SELECT fio, team, claimed_by FROM roster WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None or row[2] not in (None, user_id):
+            return None
+        if row[2] is None:
+            self.conn.execute("UPDATE roster SET claimed_by = ? WHERE username = ?", (user_id, username))
+        return RosterRow(username, row[0], row[1])
+
+    def release_all(self):
+        """Снять отметки о регистрации (после очистки ответов)"""
+        self.conn.execute("UPDATE roster SET claimed_by = NULL")
+
+    def counts(self) -> Tuple[int, int]:
+        """(строк в списке, из них зарегистрировались)"""
+        return self.conn.execute("SELECT COUNT(*), COUNT(claimed_by) FROM roster").fetchone()
@@ -0,0 +1,178 @@
+import html
+import logging
+import re
+import sqlite3
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from db import ReadPool
+
+logger = logging.getLogger("bot.search")
+
+# rowid записи индекса: ответ answer_N строки answers.id -> id * ROWID_STRIDE + N,
+# строка стихотворения poem_contributions.id -> -id. Удаление и замена идут по rowid, без просмотра индекса
+ROWID_STRIDE = 1000
+
+# Границы совпадения в snippet(): текст экранируется после выборки, затем они заменяются на <b>
+_MARK_START, _MARK_END = "\x02", "\x03"
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    fio: str
+    username: str
+    team: str
+    column: Optional[int]       # Номер колонки answer_N; None - строка стихотворения
+    line_number: Optional[int]  # Номер строки стихотворения
+    snippet: str                # HTML с выделенными совпадениями
+
+
+def _folded(value: str) -> str:
+    """SQL-выражение: текст с ё, замененной на е (unicode61 не считает их одной буквой)"""
+    return f"replace(replace({value}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _match_expression(query: str) -> Optional[str]:
+    """Запрос администратора -> выражение FTS5: все слова, каждое как префикс"""
+    words = re.findall(r"\w+", query.replace("ё", "е").replace("Ё", "Е"))
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class SearchIndex:
+    """
+    Полнотекстовый индекс FTS5 по текстовым ответам и строкам стихотворений.
+
+    Индекс обновляют триггеры SQLite, поэтому код, который пишет ответы, о нем не знает.
+    Триггеры на колонки answer_N пересоздаются в `sync` при появлении новых колонок;
+    ответы-фото в индекс не попадают, ё в индексе и запросах заменяется на е.
+    Поиск идет через соединения только для чтения.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, reads: ReadPool):
+        self.conn = conn
+        self.reads = reads
+        self._columns = 0
+        self._init_tables()
+
+    def _init_tables(self):
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='search_index'"
+        ).fetchone()
+        # Автор строки стихотворения ищется в answers по пользователю и чату
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_user ON answers (user_id, chat_id)")
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(text, tokenize='unicode61 remove_diacritics 2')"
+        )
+        self.conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS search_answers_ad AFTER DELETE ON answers BEGIN
+                DELETE FROM search_index WHERE rowid BETWEEN old.id * {ROWID_STRIDE} AND old.id * {ROWID_STRIDE} + {ROWID_STRIDE - 1};
+            END
+        """)
+        self.conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS search_poem_ai AFTER INSERT ON poem_contributions
+            WHEN new.contribution IS NOT NULL AND new.contribution != '' BEGIN
+                INSERT INTO search_index (rowid, text) VALUES (-new.id, {_folded("new.contribution")});
+            END
+        """)
+        self.conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS search_poem_ad AFTER DELETE ON poem_contributions BEGIN
+                DELETE FROM search_index WHERE rowid = -old.id;
+            END
+        """)
+        self.conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS search_poem_au AFTER UPDATE OF contribution ON poem_contributions BEGIN
+                DELETE FROM search_index WHERE rowid = -old.id;
+                INSERT INTO search_index (rowid, text)
+                    SELECT -new.id, {_folded("new.contribution")} WHERE new.contribution IS NOT NULL AND new.contribution != '';
+            END
+        """)
+        self.sync()
+        if not exists:
+            self._backfill()
+        self.conn.commit()
+
+    @staticmethod
+    def _indexed(value: str) -> str:
+        """Условие для колонки ответа: непустой текст, не фото"""
+        return f"{value} IS NOT NULL AND {value} != '' AND {value} NOT LIKE 'photo_file_id:%'"
+
+    def _answer_columns(self) -> List[int]:
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(answers)")]
+        return sorted(int(name[7:]) for name in columns if re.fullmatch(r"answer_\d+", name))
+
+    def sync(self):
+        """Создать триггеры для новых колонок answer_N (после добавления вопросов в каталог)"""
+        columns = self._answer_columns()
+        if len(columns) == self._columns:
+            return
+        for n in columns:
+            self.conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS search_answer_{n}_au AFTER UPDATE OF answer_{n} ON answers BEGIN
+                    DELETE FROM search_index WHERE rowid = old.id * {ROWID_STRIDE} + {n};
+                    INSERT INTO search_index (rowid, text)
+                        SELECT new.id * {ROWID_STRIDE} + {n}, {_folded(f"new.answer_{n}")} WHERE {self._indexed(f"new.answer_{n}")};
+                END
+            """)
+
+        # Вставка строки целиком - одним триггером на все колонки, поэтому он пересоздается
+        inserts = "\n".join(
+            f"INSERT INTO search_index (rowid, text) SELECT new.id * {ROWID_STRIDE} + {n}, {_folded(f'new.answer_{n}')} "
+            f"WHERE {self._indexed(f'new.answer_{n}')};"
+            for n in columns
+        )
+        self.conn.execute("DROP TRIGGER IF EXISTS search_answers_ai")
+        if inserts:
+            self.conn.execute(f"CREATE TRIGGER search_answers_ai AFTER INSERT ON answers BEGIN\n{inserts}\nEND")
+        self.conn.commit()
+        self._columns = len(columns)
+        logger.debug(f"Триггеры поиска обновлены: колонок ответов {len(columns)}")
+
+    def _backfill(self):
+        """Проиндексировать данные, записанные до появления индекса"""
+        for n in self._answer_columns():
+            self.conn.execute(
+                f"INSERT INTO search_index (rowid, text) SELECT id * {ROWID_STRIDE} + {n}, {_folded(f'answer_{n}')} "
+                f"FROM answers WHERE {self._indexed(f'answer_{n}')}"
+            )
+        self.conn.execute(
+            f"INSERT INTO search_index (rowid, text) SELECT -id, {_folded('contribution')} FROM poem_contributions "
+            "WHERE contribution IS NOT NULL AND contribution != ''"
+        )
+        count = self.conn.execute("SELECT COUNT(*) FROM search_index").fetchone()[0]
+        logger.info(f"Поисковый индекс построен: {count} записей")
+
+    async def search(self, query: str, page: int = 0, per_page: int = 5) -> Tuple[int, List[SearchHit]]:
+        """Найти ответы и строки стихотворений по релевантности. Возвращает число совпадений и страницу"""
+        expression = _match_expression(query)
+        if expression is None:
+            return 0, []
+
+        total = (await self.reads.fetchall(
+            "SELECT COUNT(*) FROM search_index WHERE search_index MATCH ?", (expression,)
+        ))[0][0]
+        if not total:
+            return 0, []
+
+        rows = await self.reads.fetchall(f"""
+            SELECT hits.hit, hits.snip,
+                   COALESCE(a.fio, p.fio, ''), COALESCE(a.username, pa.username, ''), COALESCE(a.team, p.team, ''),
+                   p.line_number
+            FROM (
+                SELECT rowid AS hit, snippet(search_index, 0, ?, ?, '…', 12) AS snip, rank
+                FROM search_index WHERE search_index MATCH ?
+                ORDER BY rank LIMIT ? OFFSET ?
+            ) AS hits
+            LEFT JOIN answers a ON hits.hit > 0 AND a.id = hits.hit / {ROWID_STRIDE}
+            LEFT JOIN poem_contributions p ON hits.hit < 0 AND p.id = -hits.hit
+            LEFT JOIN answers pa ON pa.user_id = p.user_id AND pa.chat_id = p.chat_id
+            ORDER BY hits.rank
+        """, (_MARK_START, _MARK_END, expression, per_page, page * per_page))
+
+        hits = []
+        for hit, snip, fio, username, team, line_number in rows:
+            snippet = html.escape(snip).replace(_MARK_START, "<b>").replace(_MARK_END, "</b>")
+            column = hit % ROWID_STRIDE if hit > 0 else None
+            hits.append(SearchHit(fio, username, team, column, line_number, snippet))
+        return total, hits
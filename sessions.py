@@ -0,0 +1,178 @@
+import asyncio
+import heapq
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from clock import Clock
+
+logger = logging.getLogger("bot.sessions")
+
+SessionKey = Tuple[int, int]  # (chat_id, user_id)
+
+
+@dataclass(slots=True)
+class Session:
+    """Что участник делает сейчас"""
+    block: Optional[int] = None  # Открытый блок
+    team: Optional[str] = None   # Команда, если участник в идущем стихотворении
+
+
+class SessionTable:
+    """
+    Единая таблица сессий участников: (chat_id, user_id) -> Session.
+    Заменяет отдельные словари активных блоков и участников стихотворений;
+    сессия удаляется, как только в ней не остается ни блока, ни команды.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[SessionKey, Session] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def block(self, key: SessionKey) -> Optional[int]:
+        session = self._sessions.get(key)
+        return session.block if session else None
+
+    def team(self, key: SessionKey) -> Optional[str]:
+        session = self._sessions.get(key)
+        return session.team if session else None
+
+    def set_block(self, key: SessionKey, block: int):
+        session = self._sessions.get(key)
+        if session is None:
+            self._sessions[key] = Session(block=block)
+        else:
+            session.block = block
+
+    def set_team(self, key: SessionKey, team: str):
+        session = self._sessions.get(key)
+        if session is None:
+            self._sessions[key] = Session(team=team)
+        else:
+            session.team = team
+
+    def release_block(self, key: SessionKey) -> Optional[int]:
+        """Снять открытый блок; возвращает его номер"""
+        session = self._sessions.get(key)
+        if session is None:
+            return None
+        block, session.block = session.block, None
+        if session.team is None:
+            del self._sessions[key]
+        return block
+
+    def release_team(self, key: SessionKey):
+        session = self._sessions.get(key)
+        if session is None:
+            return
+        session.team = None
+        if session.block is None:
+            del self._sessions[key]
+
+    def discard(self, key: SessionKey):
+        self._sessions.pop(key, None)
+
+    def release_all_blocks(self):
+        for key in [key for key, session in self._sessions.items() if session.block is not None]:
+            self.release_block(key)
+
+    def count(self) -> Tuple[int, int]:
+        """Сколько участников в блоках и сколько в стихотворениях"""
+        blocks = sum(1 for session in self._sessions.values() if session.block is not None)
+        teams = sum(1 for session in self._sessions.values() if session.team is not None)
+        return blocks, teams
+
+
+class SessionExpiry:
+    """
+    Сроки бездействия сессий на min-куче.
+
+    `touch` переносит срок сессии (в куче остается и старая запись - она отбрасывается
+    при извлечении, если срок уже изменился), `discard` снимает сессию. Фоновая задача
+    спит до ближайшего срока и будится, только если появился более ранний, поэтому
+    пока ни одна сессия не истекает, она ничего не делает. Сроки считаются по часам
+    мероприятия `clock`.
+    """
+
+    def __init__(self, on_expire: Callable[[Hashable], Awaitable], timeout: float, clock: Optional[Clock] = None):
+        self.on_expire = on_expire
+        self.timeout = timeout  # Секунды бездействия до истечения сессии
+        self.clock = clock or Clock()
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._deadlines: Dict[Hashable, float] = {}
+        self._counter = 0  # Разрывает равенство сроков, чтобы куча не сравнивала ключи
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def touch(self, key: Hashable, last_activity: Optional[datetime] = None):
+        """Продлить сессию: срок = последняя активность (по умолчанию - сейчас) + timeout"""
+        deadline = self.clock.monotonic() + self.timeout
+        if last_activity is not None:
+            deadline -= max(0.0, (self.clock.now() - last_activity).total_seconds())
+
+        self._deadlines[key] = deadline
+        self._counter += 1
+        heapq.heappush(self._heap, (deadline, self._counter, key))
+
+        # Старые записи копятся при каждом продлении - периодически пересобираем кучу
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(d, c, k) for d, c, k in self._heap if self._deadlines.get(k) == d]
+            heapq.heapify(self._heap)
+
+        if self._heap[0][2] == key and self._heap[0][0] == deadline:
+            self._wakeup.set()
+
+    def discard(self, key: Hashable):
+        self._deadlines.pop(key, None)
+
+    def idle_for(self, key: Hashable) -> Optional[float]:
+        """Секунды с последнего продления сессии (None - сессии нет)"""
+        deadline = self._deadlines.get(key)
+        if deadline is None:
+            return None
+        return self.clock.monotonic() - (deadline - self.timeout)
+
+    def clear(self):
+        self._deadlines.clear()
+        self._heap.clear()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def _pop_expired(self, now: float) -> List[Hashable]:
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(self._heap)
+            if self._deadlines.get(key) == deadline:
+                del self._deadlines[key]
+                expired.append(key)
+        return expired
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            # Вершина кучи может быть устаревшей записью - тогда проснемся раньше и просто пойдем дальше
+            timeout = self._heap[0][0] - self.clock.monotonic() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), None if timeout is None else self.clock.real(timeout))
+                except asyncio.TimeoutError:
+                    pass
+
+            for key in self._pop_expired(self.clock.monotonic()):
+                try:
+                    await self.on_expire(key)
+                except Exception as e:
+                    logger.error(f"Ошибка при завершении сессии {key}: {e}", exc_info=True)
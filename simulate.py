@@ -0,0 +1,255 @@
+"""
+Симуляция дня мероприятия в ускоренном времени.
+
+Свежий бот (см. replay.fresh_hub) работает по SimulatedClock: расписание блоков,
+напоминания, таймауты сессий и ходов стихотворения и автозавершение идут в
+`--speed` раз быстрее, и день с 8:50 до окончания игры проходит за десятки
+секунд. Участники - программы, которые отвечают на сообщения бота через
+случайное (по часам мероприятия) время; часть из них пропускает по одному
+вопросу и одному ходу стихотворения, чтобы сработали таймауты.
+
+В конце проверяется, что каждый блок открылся всем участникам и не раньше
+своего времени, стихотворения всех команд завершены, игра завершилась во
+время finish_time, а обработчики не падали. Выводятся задержка открытия блоков
+и время тиков планировщика. Код возврата 1 - проверка не прошла (для CI).
+
+    python simulate.py [--participants 40] [--speed 1000] [--dropout 0.1] [--seed 1]
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, time as day_time, timedelta
+from typing import Dict, List, Optional
+
+from aiogram.types import Update
+
+from clock import SimulatedClock
+from replay import ReplaySession, close_hub, fresh_hub
+
+DAY_START = day_time(8, 50)        # С этого времени начинается симуляция
+REGISTRATION_MINUTES = 30          # Участники приходят в первые полчаса
+ANSWER_DELAY = (15, 120)           # Секунды на ответ (по часам мероприятия)
+FINISH_TOLERANCE = 60              # Допустимое опоздание автозавершения, секунды
+FINAL_MESSAGE = "благодарим тебя за активное участие"
+
+
+class Participant:
+    """Участник-программа: реагирует на сообщения бота, как человек"""
+
+    def __init__(self, user_id: int, team: str, skip_question: Optional[str], skip_poem: bool):
+        self.user_id = user_id
+        self.team = team
+        self.skip_question = skip_question  # Текст вопроса, на который участник не ответит
+        self.skip_poem = skip_poem          # Пропустить свой ход в стихотворении
+
+
+class Simulation:
+    def __init__(self, participants: int, speed: float, dropout: float, seed: int):
+        self.random = random.Random(seed)
+        self.session = ReplaySession(on_message=self._on_message)
+        self.clock = SimulatedClock(datetime.combine(datetime.now().date(), DAY_START), speed)
+        # Ограничение частоты работает по часам мероприятия - участники-программы его не превышают
+        self.hub, self.workdir = fresh_hub(self.session, self.clock, throttle=True)
+        self.game = self.hub.games[self.hub.registry.default.event_id]
+        catalog = self.game.catalog
+        # День симуляции - дата мероприятия из каталога, если она задана (часы еще никто не спрашивал)
+        self.clock.start = datetime.combine(catalog.event_day(self.clock.today()), DAY_START)
+        # Лимит Telegram действует в реальных секундах - в симуляции он в секундах мероприятия
+        self.hub.outbox.rate *= speed
+
+        self.questions = [q.text for block in catalog.blocks for q in block.questions]
+        self.photo_questions = {q.text for block in catalog.blocks for q in block.questions if q.kind == "photo"}
+        teams = self.game.event.teams
+        self.participants: Dict[int, Participant] = {}
+        for number in range(participants):
+            user_id = 1_000_000 + number
+            skip = self.random.choice(self.questions) if self.random.random() < dropout else None
+            self.participants[user_id] = Participant(user_id, teams[number % len(teams)], skip,
+                                                     self.random.random() < dropout)
+
+        self.ids = itertools.count(1)
+        self.tasks = set()
+        self.errors = Counter()
+        self.finished_at: Optional[datetime] = None
+        self.ticks: List[float] = []
+
+    # ==================== УЧАСТНИКИ ====================
+
+    def _update(self, user_id: int, text: Optional[str] = None, photo: bool = False,
+                callback: Optional[str] = None) -> Update:
+        user = {"id": user_id, "is_bot": False, "first_name": f"u{user_id}", "username": f"user{user_id}"}
+        message = {"message_id": next(self.ids), "date": int(time.time()),
+                   "chat": {"id": user_id, "type": "private"}, "from": user}
+        if callback is not None:
+            message["from"] = {"id": 1, "is_bot": True, "first_name": "bot"}
+            return Update.model_validate({
+                "update_id": next(self.ids),
+                "callback_query": {"id": str(next(self.ids)), "from": user, "chat_instance": "sim",
+                                   "data": callback, "message": message},
+            }, context={"bot": self.hub.bot})
+        if photo:
+            message["photo"] = [{"file_id": f"photo{user_id}", "file_unique_id": "u", "width": 1, "height": 1}]
+        else:
+            message["text"] = text
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return Update.model_validate({"update_id": next(self.ids), "message": message},
+                                     context={"bot": self.hub.bot})
+
+    def _later(self, delay: float, user_id: int, text: Optional[str] = None, photo: bool = False,
+               callback: Optional[str] = None):
+        async def feed():
+            await self.clock.sleep(delay)
+            # Номера апдейтов и сообщений выдаются в момент отправки, как в Telegram
+            update = self._update(user_id, text, photo, callback)
+            try:
+                await self.hub.dp.feed_update(self.hub.bot, update)
+            except Exception as e:
+                self.errors[type(e).__name__] += 1
+
+        task = asyncio.create_task(feed())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _delay(self) -> float:
+        return self.random.uniform(*ANSWER_DELAY)
+
+    def _on_message(self, chat_id: int, text: str):
+        """Сообщение бота участнику (склеенные сообщения приходят одним текстом)"""
+        if FINAL_MESSAGE in text and self.finished_at is None:
+            self.finished_at = self.clock.now()
+        participant = self.participants.get(chat_id)
+        if participant is None:
+            return
+
+        if "введите своё ФИ" in text:
+            self._later(self._delay(), chat_id, f"Участник {chat_id}")
+        if "цвет своего браслета" in text:
+            self._later(self._delay(), chat_id, callback=f"team_{participant.team}")
+        if "жми ДА" in text:
+            self._later(self._delay(), chat_id, callback="button_pressed")
+        if "ваша очередь!" in text and not participant.skip_poem:
+            self._later(self._delay(), chat_id, f"Строка от участника {chat_id}")
+
+        # Последний вопрос в тексте - тот, на который ждут ответа
+        asked = max(self.questions, key=text.rfind)
+        if asked not in text or asked == participant.skip_question:
+            return
+        if asked in self.photo_questions:
+            self._later(self._delay(), chat_id, photo=True)
+        else:
+            self._later(self._delay(), chat_id, f"Ответ {self.random.randint(1, 100)}")
+
+    # ==================== ПРОГОН ====================
+
+    async def run(self) -> bool:
+        timer = self.game.timer_block_run
+
+        async def timed_tick():
+            started = time.perf_counter()
+            await timer()
+            self.ticks.append(time.perf_counter() - started)
+
+        self.game.timer_block_run = timed_tick
+        await self.game.recover()
+
+        for user_id in self.participants:
+            self._later(self.random.uniform(0, REGISTRATION_MINUTES * 60), user_id, "/start")
+
+        finish = self.game.catalog.finish_time(self.clock.today())
+        started = time.perf_counter()
+        while self.clock.now() < finish + timedelta(seconds=FINISH_TOLERANCE + 60):
+            await asyncio.sleep(0.05)
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.hub.outbox.drain()
+        elapsed = time.perf_counter() - started
+        return self._report(finish, elapsed)
+
+    def _report(self, finish: datetime, elapsed: float) -> bool:
+        conn = self.game.conn
+        conn.commit()
+        catalog = self.game.catalog
+        today = self.clock.today()
+        participants = len(self.participants)
+        failures = []
+
+        print(f"Участников: {participants}, ускорение: {self.clock.speed:.0f}x, "
+              f"день прошел за {elapsed:.1f} с реального времени")
+        print(f"\n{'Блок':<24}{'время':>7}{'открыт':>9}{'задержка мед/макс':>20}")
+        for block in catalog.blocks:
+            # Блок вопросов открылся участнику, когда ему задан первый вопрос; стихотворение - когда дошел его ход
+            where = "block = ?" if block.kind == "poem" else "block = ? AND step = 0"
+            count = conn.execute(
+                f"SELECT COUNT(DISTINCT user_id) FROM answer_timings WHERE {where}", (block.index,)
+            ).fetchone()[0]
+            if count != participants:
+                failures.append(f"блок {block.index + 1} открылся {count} участникам из {participants}")
+
+            block_time = catalog.block_time(block.index, today)
+            lag = ""
+            if block_time is not None and block.kind == "quiz" and count:
+                delays = sorted(
+                    published / 1000 - block_time.timestamp()
+                    for (published,) in conn.execute(f"SELECT published FROM answer_timings WHERE {where}", (block.index,))
+                )
+                lag = f"{delays[len(delays) // 2]:.0f} / {delays[-1]:.0f} с"
+                if delays[0] < -1:
+                    failures.append(f"блок {block.index + 1} открылся раньше {block_time:%H:%M}")
+            when = f"{block_time:%H:%M}" if block_time else "—"
+            print(f"{block.title[:23]:<24}{when:>7}{count:>9}{lag:>20}")
+
+        teams = {participant.team for participant in self.participants.values()}
+        completed = conn.execute(
+            "SELECT COUNT(DISTINCT team) FROM team_poems WHERE status = 'completed'"
+        ).fetchone()[0]
+        print(f"\nСтихотворений завершено: {completed} из {len(teams)}")
+        if catalog.poem_index is not None and completed != len(teams):
+            failures.append(f"завершено стихотворений {completed} из {len(teams)}")
+
+        if self.finished_at is None:
+            failures.append("игра не завершилась автоматически")
+        else:
+            late = (self.finished_at - finish).total_seconds()
+            print(f"Автозавершение: {self.finished_at:%H:%M:%S} (по расписанию {finish:%H:%M})")
+            if not 0 <= late <= FINISH_TOLERANCE:
+                failures.append(f"автозавершение на {late:.0f} с позже/раньше расписания")
+
+        ticks = sorted(self.ticks)
+        if ticks:
+            print(f"Тиков планировщика: {len(ticks)}, медиана {ticks[len(ticks) // 2] * 1000:.1f} мс, "
+                  f"макс. {ticks[-1] * 1000:.1f} мс")
+        print("Вызовы API: " + ", ".join(f"{name} {count}" for name, count in self.session.calls.most_common()))
+        if self.errors:
+            failures.append(f"ошибки обработчиков: {dict(self.errors)}")
+
+        for failure in failures:
+            print(f"❌ {failure}")
+        if not failures:
+            print("✅ Все проверки пройдены")
+        return not failures
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--participants", type=int, default=40)
+    parser.add_argument("--speed", type=float, default=1000.0)
+    parser.add_argument("--dropout", type=float, default=0.1, help="Доля участников, пропускающих вопрос и ход")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    simulation = Simulation(args.participants, args.speed, args.dropout, args.seed)
+    try:
+        ok = await simulation.run()
+    finally:
+        await close_hub(simulation.hub, simulation.workdir)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,157 @@
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+
+logger = logging.getLogger("bot.snapshots")
+
+ARCHIVE_PREFIX = "archive"  # Метки архивов (например, перед очисткой) - на них не действует ротация
+
+
+class SnapshotService:
+    """
+    Сжатые снимки базы мероприятия.
+
+    Снимок снимается через sqlite3.Connection.backup порциями по `pages` страниц
+    с паузой `step_pause` между ними из согласованного снимка WAL, поэтому запись
+    участников не ждет копирования, и сжимается gzip. Файлы называются
+    <база>-<ГГГГММДД-ЧЧММСС.мс>-<метка>.db.gz - снимки одной секунды (архив перед
+    очисткой и сразу за ним /export) не затирают друг друга; периодических снимков хранится
+    не больше `keep`, архивы не удаляются.
+    Тяжелые отчеты читают последний снимок, а не рабочую базу.
+    """
+
+    def __init__(self, db_path: str, directory: str = "snapshots", keep: int = 48,
+                 interval: float = 30 * 60, pages: int = 256, step_pause: float = 0.005):
+        self.db_path = db_path
+        self.directory = Path(directory)
+        self.keep = keep
+        self.interval = interval  # Секунды между периодическими снимками
+        self.pages = pages
+        self.step_pause = step_pause
+        self._prefix = Path(db_path).stem
+        self._lock = asyncio.Lock()  # Снимки одной базы не снимаются параллельно
+        self._task: Optional[asyncio.Task] = None
+
+    # ==================== СНИМКИ ====================
+
+    async def take(self, label: str = "periodic") -> Path:
+        """Снять снимок и вернуть путь к сжатому файлу"""
+        async with self._lock:
+            started = time.perf_counter()
+            path = await asyncio.to_thread(self._take, label)
+            self._rotate()
+        logger.info(f"Снимок {path.name}: {path.stat().st_size // 1024} КБ "
+                    f"за {(time.perf_counter() - started) * 1000:.0f} мс")
+        return path
+
+    def _take(self, label: str) -> Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        while True:
+            now = datetime.now()
+            stamp = f"{now:%Y%m%d-%H%M%S}.{now.microsecond // 1000:03d}"
+            path = self.directory / f"{self._prefix}-{stamp}-{label}.db.gz"
+            if not path.exists():
+                break
+            time.sleep(0.001)  # Снимок с таким именем уже есть - берем следующую миллисекунду
+        raw = path.with_suffix(".tmp")
+
+        source = sqlite3.connect(self.db_path)
+        target = sqlite3.connect(raw)
+        try:
+            # Открытая транзакция чтения фиксирует снимок WAL: запись из других соединений
+            # не заставляет backup начинать копирование заново и сама его не ждет
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            source.backup(target, pages=self.pages, progress=lambda *_: time.sleep(self.step_pause))
+            source.rollback()
+            # Снимок - самостоятельный файл: без WAL рядом с ним не появятся -wal и -shm
+            target.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            target.close()
+            source.close()
+
+        try:
+            with open(raw, "rb") as src, gzip.open(path.with_suffix(".part"), "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(path.with_suffix(".part"), path)
+        finally:
+            raw.unlink(missing_ok=True)
+        return path
+
+    def _rotate(self):
+        periodic = [path for path in self.list() if not self._label(path).startswith(ARCHIVE_PREFIX)]
+        for path in periodic[:max(0, len(periodic) - self.keep)]:
+            path.unlink(missing_ok=True)
+            logger.info(f"Удален старый снимок {path.name}")
+
+    def _label(self, path: Path) -> str:
+        # <база>-<дата>-<время.мс>-<метка>.db.gz
+        return path.name[len(self._prefix) + 1:].removesuffix(".db.gz").split("-", 2)[-1]
+
+    def list(self) -> List[Path]:
+        """Снимки базы от старых к новым"""
+        if not self.directory.exists():
+            return []
+        return sorted(self.directory.glob(f"{self._prefix}-*.db.gz"))
+
+    def latest(self, max_age: Optional[float] = None) -> Optional[Path]:
+        """Последний снимок (не старше `max_age` секунд, если задано)"""
+        snapshots = self.list()
+        if not snapshots:
+            return None
+        path = snapshots[-1]
+        if max_age is not None and time.time() - path.stat().st_mtime > max_age:
+            return None
+        return path
+
+    async def fresh(self, max_age: float) -> Path:
+        """Последний снимок, если он не старше `max_age` секунд, иначе новый"""
+        return self.latest(max_age) or await self.take()
+
+    @asynccontextmanager
+    async def open(self, path: Path) -> AsyncIterator[sqlite3.Connection]:
+        """Распаковать снимок во временный файл и открыть только для чтения"""
+        fd, raw = tempfile.mkstemp(suffix=".db", dir=self.directory)
+        os.close(fd)
+
+        def unpack():
+            with gzip.open(path, "rb") as src, open(raw, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+
+        try:
+            await asyncio.to_thread(unpack)
+            conn = sqlite3.connect(Path(raw).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+            try:
+                yield conn
+            finally:
+                conn.close()
+        finally:
+            os.unlink(raw)
+
+    # ==================== ПЕРИОДИЧЕСКИЕ СНИМКИ ====================
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.take()
+            except Exception as e:
+                logger.error(f"Ошибка при снятии снимка {self.db_path}: {e}", exc_info=True)
@@ -0,0 +1,102 @@
+import bisect
+import math
+import sqlite3
+from collections import Counter
+from typing import List, Optional
+
+# Границы корзин гистограммы времени ответа: от 0,5 с с шагом 15% (до нескольких часов)
+_BUCKET_BASE = 0.5
+_BUCKET_STEP = 1.15
+_BUCKET_BOUNDS = [_BUCKET_BASE * _BUCKET_STEP ** i for i in range(80)]
+
+
+class Histogram:
+    """
+    Гистограмма с логарифмическими корзинами: добавление O(log корзин),
+    медиана и перцентили - проходом по корзинам без хранения самих значений.
+    Погрешность - не больше половины корзины (около 7%).
+    """
+
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self.total = 0
+
+    def add(self, value: float):
+        self.counts[bisect.bisect_right(_BUCKET_BOUNDS, value)] += 1
+        self.total += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.total:
+            return None
+        rank = p * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if i == 0:
+                    return _BUCKET_BOUNDS[0] / 2
+                if i == len(_BUCKET_BOUNDS):
+                    return _BUCKET_BOUNDS[-1]
+                # Середина корзины в логарифмической шкале
+                return math.sqrt(_BUCKET_BOUNDS[i - 1] * _BUCKET_BOUNDS[i])
+        return _BUCKET_BOUNDS[-1]
+
+    def median(self) -> Optional[float]:
+        return self.percentile(0.5)
+
+
+class LiveStats:
+    """
+    Счетчики для /stats, которые обновляются в момент записи: регистрация, выбор
+    команды, завершение блока, ответ на вопрос, завершение стихотворения.
+    Агрегирующие запросы выполняются только в `load` - при запуске и после очистки базы,
+    поэтому /stats можно обновлять хоть каждые несколько секунд.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.registered = 0
+        self.teams: Counter = Counter()      # Команда -> участников
+        self.completed: Counter = Counter()  # Номер блока -> сколько участников его завершили
+        self.expired: Counter = Counter()    # Номер блока -> сколько раз он закрыт по бездействию
+        self.poems_completed = 0
+        self.answer_times = Histogram()      # Секунды от вопроса до ответа (с момента запуска)
+
+    def load(self, conn: sqlite3.Connection, poem_index: Optional[int]):
+        """Начальные значения из базы"""
+        self._reset()
+        self.registered = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        for team, count in conn.execute("SELECT team, COUNT(*) FROM answers WHERE team != '' GROUP BY team"):
+            self.teams[team] = count
+        # current_block - следующий блок участника: все блоки до него завершены
+        for current_block, count in conn.execute("SELECT current_block, COUNT(*) FROM answers GROUP BY current_block"):
+            for block in range(current_block or 0):
+                self.completed[block] += count
+        if poem_index is not None:
+            self.poems_completed = conn.execute(
+                "SELECT COUNT(DISTINCT team) FROM team_poems WHERE status = 'completed'"
+            ).fetchone()[0]
+
+    def record_registration(self):
+        self.registered += 1
+
+    def record_team(self, old: Optional[str], new: str):
+        if old == new:
+            return
+        if old:
+            self.teams[old] -= 1
+        self.teams[new] += 1
+
+    def record_block(self, index: int, expired: bool = False):
+        self.completed[index] += 1
+        if expired:
+            self.expired[index] += 1
+
+    def record_answer(self, seconds: float):
+        self.answer_times.add(seconds)
+
+    def record_poem_completed(self, block_index: int, members: int):
+        self.poems_completed += 1
+        self.completed[block_index] += members
@@ -0,0 +1,120 @@
+import time
+from collections import OrderedDict
+from copy import copy
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+
+def user_state(bot: Bot, storage: BaseStorage, chat_id: int, user_id: int) -> FSMContext:
+    """
+    Состояние FSM пользователя вне обработчика апдейта (планировщик, стихотворение, восстановление).
+    Ключ совпадает с тем, который диспетчер строит для сообщений пользователя в этом чате.
+    """
+    return FSMContext(storage, StorageKey(bot_id=bot.id, chat_id=chat_id, user_id=user_id))
+
+
+class _Record:
+    __slots__ = ("state", "data", "touched_at")
+
+    def __init__(self):
+        self.state: Optional[str] = None
+        self.data: Dict[str, Any] = {}
+        self.touched_at = 0.0
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """
+    FSM-хранилище в памяти с ограниченным размером.
+
+    В отличие от MemoryStorage, чтение не создает записей, а запись без состояния
+    и данных (state.clear() после завершения сессии) сразу удаляется. Записи упорядочены
+    по последнему обращению: при превышении `max_entries` вытесняются самые давние,
+    а записи, к которым не обращались дольше `ttl` секунд, удаляются как брошенные.
+    """
+
+    def __init__(self, max_entries: int = 50000, ttl: float = 2 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._records: "OrderedDict[StorageKey, _Record]" = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __bool__(self) -> bool:
+        # Dispatcher подставляет MemoryStorage вместо "ложного" хранилища (storage or MemoryStorage())
+        return True
+
+    def _get(self, key: StorageKey) -> Optional[_Record]:
+        record = self._records.get(key)
+        if record is None:
+            return None
+        now = time.monotonic()
+        if now - record.touched_at > self.ttl:
+            del self._records[key]
+            self.evicted += 1
+            return None
+        record.touched_at = now
+        self._records.move_to_end(key)
+        return record
+
+    def _touch(self, key: StorageKey) -> _Record:
+        record = self._get(key)
+        if record is None:
+            record = self._records[key] = _Record()
+            record.touched_at = time.monotonic()
+            self._evict()
+        return record
+
+    def _evict(self):
+        # Самые давние записи - в начале: снимаем брошенные, затем лишние сверх лимита
+        deadline = time.monotonic() - self.ttl
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.touched_at >= deadline and len(self._records) <= self.max_entries:
+                break
+            del self._records[key]
+            self.evicted += 1
+
+    def _release_if_empty(self, key: StorageKey, record: _Record):
+        if record.state is None and not record.data:
+            self._records.pop(key, None)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        if state is None and key not in self._records:
+            return
+        record = self._touch(key)
+        record.state = state
+        self._release_if_empty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        if not data and key not in self._records:
+            return
+        record = self._touch(key)
+        record.data = data.copy()
+        self._release_if_empty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get(key)
+        return record.data.copy() if record else {}
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Optional[Any] = None) -> Optional[Any]:
+        record = self._get(storage_key)
+        if record is None:
+            return default
+        return copy(record.data.get(dict_key, default))
+
+    async def close(self) -> None:
+        self._records.clear()
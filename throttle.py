@@ -0,0 +1,117 @@
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from clock import Clock
+from outbox import Outbox
+
+logger = logging.getLogger("bot.throttle")
+
+WARNING_TEXT = "⏳ Вы отправляете сообщения слишком часто. Подождите немного - лишние сообщения не будут учтены."
+
+
+@dataclass(frozen=True)
+class Budget:
+    """
+    Бюджет маркерного ведра: `burst` апдейтов подряд, дальше `rate` в секунду.
+    Сверх бюджета еще `grace` апдейтов обрабатываются с предупреждением, остальные отбрасываются
+    """
+    rate: float
+    burst: float
+    grace: float
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated_at", "warned")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated_at = now
+        self.warned = False  # Предупреждение за текущий всплеск уже отправлено
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    """
+    Внешний middleware сообщений и нажатий кнопок: ограничение частоты апдейтов одного пользователя.
+
+    У каждого пользователя свое ведро. Команды и кнопки администратора
+    списываются с отдельного бюджета `admin`, поэтому его собственные ответы
+    в игре не мешают командам. Ведра упорядочены по последнему обращению;
+    сверх `max_buckets` вытесняются самые давние - вытесненное ведро начнется
+    заново полным, так что память постоянна, а активного спамера это не спасает.
+    Отброшенный апдейт не доходит до обработчиков и не стоит ни одного запроса к базе.
+    """
+
+    def __init__(self, outbox: Outbox, participant: Budget, admin: Budget, admin_id: int,
+                 max_buckets: int = 20000, clock: Optional[Clock] = None):
+        self.outbox = outbox
+        self.budgets = {False: participant, True: admin}
+        self.admin_id = admin_id
+        self.max_buckets = max_buckets
+        self.clock = clock or Clock()
+        self._buckets: "OrderedDict[Tuple[int, bool], _Bucket]" = OrderedDict()
+        self.warned = 0
+        self.dropped = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _is_admin_command(self, event: TelegramObject, user_id: int) -> bool:
+        if user_id != self.admin_id:
+            return False
+        if isinstance(event, CallbackQuery):
+            return True
+        text = event.text or event.caption  # Файл с командой в подписи (/import)
+        return bool(text and text.startswith("/"))
+
+    def _bucket(self, key: Tuple[int, bool], budget: Budget) -> _Bucket:
+        """Ведро пользователя с начисленными за прошедшее время маркерами"""
+        # Часы мероприятия: в ускоренной симуляции участники и лимит живут в одном времени
+        now = self.clock.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(budget.burst, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+            return bucket
+
+        self._buckets.move_to_end(key)
+        bucket.tokens = min(budget.burst, bucket.tokens + (now - bucket.updated_at) * budget.rate)
+        bucket.updated_at = now
+        if bucket.tokens >= 1:
+            bucket.warned = False
+        return bucket
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = event.from_user
+        if user is None:
+            return await handler(event, data)
+
+        admin = self._is_admin_command(event, user.id)
+        budget = self.budgets[admin]
+        bucket = self._bucket((user.id, admin), budget)
+        if bucket.tokens - 1 < -budget.grace:
+            # Маркеры не списываются - ведро продолжает наполняться, как только поток стихнет
+            self.dropped += 1
+            logger.debug("Апдейт пользователя %s отброшен: превышена частота", user.id)
+            return None
+
+        bucket.tokens -= 1
+        if bucket.tokens < 0 and not bucket.warned:
+            bucket.warned = True
+            self.warned += 1
+            chat_id = event.chat.id if isinstance(event, Message) else user.id
+            self.outbox.send(chat_id, WARNING_TEXT)
+            logger.warning("Пользователь %s превысил частоту апдейтов", user.id)
+        return await handler(event, data)